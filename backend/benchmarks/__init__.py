@@ -0,0 +1,3 @@
+"""
+Offline benchmark harness with local stand-ins for the Gemini clients
+"""
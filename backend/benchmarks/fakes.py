@@ -0,0 +1,157 @@
+"""
+Deterministic local stand-ins for the Gemini chat and embedding clients
+"""
+import asyncio
+import hashlib
+import math
+import re
+import time
+from typing import Any, AsyncIterator, ClassVar, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Simulated service latency in seconds, tweak before running a benchmark
+LATENCY = {
+    "llm": 0.4,          # time to first token of a chat completion
+    "token": 0.004,      # per streamed token
+    "embed": 0.06,       # per embedding request (single query or one batch)
+}
+ANSWER_TOKENS = 180
+EMBEDDING_DIM = 256
+
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _prompt_text(messages: List[BaseMessage]) -> str:
+    return "\n".join(str(message.content) for message in messages)
+
+
+def _fake_reply(prompt: str) -> str:
+    """Refiner prompts get the query back, answer prompts get a fixed-length answer"""
+    if "### Revised Query:" in prompt:
+        query = prompt.rsplit("### User's Query:", 1)[-1].split("### Revised Query:", 1)[0]
+        return "Can you explain " + " ".join(query.split()).rstrip("?") + "?"
+    seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    words = [seed[i % 60:i % 60 + 4] for i in range(ANSWER_TOKENS)]
+    return " ".join(words)
+
+
+def _usage(prompt: str, reply: str) -> dict:
+    input_tokens = max(1, len(prompt) // 4)
+    output_tokens = max(1, len(reply) // 4)
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens}
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model with ChatGoogleGenerativeAI's constructor arguments and configurable latency"""
+
+    model: str = "fake-gemini"
+    google_api_key: Optional[Any] = None
+    temperature: float = 0.0
+    calls: ClassVar[int] = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-gemini"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        FakeChatModel.calls += 1
+        prompt = _prompt_text(messages)
+        reply = _fake_reply(prompt)
+        time.sleep(LATENCY["llm"] + LATENCY["token"] * len(reply.split()))
+        message = AIMessage(content=reply, usage_metadata=_usage(prompt, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        FakeChatModel.calls += 1
+        prompt = _prompt_text(messages)
+        reply = _fake_reply(prompt)
+        await asyncio.sleep(LATENCY["llm"] + LATENCY["token"] * len(reply.split()))
+        message = AIMessage(content=reply, usage_metadata=_usage(prompt, reply))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        FakeChatModel.calls += 1
+        prompt = _prompt_text(messages)
+        reply = _fake_reply(prompt)
+        time.sleep(LATENCY["llm"])
+        words = reply.split()
+        for i, word in enumerate(words):
+            time.sleep(LATENCY["token"])
+            usage = _usage(prompt, reply) if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " ", usage_metadata=usage))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        FakeChatModel.calls += 1
+        prompt = _prompt_text(messages)
+        reply = _fake_reply(prompt)
+        await asyncio.sleep(LATENCY["llm"])
+        words = reply.split()
+        for i, word in enumerate(words):
+            await asyncio.sleep(LATENCY["token"])
+            usage = _usage(prompt, reply) if i == len(words) - 1 else None
+            yield ChatGenerationChunk(message=AIMessageChunk(content=word + " ", usage_metadata=usage))
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words vectors: texts sharing words get similar embeddings"""
+
+    calls = 0
+
+    def __init__(self, model: str = "fake-embedding", google_api_key: Any = None, **kwargs: Any):
+        self.model = model
+
+    @staticmethod
+    def _vector(text: str) -> List[float]:
+        vector = [0.0] * EMBEDDING_DIM
+        for word in WORD_RE.findall(text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % EMBEDDING_DIM
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str], *args: Any, **kwargs: Any) -> List[List[float]]:
+        FakeEmbeddings.calls += 1
+        time.sleep(LATENCY["embed"])
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str, *args: Any, **kwargs: Any) -> List[float]:
+        FakeEmbeddings.calls += 1
+        time.sleep(LATENCY["embed"])
+        return self._vector(text)
+
+    async def aembed_documents(self, texts: List[str], *args: Any, **kwargs: Any) -> List[List[float]]:
+        FakeEmbeddings.calls += 1
+        await asyncio.sleep(LATENCY["embed"])
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str, *args: Any, **kwargs: Any) -> List[float]:
+        FakeEmbeddings.calls += 1
+        await asyncio.sleep(LATENCY["embed"])
+        return self._vector(text)
+
+
+def install_fakes(llm_latency: Optional[float] = None, token_latency: Optional[float] = None,
+                  embed_latency: Optional[float] = None):
+    """Swap the Gemini clients for the fakes. Call before importing any ``components`` module."""
+    import langchain_google_genai
+
+    if llm_latency is not None:
+        LATENCY["llm"] = llm_latency
+    if token_latency is not None:
+        LATENCY["token"] = token_latency
+    if embed_latency is not None:
+        LATENCY["embed"] = embed_latency
+    langchain_google_genai.ChatGoogleGenerativeAI = FakeChatModel
+    langchain_google_genai.GoogleGenerativeAIEmbeddings = FakeEmbeddings
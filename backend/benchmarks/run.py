@@ -0,0 +1,259 @@
+"""
+Offline benchmarks for the ask and ingest pipelines.
+
+Gemini is replaced by the local fakes in ``benchmarks.fakes``, so results only
+reflect the code in this repository plus the simulated service latency. Run
+from the backend directory:
+
+    python -m benchmarks.run --clients 16 --requests 200 --json results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from benchmarks.fakes import LATENCY, FakeChatModel, FakeEmbeddings, install_fakes
+from benchmarks.synthetic_pdfs import TOPICS, generate_corpus
+
+QUESTION_TEMPLATES = [
+    "what is {}", "explain {}", "how does {} work", "give an example of {}",
+    "difference between {} and {}", "why is {} important for exams",
+]
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(1, int(round(p / 100.0 * len(ordered) + 0.5)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def summarize(name: str, latencies: List[float], wall_time: float, **extra) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "throughput_per_s": round(len(latencies) / wall_time, 2) if wall_time else 0.0,
+        "wall_s": round(wall_time, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        **extra,
+    }
+
+
+def print_result(result: Dict[str, Any]):
+    extra = {k: v for k, v in result.items()
+             if k not in ("name", "count", "p50_ms", "p95_ms", "p99_ms", "throughput_per_s", "wall_s", "peak_rss_mb")}
+    print(f"{result['name']:<28} n={result['count']:<5} p50={result['p50_ms']:>9.2f}ms "
+          f"p95={result['p95_ms']:>9.2f}ms p99={result['p99_ms']:>9.2f}ms "
+          f"{result['throughput_per_s']:>8.2f}/s rss={result['peak_rss_mb']:.1f}MB")
+    if extra:
+        print(" " * 30 + json.dumps(extra))
+
+
+def make_questions(n: int, seed: int, unique: bool = False) -> List[str]:
+    """Syllabus questions; with unique=False they repeat like real traffic does"""
+    rng = random.Random(seed)
+    vocabulary = [term for terms in TOPICS.values() for term in terms]
+    questions = []
+    for i in range(n):
+        template = rng.choice(QUESTION_TEMPLATES)
+        question = template.format(*rng.sample(vocabulary, template.count("{}")))
+        questions.append(f"{question} (variant {i})" if unique else question)
+    return questions
+
+
+def timed_calls(fn: Callable[[str], Any], inputs: List[str]) -> List[float]:
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def bench_refine(n: int, seed: int) -> List[Dict[str, Any]]:
+    from components.query_refine import get_refine_cache_stats, refine_cache, refine_user_query
+
+    refine_cache.clear()
+    cold = make_questions(n, seed, unique=True)
+    start = time.perf_counter()
+    cold_latencies = timed_calls(refine_user_query, cold)
+    cold_wall = time.perf_counter() - start
+
+    start = time.perf_counter()
+    warm_latencies = timed_calls(refine_user_query, cold)
+    warm_wall = time.perf_counter() - start
+    return [
+        summarize("refine_user_query (cold)", cold_latencies, cold_wall),
+        summarize("refine_user_query (warm)", warm_latencies, warm_wall, cache=get_refine_cache_stats()),
+    ]
+
+
+def bench_ingest(workdir: str, n_files: int, pages: int, seed: int) -> Dict[str, Any]:
+    from components.vectordb_builder import IngestStats, process_pdf_directory
+
+    pdf_dir = os.path.join(workdir, "corpus")
+    persist_dir = os.path.join(workdir, "chroma_db")
+    generate_corpus(pdf_dir, n_files=n_files, pages_per_file=pages, seed=seed)
+    stats = IngestStats()
+    embed_calls = FakeEmbeddings.calls
+    start = time.perf_counter()
+    process_pdf_directory(pdf_dir, persist_dir, os.path.join(workdir, "processed_files.pkl"), stats=stats)
+    wall = time.perf_counter() - start
+    report = stats.as_dict()
+    # One sample per file would hide the pipeline overlap, report the run as a whole
+    return summarize("process_pdf_directory", [wall], wall,
+                     files=report.get("files_done"), chunks=report.get("chunks_added"),
+                     chunks_per_s=round((report.get("chunks_added") or 0) / wall, 1) if wall else 0.0,
+                     embed_calls=FakeEmbeddings.calls - embed_calls)
+
+
+def bench_answer(persist_dir: str, n: int, clients: int, seed: int) -> List[Dict[str, Any]]:
+    from components.qa_utils import aanswer_question, answer_question, create_qa_chain
+    from components.lexical_index import load_or_build_lexical_index
+    from components.vector_backends import load_vector_backend
+
+    vectorstore = load_vector_backend(persist_dir)
+    lexical_index = load_or_build_lexical_index(persist_dir, vectorstore)
+    qa_chain = create_qa_chain(vectorstore)
+    questions = make_questions(n, seed + 1)
+
+    sequential = questions[: max(1, n // 4)]
+    start = time.perf_counter()
+    seq_latencies = timed_calls(
+        lambda q: answer_question(qa_chain, q, vectorstore=vectorstore, lexical_index=lexical_index), sequential)
+    seq_wall = time.perf_counter() - start
+
+    async def run_concurrent():
+        latencies: List[float] = []
+        queue: asyncio.Queue = asyncio.Queue()
+        for question in questions:
+            queue.put_nowait(question)
+
+        async def client():
+            while not queue.empty():
+                question = queue.get_nowait()
+                begin = time.perf_counter()
+                await aanswer_question(qa_chain, question, vectorstore=vectorstore, lexical_index=lexical_index)
+                latencies.append(time.perf_counter() - begin)
+
+        begin = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        return latencies, time.perf_counter() - begin
+
+    llm_calls = FakeChatModel.calls
+    conc_latencies, conc_wall = asyncio.run(run_concurrent())
+    return [
+        summarize("answer_question", seq_latencies, seq_wall),
+        summarize(f"aanswer_question x{clients}", conc_latencies, conc_wall, llm_calls=FakeChatModel.calls - llm_calls),
+    ]
+
+
+def bench_endpoint(persist_dir: str, n: int, clients: int, seed: int) -> Dict[str, Any]:
+    try:
+        import httpx
+    except ImportError:
+        return {"name": "/ask", "skipped": "httpx is not installed"}
+    from components import chatbot_api
+    from components.index_snapshot import SnapshotManager
+
+    chatbot_api.snapshots = SnapshotManager(persist_dir)
+    chatbot_api.snapshots.publish(chatbot_api.open_snapshot(0, persist_dir))
+    questions = make_questions(n, seed + 2)
+
+    async def run():
+        latencies: List[float] = []
+        errors = 0
+        queue: asyncio.Queue = asyncio.Queue()
+        for question in questions:
+            queue.put_nowait(question)
+        transport = httpx.ASGITransport(app=chatbot_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+            async def client():
+                nonlocal errors
+                while not queue.empty():
+                    question = queue.get_nowait()
+                    begin = time.perf_counter()
+                    response = await http.post("/ask", data={"question": question})
+                    latencies.append(time.perf_counter() - begin)
+                    errors += response.status_code != 200
+
+            begin = time.perf_counter()
+            await asyncio.gather(*(client() for _ in range(clients)))
+            return latencies, time.perf_counter() - begin, errors
+
+    latencies, wall, errors = asyncio.run(run())
+    return summarize(f"POST /ask x{clients}", latencies, wall, errors=errors,
+                     answer_cache=chatbot_api.get_answer_cache().stats())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=100, help="questions per answer/endpoint benchmark")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--files", type=int, default=20, help="synthetic PDFs to ingest")
+    parser.add_argument("--pages", type=int, default=8, help="pages per synthetic PDF")
+    parser.add_argument("--llm-latency", type=float, default=None, help="seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=None, help="seconds per generated token")
+    parser.add_argument("--embed-latency", type=float, default=None, help="seconds per embedding request")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--only", nargs="*", choices=["refine", "ingest", "answer", "endpoint"],
+                        help="run a subset of the benchmarks")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    selected = set(args.only or ["refine", "ingest", "answer", "endpoint"])
+
+    install_fakes(args.llm_latency, args.token_latency, args.embed_latency)
+
+    workdir = tempfile.mkdtemp(prefix="prepbot-bench-")
+    # Keep every artifact (embedding and parse caches, manifests, uploads) out of the real tree
+    os.environ.setdefault("EMBEDDING_CACHE_DIR", os.path.join(workdir, "embedding_cache"))
+    # Ingest timings must measure parsing, not loads of pages cached by an earlier run
+    os.environ.setdefault("PARSE_CACHE_DIR", os.path.join(workdir, "parse_cache"))
+    os.chdir(workdir)
+    persist_dir = os.path.join(workdir, "chroma_db")
+
+    results = []
+    if "refine" in selected:
+        results.extend(bench_refine(max(10, args.requests // 2), args.seed))
+    if selected & {"ingest", "answer", "endpoint"}:
+        # The answer benchmarks need an index, so ingestion always runs before them
+        ingest = bench_ingest(workdir, args.files, args.pages, args.seed)
+        if "ingest" in selected:
+            results.append(ingest)
+    if "answer" in selected:
+        results.extend(bench_answer(persist_dir, args.requests, args.clients, args.seed))
+    if "endpoint" in selected:
+        results.append(bench_endpoint(persist_dir, args.requests, args.clients, args.seed))
+
+    print(f"workdir: {workdir}")
+    for result in results:
+        if "skipped" in result:
+            print(f"{result['name']:<28} skipped: {result['skipped']}")
+        else:
+            print_result(result)
+    if json_path:
+        payload = {"latency": LATENCY, "results": results}
+        with open(json_path, "w") as f:
+            json.dump(payload, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
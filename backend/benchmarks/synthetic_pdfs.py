@@ -0,0 +1,75 @@
+"""
+Generate a deterministic corpus of small text PDFs for ingestion benchmarks
+"""
+import os
+import random
+from typing import List
+
+TOPICS = {
+    "Maths": ["mean", "median", "variance", "standard deviation", "correlation", "conditional probability",
+              "Bayes theorem", "binomial distribution", "Poisson distribution", "normal distribution",
+              "hypothesis testing", "confidence interval", "estimation", "z-test", "sampling"],
+    "js": ["HTML elements", "CSS selectors", "DOM manipulation", "JavaScript closures", "promises",
+           "async await", "React components", "props", "state", "useEffect cleanup", "hooks",
+           "HTTP methods", "fetch API", "JSON data", "event listeners"],
+    "dsa": ["arrays", "linked lists", "stacks", "queues", "binary trees", "graphs", "breadth-first search",
+            "depth-first search", "merge sort", "quick sort", "binary search", "recursion",
+            "dynamic programming", "memoization", "time complexity"],
+}
+VERBS = ["explains", "describes", "is used for", "helps with", "is related to", "depends on", "is an example of"]
+FILLER = ["in practice", "for exam questions", "with a worked example", "step by step", "in most textbooks",
+          "when solving problems", "for the semester syllabus"]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a minimal PDF with one Helvetica text block per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for lines in pages:
+        stream = "BT /F1 10 Tf 14 TL 50 780 Td " + " ".join(f"({_escape(line)}) Tj T*" for line in lines) + " ET"
+        stream_bytes = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream_bytes) + stream_bytes + b"\nendstream")
+        content_ref = len(objects)
+        objects.append(("<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                        f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_ref} 0 R >>").encode())
+        page_refs.append(len(objects))
+    kids = " ".join(f"{ref} 0 R" for ref in page_refs)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_refs)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def _sentence(rng: random.Random, subject: str) -> str:
+    first, second = rng.sample(TOPICS[subject], 2)
+    return f"{first.capitalize()} {rng.choice(VERBS)} {second} {rng.choice(FILLER)}."
+
+
+def generate_corpus(directory: str, n_files: int = 20, pages_per_file: int = 8, lines_per_page: int = 45,
+                    seed: int = 7) -> List[str]:
+    """Write n_files PDFs cycling through the three subjects and return their paths"""
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    subjects = list(TOPICS)
+    paths = []
+    for i in range(n_files):
+        subject = subjects[i % len(subjects)]
+        pages = [[_sentence(rng, subject) for _ in range(lines_per_page)] for _ in range(pages_per_file)]
+        path = os.path.join(directory, f"{subject}-{i + 1}.pdf")
+        write_pdf(path, pages)
+        paths.append(path)
+    return paths
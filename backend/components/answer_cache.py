@@ -0,0 +1,178 @@
+"""
+Semantic answer cache that sits in front of the LLM answer chain
+"""
+import hashlib
+import os
+import pickle
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from components.cache_utils import LRUTTLCache
+
+
+class SemanticAnswerCache:
+    """Cache answers keyed on the embedding of the refined query.
+
+    A lookup returns the stored answer of the most similar cached query when
+    their cosine similarity is at least ``threshold``. Answers stored without
+    a vector (the lexical fast path never embeds the query) are only found by
+    ``lookup_query`` on the same normalized text. Entries are bounded by
+    ``maxsize`` (LRU) and ``ttl`` seconds, and the whole cache is dropped when
+    the index it was built against changes. Answers are tagged with that index
+    version; one computed against an older index is not stored. Changes are
+    written to ``persist_path`` at most every ``save_delay`` seconds, from a
+    background thread.
+    """
+
+    def __init__(self, maxsize: int = 512, ttl: Optional[float] = 6 * 3600,
+                 threshold: float = 0.92, persist_path: Optional[str] = None,
+                 index_version: Optional[str] = None, save_delay: float = 5.0):
+        self.threshold = threshold
+        self.persist_path = persist_path
+        self.index_version = index_version
+        self.save_delay = save_delay
+        self._entries = LRUTTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._save_timer: Optional[threading.Timer] = None
+        self._timer_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.stale_stores = 0
+        if persist_path:
+            self._load()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    @staticmethod
+    def _key(query: str) -> str:
+        return hashlib.sha256(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    def lookup(self, query_vector) -> Optional[Dict[str, Any]]:
+        """Return the cached answer for the closest query above the threshold"""
+        entries = [(key, entry) for key, entry in self._entries.items()
+                   if entry["vector"] is not None and entry.get("index_version") == self.index_version]
+        if entries:
+            keys = [key for key, _ in entries]
+            matrix = np.stack([entry["vector"] for _, entry in entries])
+            scores = matrix @ self._normalize(query_vector)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.threshold:
+                entry = self._entries.get(keys[best])
+                if entry is not None:
+                    self.hits += 1
+                    return dict(entry["answer"])
+        self.misses += 1
+        return None
+
+    def lookup_query(self, query: str) -> Optional[Dict[str, Any]]:
+        """Return the cached answer for the same refined query, ignoring case and whitespace"""
+        entry = self._entries.get(self._key(query))
+        if entry is None or entry.get("index_version") != self.index_version:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(entry["answer"])
+
+    def store(self, query: str, query_vector, answer: Dict[str, Any], index_version: Optional[str] = None):
+        """Remember the answer produced for a refined query; query_vector may be None.
+
+        index_version is the version of the index the answer was retrieved
+        from (default: the cache's). The answer is dropped if the cache was
+        invalidated for another index meanwhile.
+        """
+        if index_version is not None and index_version != self.index_version:
+            self.stale_stores += 1
+            return
+        self._entries.set(self._key(query), {
+            "query": query,
+            "vector": self._normalize(query_vector) if query_vector is not None else None,
+            "answer": dict(answer),
+            "index_version": self.index_version,
+        })
+        self._schedule_save()
+
+    def invalidate(self, index_version: Optional[str] = None):
+        """Drop every cached answer, e.g. after the vector store changed"""
+        self._entries.clear()
+        self.index_version = index_version
+        self.invalidations += 1
+        self._schedule_save()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self._entries.maxsize,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self._entries.evictions,
+            "invalidations": self.invalidations,
+            "stale_stores": self.stale_stores,
+        }
+
+    def _schedule_save(self):
+        """Save after save_delay seconds, once for every change made meanwhile"""
+        if not self.persist_path:
+            return
+        with self._timer_lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_delay, self._scheduled_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def _scheduled_save(self):
+        with self._timer_lock:
+            self._save_timer = None
+        self.save()
+
+    def flush(self):
+        """Write a pending change now, e.g. on shutdown"""
+        with self._timer_lock:
+            timer, self._save_timer = self._save_timer, None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def save(self):
+        """Write the cache to ``persist_path`` if persistence is enabled"""
+        if not self.persist_path:
+            return
+        payload = {"index_version": self.index_version, "entries": self._entries.dump()}
+        tmp_path = f"{self.persist_path}.tmp"
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.persist_path) or ".", exist_ok=True)
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(payload, f)
+                os.replace(tmp_path, self.persist_path)
+            except OSError as e:
+                print("[WARN] Failed to persist answer cache:", e)
+
+    def _load(self):
+        if not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "rb") as f:
+                payload = pickle.load(f)
+        except Exception as e:
+            print("[WARN] Ignoring unreadable answer cache:", e)
+            return
+        if payload.get("index_version") != self.index_version:
+            # Answers were produced against a different index
+            return
+        entries: List = payload.get("entries", [])
+        for key, value, stored_at in entries:
+            value.setdefault("index_version", self.index_version)
+            self._entries.set(key, value, stored_at=stored_at)
+        # Loading is not a lookup, keep the counters clean
+        self._entries.hits = self._entries.misses = self._entries.evictions = 0
@@ -0,0 +1,106 @@
+"""
+Small in-memory caches shared by the chatbot components
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class LRUTTLCache:
+    """Thread-safe LRU cache with an optional time-to-live for every entry.
+
+    ``on_evict(key, value)`` is called for entries pushed out by the size
+    limit (not for expired ones), e.g. to spill them to disk.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        if maxsize <= 0:
+            raise ValueError("maxsize must be positive")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._data: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _expired(self, stored_at: float, now: float) -> bool:
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the value for key and mark it as recently used"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, stored_at = entry
+            if self._expired(stored_at, time.time()):
+                del self._data[key]
+                self.evictions += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, stored_at: Optional[float] = None):
+        """Insert or replace a value, evicting the least recently used entry if full"""
+        evicted = []
+        with self._lock:
+            self._data[key] = (value, stored_at if stored_at is not None else time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                evicted_key, (evicted_value, _) = self._data.popitem(last=False)
+                evicted.append((evicted_key, evicted_value))
+                self.evictions += 1
+        if self.on_evict is not None:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Live (key, value) pairs, oldest first. Expired entries are dropped."""
+        with self._lock:
+            self._purge_expired()
+            return [(key, value) for key, (value, _) in self._data.items()]
+
+    def dump(self) -> List[Tuple[Hashable, Any, float]]:
+        """Live entries with their insertion time, for persisting to disk"""
+        with self._lock:
+            self._purge_expired()
+            return [(key, value, stored_at) for key, (value, stored_at) in self._data.items()]
+
+    def _purge_expired(self):
+        if self.ttl is None:
+            return
+        now = time.time()
+        for key in [k for k, (_, stored_at) in self._data.items() if self._expired(stored_at, now)]:
+            del self._data[key]
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
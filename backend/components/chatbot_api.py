@@ -1,18 +1,39 @@
 """
 FastAPI server for the university chatbot
 """
-from fastapi import FastAPI, UploadFile, File, Form, BackgroundTasks
+import time
+
+# Everything below counts towards the app's import time
+APP_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, UploadFile, File, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import uvicorn
 
+import asyncio
+import json
 import os
-import shutil
+import threading
 import uuid
-from typing import List
+import zipfile
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
 
-from components.qa_utils import create_qa_chain, answer_question, load_vector_db_from_persist_dir
-from components.vectordb_builder import process_pdf_directory
+# Only light modules here; the LangChain/GenAI/Chroma stack is imported by lazy_import()
+from components.answer_cache import SemanticAnswerCache
+from components.index_snapshot import IndexSnapshot, SnapshotManager, manifest_path
+from components.ingest_jobs import IngestJobQueue
+from components.lazy import import_all, import_timings, imported, lazy_import
+from components.metrics import HTTP_REQUEST_SECONDS, current_trace, registry, render_metrics, server_timing, trace
+from components.sessions import SessionStore
+from components.single_flight import SingleFlight
+from components.uploads import (BULK_UPLOAD_MAX_BYTES, BULK_UPLOAD_MAX_FILES, UPLOAD_MAX_BYTES, UploadDeduplicator,
+                                UploadTooLarge, stored_name, stream_to_file, zip_members)
+
+# Settings below may come from .env
+load_dotenv()
 
 
 # Create the FastAPI app
@@ -34,17 +55,83 @@ DOCUMENTS_DIR = "documents"
 # PRESIST_DIR = "/Users/mayankgupta/Desktop/Project/ExamBot/backend/artifacts/chroma_db"
 os.makedirs(DOCUMENTS_DIR, exist_ok=True)
 
+# Semantic answer cache (set ANSWER_CACHE_PATH to persist it across restarts)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH") or None
+# Send each request's stage breakdown back in a Server-Timing header
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "true").lower() in ("1", "true", "yes")
+# Identical questions asked while the first is still being answered wait for its answer
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "true").lower() in ("1", "true", "yes")
+# After the index loads, run one embedding and one vector search so the first user does not pay for them
+INDEX_WARMUP = os.getenv("INDEX_WARMUP", "false").lower() in ("1", "true", "yes")
+INDEX_WARMUP_QUERY = os.getenv("INDEX_WARMUP_QUERY", "What topics does the syllabus cover?")
+
+# Imported in the background after startup, in this order (each includes what it pulls in first)
+HEAVY_COMPONENTS = ("embedding_cache", "vector_backends", "lexical_index", "query_refine", "qa_utils",
+                    "vectordb_builder")
+
+
+# The serving path only reads the published snapshot, ingestion builds the next one
+snapshots = SnapshotManager(PRESIST_DIR)
+_answer_cache: Optional[SemanticAnswerCache] = None
+_answer_cache_lock = threading.Lock()
+
+# Cold start breakdown in milliseconds, filled in as the phases finish
+startup_timings: Dict[str, float] = {}
+# index: pending -> loading -> loaded | missing | failed; warmup: disabled | pending -> skipped | running -> done | failed
+startup_state = {"index": "pending", "warmup": "pending" if INDEX_WARMUP else "disabled"}
+index_task: Optional[asyncio.Task] = None
+warmup_task: Optional[asyncio.Task] = None
+
+
+def _ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 1)
 
-vectorstore = None
-qa_chain = None
+
+def get_answer_cache() -> SemanticAnswerCache:
+    """The semantic answer cache, created once the index fingerprint can be computed"""
+    global _answer_cache
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            get_index_version = lazy_import("vectordb_builder").get_index_version
+            _answer_cache = SemanticAnswerCache(
+                maxsize=ANSWER_CACHE_SIZE,
+                ttl=ANSWER_CACHE_TTL,
+                threshold=ANSWER_CACHE_THRESHOLD,
+                persist_path=ANSWER_CACHE_PATH,
+                index_version=get_index_version(snapshots.index_manifest()),
+            )
+        return _answer_cache
+
+
+def open_snapshot(version: int, persist_dir: str, refresh: bool = False) -> IndexSnapshot:
+    """Load the vector store, BM25 index and QA chain of a snapshot directory"""
+    vectorstore = lazy_import("vector_backends").load_vector_backend(persist_dir, refresh=refresh)
+    lexical_index = lazy_import("lexical_index").load_or_build_lexical_index(persist_dir, vectorstore)
+    get_index_version = lazy_import("vectordb_builder").get_index_version
+    return IndexSnapshot(
+        version,
+        persist_dir,
+        vectorstore,
+        lazy_import("qa_utils").create_qa_chain(vectorstore),
+        lexical_index,
+        index_version=get_index_version(snapshots.index_manifest(persist_dir)),
+    )
 
 
 async def load_db_and_chain():
-    global vectorstore, qa_chain, search_tool
     try:
-        if os.path.exists(PRESIST_DIR):
-            vectorstore = load_vector_db_from_persist_dir(PRESIST_DIR)
-            qa_chain = create_qa_chain(vectorstore)
+        persist_dir = snapshots.current_dir()
+        if os.path.exists(persist_dir):
+            # Opening Chroma touches sqlite, keep it off the event loop
+            snapshot = await asyncio.to_thread(open_snapshot, snapshots.current_version(), persist_dir)
+            if not snapshots.publish(snapshot):
+                # An ingest published a newer version while this one was loading
+                print(f"[INFO] Loaded index v{snapshot.version} superseded by v{snapshots.current().version}")
+                await asyncio.to_thread(snapshots.discard, snapshot.persist_dir, snapshot)
+            await asyncio.to_thread(snapshots.cleanup_stale)
             return True
         else:
             return False
@@ -53,27 +140,333 @@ async def load_db_and_chain():
         return False
 
 
-# Try to load the vector database on startup
+async def load_index_in_background():
+    """Import the LangChain stack and open the index while the server already answers requests"""
+    global warmup_task
+    startup_state["index"] = "loading"
+    started = time.perf_counter()
+    try:
+        # Imports and opening Chroma block, keep them off the event loop
+        await asyncio.to_thread(import_all, HEAVY_COMPONENTS)
+        await asyncio.to_thread(get_answer_cache)
+    except Exception as e:
+        print("[ERROR] Failed to import the chatbot components:", e)
+        startup_state["index"] = "failed"
+        return
+    startup_timings["imports"] = _ms(started)
+    loading = time.perf_counter()
+    loaded = await load_db_and_chain()
+    startup_timings["index_load"] = _ms(loading)
+    if loaded:
+        startup_state["index"] = "loaded"
+    else:
+        startup_state["index"] = "failed" if os.path.exists(snapshots.current_dir()) else "missing"
+    if loaded and INDEX_WARMUP:
+        # Requests waiting for the index need not wait for the warm-up too
+        warmup_task = asyncio.create_task(warm_up())
+    else:
+        if startup_state["warmup"] == "pending":
+            # Nothing to warm up
+            startup_state["warmup"] = "skipped"
+        _mark_ready()
+
+
+def _mark_ready():
+    startup_timings["ready"] = _ms(APP_IMPORT_STARTED)
+    print(f"[INFO] Index {startup_state['index']}, ready {startup_timings['ready']} ms after import:", startup_timings)
+
+
+async def warm_up():
+    """Pay for the first query embedding and vector search before a user does"""
+    startup_state["warmup"] = "running"
+    try:
+        with snapshots.acquire() as snapshot:
+            started = time.perf_counter()
+            vector = await lazy_import("embedding_cache").get_embeddings().aembed_query(INDEX_WARMUP_QUERY)
+            startup_timings["warmup_embed"] = _ms(started)
+            started = time.perf_counter()
+            await asyncio.to_thread(snapshot.vectorstore.similarity_search_by_vector, vector, k=1)
+            startup_timings["warmup_retrieve"] = _ms(started)
+        startup_state["warmup"] = "done"
+    except Exception as e:
+        print("[WARN] Index warm-up failed:", e)
+        startup_state["warmup"] = "failed"
+    _mark_ready()
+
+
+async def ensure_index_loaded() -> bool:
+    """Wait for the background load if it is still running, otherwise try loading now"""
+    if snapshots.current() is None and index_task is not None and not index_task.done():
+        await asyncio.shield(index_task)
+    if snapshots.current() is None:
+        return await load_db_and_chain()
+    return True
+
+
+# Start serving right away and load the vector database in the background
 @app.on_event("startup")
 async def startup_event():
-    await load_db_and_chain()
+    global index_task
+    startup_timings.setdefault("startup_event", _ms(APP_IMPORT_STARTED))
+    index_task = asyncio.create_task(load_index_in_background())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # The answer cache saves on a timer, write what changed since the last save
+    if _answer_cache is not None:
+        await asyncio.to_thread(_answer_cache.flush)
+
+# Runs on the ingestion worker: only ever one batch at a time
+def process_uploaded_documents(new_files: Optional[List[str]], rebuild_shards: Optional[List[str]] = None):
+    """Index the given files, or rescan the whole documents directory if None,
+    then rebuild the given subject shards.
+
+    Ingestion writes to a copy of the current index; the copy is published as
+    the new snapshot only once it is complete, so readers never see a
+    half-updated store.
+    """
+    builder = lazy_import("vectordb_builder")
+    stats = builder.IngestStats()
+    current = snapshots.current()
+    version, staging_dir = snapshots.stage(current.persist_dir if current else None)
+    try:
+        updated_store = None
+        if new_files is None:
+            updated_store = builder.process_pdf_directory(DOCUMENTS_DIR, staging_dir, manifest_path(staging_dir),
+                                                          stats=stats)
+        elif new_files:
+            updated_store = builder.process_pdf_files(new_files, staging_dir, manifest_path(staging_dir), stats=stats)
+        if rebuild_shards:
+            updated_store = builder.rebuild_shards(rebuild_shards, staging_dir, manifest_path(staging_dir),
+                                                   stats=stats)
+        if not updated_store:
+            # Nothing changed, keep serving the current snapshot
+            snapshots.discard(staging_dir)
+            return stats
+        snapshot = open_snapshot(version, staging_dir, refresh=True)
+    except Exception:
+        snapshots.discard(staging_dir)
+        raise
+    if not snapshots.publish(snapshot):
+        snapshots.discard(staging_dir, snapshot)
+        return stats
+    get_answer_cache().invalidate(snapshot.index_version)
+    return stats
+
+flights = SingleFlight()
+sessions = SessionStore()
+
+def _flight_key(question: str):
+    """Questions coalesce when they normalize the same and would hit the same index"""
+    current = snapshots.current()
+    return lazy_import("query_refine").normalize_query(question), current.index_version if current else None
+
+def _job_finished(job):
+    uploads.job_finished(job.id, job.failed_files)
+
+ingest_queue = IngestJobQueue(
+    process_uploaded_documents,
+    coalesce_window=float(os.getenv("INGEST_COALESCE_WINDOW", "1.0")),
+    on_finished=_job_finished,
+)
+
+def _indexed_documents():
+    """Content hash -> path of every document in the published index"""
+    builder = lazy_import("vectordb_builder")
+    current = snapshots.current()
+    processed = builder.load_processed_files_info(snapshots.index_manifest(current.persist_dir if current else None))
+    return {builder.entry_hash(entry): path for path, entry in processed.items() if os.path.exists(path)}
+
+def _job_pending(job_id: str) -> bool:
+    job = ingest_queue.get(job_id)
+    return job is not None and job.status in ("queued", "running")
+
+uploads = UploadDeduplicator(_indexed_documents, _job_pending)
+# Request bodies above these sizes are refused before they are read (multipart framing on top of the file)
+UPLOAD_BODY_LIMITS = {"/upload": UPLOAD_MAX_BYTES + 64 * 1024, "/upload/bulk": BULK_UPLOAD_MAX_BYTES}
+
+def _index_chunks(vectorstore) -> int:
+    """Number of chunks in a Chroma collection, matrix store or sharded store"""
+    if hasattr(vectorstore, "_collection"):
+        return vectorstore._collection.count()
+    return len(vectorstore)
+
+def _loaded_embeddings():
+    """The shared embeddings, or None while embedding_cache is still being imported"""
+    embedding_cache = imported("embedding_cache")
+    return embedding_cache.get_embeddings() if embedding_cache else None
 
-# Background task to process uploaded documents
-def process_uploaded_documents(new_files: List[str]):
-    global vectorstore, qa_chain
-    vectorstore = process_pdf_directory(DOCUMENTS_DIR, PRESIST_DIR)
-    if vectorstore:
-        qa_chain = create_qa_chain(vectorstore)
+def collect_service_metrics():
+    """Gauges and cache counters read from the live objects at scrape time.
+
+    Components that are still being imported after a cold start are skipped.
+    """
+    samples = []
+    for phase, ms in startup_timings.items():
+        samples.append(("prepbot_startup_seconds", "gauge", "Time spent in each cold start phase",
+                        {"phase": phase}, ms / 1000))
+    for name, ms in import_timings.items():
+        samples.append(("prepbot_import_seconds", "gauge", "Time spent importing each heavy component",
+                        {"component": name}, ms / 1000))
+    query_refine = imported("query_refine")
+    qa_utils = imported("qa_utils")
+    embeddings = _loaded_embeddings()
+    caches = {}
+    if _answer_cache is not None:
+        caches["answer"] = _answer_cache.stats()
+    if query_refine is not None:
+        caches["refine"] = query_refine.get_refine_cache_stats()
+    if embeddings is not None:
+        caches["embedding"] = embeddings.store.stats()
+    for name, stats in caches.items():
+        labels = {"cache": name}
+        samples.append(("prepbot_cache_entries", "gauge", "Entries held by each cache", labels, stats["size"]))
+        samples.append(("prepbot_cache_hits_total", "counter", "Cache lookups that hit", labels, stats["hits"]))
+        samples.append(("prepbot_cache_misses_total", "counter", "Cache lookups that missed", labels, stats["misses"]))
+        samples.append(("prepbot_cache_evictions_total", "counter", "Entries evicted for space", labels,
+                        stats.get("evictions", 0)))
+    for route, count in caches.get("refine", {}).get("pre_refine", {}).items():
+        if route != "skip_rate":
+            samples.append(("prepbot_refine_route_total", "counter",
+                            "Refinements handled locally, refused as off-topic, or sent to the LLM",
+                            {"route": route}, count))
+    if embeddings is not None:
+        batcher = embeddings.query_batcher.stats()
+        samples.append(("prepbot_query_embed_requests_total", "counter",
+                        "Query embeddings requested through the batcher", {}, batcher["requests"]))
+        samples.append(("prepbot_query_embed_batches_total", "counter", "Batched query embedding calls sent",
+                        {}, batcher["batches"]))
+    current = snapshots.current()
+    if current is not None:
+        samples.append(("prepbot_index_chunks", "gauge", "Chunks in the published index", {"index": "vector"},
+                        _index_chunks(current.vectorstore)))
+        if current.lexical_index is not None:
+            samples.append(("prepbot_index_chunks", "gauge", "Chunks in the published index", {"index": "lexical"},
+                            len(current.lexical_index)))
+        for shard, size in getattr(current.vectorstore, "sizes", {}).items():
+            samples.append(("prepbot_shard_chunks", "gauge", "Chunks in each subject shard of the published index",
+                            {"shard": shard}, size))
+        samples.append(("prepbot_snapshot_version", "gauge", "Version of the published index snapshot", {},
+                        current.version))
+        samples.append(("prepbot_snapshot_readers", "gauge", "Requests pinning the published snapshot", {},
+                        current.refs))
+    subject_shards = imported("subject_shards")
+    if subject_shards is not None:
+        for shard, count in subject_shards.get_shard_stats()["routed"].items():
+            samples.append(("prepbot_shard_routes_total", "counter", "Searches routed to each subject shard",
+                            {"shard": shard}, count))
+    if qa_utils is not None:
+        for path, count in qa_utils.get_retrieval_stats().items():
+            samples.append(("prepbot_retrieval_total", "counter", "Retrievals by path", {"path": path}, count))
+        for outcome, count in qa_utils.get_speculation_stats().items():
+            if outcome != "reuse_rate":
+                samples.append(("prepbot_speculation_total", "counter", "Speculative searches by outcome",
+                                {"outcome": outcome}, count))
+    coalescing = flights.stats()
+    for mode, prefix in (("ask", ""), ("stream", "stream_")):
+        samples.append(("prepbot_single_flight_total", "counter", "Questions by whether they ran or joined one in flight",
+                        {"mode": mode, "role": "leader"}, coalescing[f"{prefix}leaders"]))
+        samples.append(("prepbot_single_flight_total", "counter", "Questions by whether they ran or joined one in flight",
+                        {"mode": mode, "role": "coalesced"}, coalescing[f"{prefix}coalesced"]))
+    upload_stats = uploads.stats()
+    samples.append(("prepbot_uploads_total", "counter", "Uploads received, by whether their content was new",
+                    {"result": "new"}, upload_stats["uploads"] - upload_stats["duplicates"]))
+    samples.append(("prepbot_uploads_total", "counter", "Uploads received, by whether their content was new",
+                    {"result": "duplicate"}, upload_stats["duplicates"]))
+    for status, count in ingest_queue.stats().items():
+        samples.append(("prepbot_ingest_jobs", "gauge", "Ingestion jobs by status", {"status": status}, count))
+    return samples
+
+registry.add_collector(collect_service_metrics)
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Answer 413 to uploads whose declared size is over the limit, without receiving them"""
+    limit = UPLOAD_BODY_LIMITS.get(request.url.path)
+    length = request.headers.get("content-length")
+    if limit is not None and length is not None and length.isdigit() and int(length) > limit:
+        return JSONResponse(content={"error": f"Upload exceeds the limit of {limit} bytes"}, status_code=413)
+    return await call_next(request)
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    """Time every request and report its pipeline stages in a Server-Timing header"""
+    started = time.perf_counter()
+    with trace() as stages:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, request.method,
+                                 getattr(route, "path", "unmatched"), str(response.status_code))
+    # Streaming responses start before their stages run, those report them in the "done" event
+    if SERVER_TIMING_HEADER and stages:
+        response.headers["Server-Timing"] = server_timing(stages)
+    return response
 
 @app.get("/")
 async def root():
     """Root endpoint"""
     return {"message": "University Chatbot API is running"}
 
+def startup_report() -> Dict:
+    """Cold start progress and where the time went"""
+    return {
+        **startup_state,
+        "timings_ms": dict(startup_timings),
+        "imports_ms": dict(import_timings),
+    }
+
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: the server is serving as soon as it starts, ready once the index is warm.
+
+    Answers 503 until the background load (and warm-up, if enabled) has
+    finished; a deployment without any index is ready once that is known.
+    """
+    index_warm = snapshots.current() is not None and startup_state["warmup"] not in ("pending", "running")
+    ready = index_warm or startup_state["index"] == "missing"
+    return JSONResponse(
+        content={"serving": True, "index_warm": index_warm, "ready": ready, "startup": startup_report()},
+        status_code=200 if ready else 503,
+    )
+
 @app.get("/status")
 async def get_status():
     """Check if the vector database is loaded"""
-    return {"db_loaded": vectorstore is not None}
+    current = snapshots.current()
+    query_refine = imported("query_refine")
+    qa_utils = imported("qa_utils")
+    vector_backends = imported("vector_backends")
+    subject_shards = imported("subject_shards")
+    embeddings = _loaded_embeddings()
+    return {
+        "db_loaded": snapshots.current() is not None,
+        "startup": startup_report(),
+        "snapshot": snapshots.stats(),
+        # None while the component is still being imported after a cold start
+        "answer_cache": _answer_cache.stats() if _answer_cache else None,
+        "refine_cache": query_refine.get_refine_cache_stats() if query_refine else None,
+        "speculative_retrieval": qa_utils.get_speculation_stats() if qa_utils else None,
+        "retrieval": {
+            **(qa_utils.get_retrieval_stats() if qa_utils else {}),
+            "backend": vector_backends.VECTOR_BACKEND if vector_backends else None,
+            "lexical_chunks": len(current.lexical_index) if current and current.lexical_index else 0,
+        },
+        "shards": {
+            **(subject_shards.get_shard_stats() if subject_shards else {}),
+            "chunks": getattr(current.vectorstore, "sizes", None) if current else None,
+        },
+        "embedding_cache": embeddings.store.stats() if embeddings else None,
+        "embedding_batcher": embeddings.query_batcher.stats() if embeddings else None,
+        "ingest_jobs": ingest_queue.stats(),
+        "single_flight": flights.stats(),
+        "sessions": sessions.stats(),
+        "uploads": uploads.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: stage latency histograms, LLM usage, caches and index size"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/documents")
 async def list_documents():
@@ -86,41 +479,196 @@ async def list_documents():
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 @app.post("/upload")
-async def upload_document(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_document(file: UploadFile = File(...)):
     """Upload a document and add it to the vector database"""
     if not file.filename.endswith('.pdf'):
         return JSONResponse(
             content={"error": "Only PDF files are supported"},
             status_code=400
         )
-    filename = f"{uuid.uuid4()}_{file.filename}"
+    # Hidden until complete, so /documents and directory rescans never see a partial file
+    tmp_path = os.path.join(DOCUMENTS_DIR, f".upload-{uuid.uuid4().hex}.part")
+    try:
+        digest, size = await stream_to_file(file.read, tmp_path)
+    except UploadTooLarge as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+
+    filename = stored_name(file.filename, digest)
     file_path = os.path.join(DOCUMENTS_DIR, filename)
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    current = snapshots.current()
+    duplicate = await asyncio.to_thread(uploads.reserve, digest, file_path, current.version if current else None)
+    if duplicate is not None:
+        os.remove(tmp_path)
+        return {"message": "Document already uploaded, skipping ingestion", "duplicate": True, "sha256": digest,
+                **duplicate}
+
+    try:
+        os.replace(tmp_path, file_path)
+        job = ingest_queue.submit([file_path])
+    except BaseException:
+        uploads.release(digest)
+        raise
+    uploads.assign_job(digest, job.id)
+
+    return {"message": "Document uploaded and being processed", "job_id": job.id, "document": filename,
+            "sha256": digest, "bytes": size}
+
+async def _stage_bulk_file(name: str, read, index_key, staged: Dict[str, dict], filename: Optional[str] = None) -> dict:
+    """Stream one file of a bulk upload to disk; returns its summary entry.
+
+    name is what the summary reports, filename (default name) what the stored document is called after.
+    """
+    tmp_path = os.path.join(DOCUMENTS_DIR, f".upload-{uuid.uuid4().hex}.part")
+    try:
+        digest, size = await stream_to_file(read, tmp_path)
+    except UploadTooLarge as e:
+        return {"name": name, "status": "rejected", "error": str(e)}
+    summary = {"name": name, "sha256": digest, "bytes": size}
+    # The same content twice in one request is ingested once
+    if digest in staged:
+        os.remove(tmp_path)
+        return {**summary, "status": "duplicate", "document": staged[digest]["document"], "duplicate_of": "request"}
+    document = stored_name(filename or name, digest)
+    file_path = os.path.join(DOCUMENTS_DIR, document)
+    duplicate = await asyncio.to_thread(uploads.reserve, digest, file_path, index_key)
+    if duplicate is not None:
+        os.remove(tmp_path)
+        return {**summary, "status": "duplicate", "document": duplicate["document"],
+                "duplicate_of": duplicate["status"], **({"job_id": duplicate["job_id"]} if "job_id" in duplicate else {})}
+    # Reserved from here on: the caller assigns the job or releases it
+    summary = {**summary, "status": "queued", "document": document, "path": file_path}
+    staged[digest] = summary
+    os.replace(tmp_path, file_path)
+    return summary
+
+@app.post("/upload/bulk")
+async def upload_documents_bulk(files: List[UploadFile] = File(...)):
+    """Upload many PDFs, or zip archives of PDFs, and index them all in one ingestion job"""
+    current = snapshots.current()
+    index_key = current.version if current else None
+    results: List[dict] = []
+    staged: Dict[str, dict] = {}
+
+    def room_left() -> bool:
+        return sum(1 for r in results if "sha256" in r) < BULK_UPLOAD_MAX_FILES
+
+    too_many = f"More than {BULK_UPLOAD_MAX_FILES} PDFs in one request"
+    unsupported = "Only PDF files and zip archives are supported"
+    try:
+        for file in files:
+            name = file.filename or ""
+            lowered = name.lower()
+            if lowered.endswith(".pdf"):
+                if not room_left():
+                    results.append({"name": name, "status": "rejected", "error": too_many})
+                    continue
+                results.append(await _stage_bulk_file(name, file.read, index_key, staged))
+            elif lowered.endswith(".zip"):
+                archive_path = os.path.join(DOCUMENTS_DIR, f".upload-{uuid.uuid4().hex}.zip.part")
+                try:
+                    await stream_to_file(file.read, archive_path, max_bytes=BULK_UPLOAD_MAX_BYTES)
+                except UploadTooLarge as e:
+                    results.append({"name": name, "status": "rejected", "error": str(e)})
+                    continue
+                try:
+                    async for member, read, problem in zip_members(archive_path):
+                        entry_name = f"{name}/{member}"
+                        if problem is not None:
+                            results.append({"name": entry_name, "status": "rejected", "error": problem})
+                        elif not room_left():
+                            results.append({"name": entry_name, "status": "rejected", "error": too_many})
+                        else:
+                            results.append(await _stage_bulk_file(entry_name, read, index_key, staged,
+                                                                  filename=member))
+                except zipfile.BadZipFile as e:
+                    results.append({"name": name, "status": "rejected", "error": f"Invalid zip archive: {e}"})
+                finally:
+                    os.remove(archive_path)
+            else:
+                results.append({"name": name, "status": "rejected", "error": unsupported})
+        # One job, so the whole set is parsed, embedded and written in a single batch
+        job = ingest_queue.submit([s["path"] for s in staged.values()]) if staged else None
+    except BaseException:
+        for digest in staged:
+            uploads.release(digest)
+        raise
+    for digest, summary in staged.items():
+        summary.pop("path")
+        uploads.assign_job(digest, job.id)
+        summary["job_id"] = job.id
 
-    background_tasks.add_task(process_uploaded_documents, [file_path])
-    
-    return {"message": "Document uploaded and being processed"}
+    counts = {status: sum(1 for r in results if r["status"] == status) for status in ("queued", "duplicate", "rejected")}
+    return {
+        "message": "Documents uploaded and being processed" if job else "No new documents to process",
+        "job_id": job.id if job else None,
+        **counts,
+        "files": results,
+    }
 
 @app.post("/rebuild-db")
-async def rebuild_database(background_tasks: BackgroundTasks):
-    """Rebuild the vector database from all documents"""
-    background_tasks.add_task(process_uploaded_documents, [])
-    return {"message": "Database rebuild started"}
+async def rebuild_database(shard: Optional[List[str]] = Form(None)):
+    """Rebuild the vector database from all documents, or only the given subject shards"""
+    if shard:
+        current = snapshots.current()
+        # Shards of the published index, and any the current rules would add
+        known = set(getattr(current.vectorstore, "shards", ())) if current else set()
+        subject_shards = lazy_import("subject_shards")
+        if subject_shards.SUBJECT_SHARDS or known:
+            known |= set(subject_shards.shard_names())
+        unknown = sorted(set(shard) - known)
+        if unknown:
+            return JSONResponse(content={"error": f"Unknown shards: {', '.join(unknown)}", "shards": sorted(known)},
+                                status_code=400)
+        job = ingest_queue.submit([], shards=shard)
+        return {"message": f"Rebuild of shards {', '.join(shard)} started", "job_id": job.id}
+    job = ingest_queue.submit(None)
+    return {"message": "Database rebuild started", "job_id": job.id}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Status of an ingestion job: queued, running, done or failed"""
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return JSONResponse(content={"error": "Unknown job"}, status_code=404)
+    return job.as_dict()
 
 @app.post("/ask")
-async def ask_question_endpoint(question: str = Form(...)):
-    """Ask a question to the chatbot"""
-    if not qa_chain:
-        if not load_db_and_chain():
-            return JSONResponse(
-                content={"error": "No vector database available. Please upload documents first."},
-                status_code=400
-            )
-    
+async def ask_question_endpoint(question: str = Form(...), speculative: Optional[bool] = Form(None),
+                                session_id: Optional[str] = Form(None)):
+    """Ask a question to the chatbot, optionally as part of a conversation (session_id)"""
+    if not await ensure_index_loaded():
+        return JSONResponse(
+            content={"error": "No vector database available. Please upload documents first."},
+            status_code=400
+        )
+
+    session = sessions.get(session_id) if session_id else None
+    history = session.history() if session else ""
+    aanswer_question = lazy_import("qa_utils").aanswer_question
+    answer_cache = get_answer_cache()
+
+    async def answer():
+        # Pin one snapshot for the whole request, even if a rebuild publishes meanwhile
+        with snapshots.acquire() as snapshot:
+            # Follow-ups depend on the conversation, a cached or shared answer would not
+            return await aanswer_question(snapshot.qa_chain, question, vectorstore=snapshot.vectorstore,
+                                          answer_cache=None if history else answer_cache, speculative=speculative,
+                                          lexical_index=snapshot.lexical_index, history=history,
+                                          index_version=snapshot.index_version)
+
     try:
-        result = answer_question(qa_chain, question, vectorstore=vectorstore)
+        if session is not None:
+            # Refinement and retrieval only see the question, so it must carry what the follow-up refers to
+            question = await sessions.condense(session, question)
+        if not SINGLE_FLIGHT or history:
+            result = await answer()
+        else:
+            result, coalesced = await flights.run(_flight_key(question), answer)
+            if coalesced:
+                result = {**result, "coalesced": True}
+        if session is not None:
+            sessions.record(session, question, result["answer"])
+            result = {**result, "session_id": session.id, "standalone_question": question}
         return result
     except Exception as e:
         return JSONResponse(
@@ -128,6 +676,72 @@ async def ask_question_endpoint(question: str = Form(...)):
             status_code=500
         )
 
+def _sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/ask/stream")
+async def ask_question_stream_endpoint(question: str = Form(...), speculative: Optional[bool] = Form(None),
+                                       session_id: Optional[str] = Form(None)):
+    """Ask a question and receive the answer as Server-Sent Events.
+
+    Emits ``token`` events while the answer is generated, followed by a single
+    ``done`` event carrying the sources and timing metadata.
+    """
+    if not await ensure_index_loaded():
+        return JSONResponse(
+            content={"error": "No vector database available. Please upload documents first."},
+            status_code=400
+        )
+
+    session = sessions.get(session_id) if session_id else None
+    history = session.history() if session else ""
+    astream_answer = lazy_import("qa_utils").astream_answer
+    answer_cache = get_answer_cache()
+
+    async def answer_events(question: str):
+        with snapshots.acquire() as snapshot:
+            async for item in astream_answer(snapshot.qa_chain, question, vectorstore=snapshot.vectorstore,
+                                             answer_cache=None if history else answer_cache, speculative=speculative,
+                                             lexical_index=snapshot.lexical_index, history=history,
+                                             index_version=snapshot.index_version):
+                yield item
+
+    async def event_stream(question: str):
+        try:
+            # The request's trace, started by observe_requests and inherited by the response task
+            stages = current_trace()
+            if session is not None:
+                question = await sessions.condense(session, question)
+            if SINGLE_FLIGHT and not history:
+                # Later identical questions replay the first one's events instead of generating their own
+                events = flights.stream(_flight_key(question), lambda: answer_events(question))
+            else:
+                events = ((item, False) async for item in answer_events(question))
+            parts = []
+            async for (event, data), coalesced in events:
+                if event == "token":
+                    parts.append(data["text"])
+                elif event == "done":
+                    data = {**data, "timings": {**data["timings"]}, "coalesced": coalesced}
+                    if stages is not None:
+                        data["timings"]["stages"] = dict(stages)
+                    if session is not None:
+                        sessions.record(session, question, "".join(parts))
+                        data["session_id"] = session.id
+                        data["standalone_question"] = question
+                yield _sse_event(event, data)
+        except Exception as e:
+            yield _sse_event("error", {"error": f"Error answering question: {str(e)}"})
+
+    return StreamingResponse(
+        event_stream(question),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+startup_timings["app_import"] = _ms(APP_IMPORT_STARTED)
+
 if __name__ == "__main__":
 
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
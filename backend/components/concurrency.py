@@ -0,0 +1,23 @@
+"""
+Concurrency limits shared by the async request path
+"""
+import asyncio
+import os
+import weakref
+
+# Maximum number of LLM calls in flight per event loop
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+_llm_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+
+def llm_slot() -> asyncio.Semaphore:
+    """Semaphore capping in-flight LLM calls on the running event loop.
+
+    Usage: ``async with llm_slot(): await chain.ainvoke(...)``
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _llm_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _llm_semaphores[loop] = asyncio.Semaphore(LLM_CONCURRENCY)
+    return semaphore
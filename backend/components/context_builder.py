@@ -0,0 +1,144 @@
+"""
+Token-budgeted prompt context: merges adjacent chunks and drops the overlap the splitter repeats
+"""
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+# Approximate tokens available for retrieved text (the prompt template comes on top).
+# Deliberately independent of RETRIEVAL_K: a larger k gives more candidates to choose from,
+# not a longer prompt. 400 tokens hold about four 400-character chunks once their overlap
+# is merged, a little more than the three chunks sent before the budget existed.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "400"))
+# Longest overlap searched for when chunks carry no start_index (the splitter uses 100)
+MAX_OVERLAP_CHARS = 200
+# Shorter suffix/prefix matches are treated as coincidence, not splitter overlap
+MIN_OVERLAP_CHARS = 20
+# Rough characters per token for English text with Gemini's tokenizer
+CHARS_PER_TOKEN = 4
+
+SENTENCE_END_RE = re.compile(r"[.!?]\s")
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of left that is a prefix of right"""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+
+class _Passage:
+    """One or more chunks of the same page stitched into contiguous text"""
+
+    def __init__(self, doc: Document, rank: int):
+        self.docs = [doc]
+        self.rank = rank
+        self.text = doc.page_content
+        self.start = doc.metadata.get("start_index")
+        self.end = self.start + len(self.text) if self.start is not None else None
+
+    def try_append(self, other: "_Passage") -> bool:
+        """Append other if it continues this passage; returns whether it did"""
+        if self.end is not None and other.start is not None:
+            if other.start > self.end or other.start < self.start:
+                return False
+            # Positional overlap, or other is fully inside this passage
+            trim = min(self.end - other.start, len(other.text))
+        else:
+            trim = _overlap(self.text, other.text)
+            if not trim:
+                return False
+        self.absorb(other, other.text[trim:])
+        return True
+
+    def absorb(self, other: "_Passage", added: str = ""):
+        """Take over other's chunks, appending the part of its text this passage lacks"""
+        self.text += added
+        self.docs.extend(other.docs)
+        self.rank = min(self.rank, other.rank)
+        if self.start is not None:
+            self.end = self.start + len(self.text)
+
+
+def _merge_once(merged: List[_Passage]) -> bool:
+    """Merge one pair of passages; returns False once none can be"""
+    for left in merged:
+        for right in merged:
+            if left is right:
+                continue
+            if right.text in left.text:
+                left.absorb(right)
+            elif not left.try_append(right):
+                continue
+            merged.remove(right)
+            return True
+    return False
+
+
+def _merge_page(passages: List[_Passage]) -> List[_Passage]:
+    # Chunks indexed before start_index was recorded have no offsets and may come in any
+    # order: a merged passage can continue another one, so merge until nothing changes
+    merged = sorted(passages, key=lambda passage: (passage.start is None, passage.start or 0))
+    while _merge_once(merged):
+        pass
+    return merged
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, at a sentence end if one is close; empty if nothing fits"""
+    limit = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    cut = text[:limit]
+    ends = [match.end() for match in SENTENCE_END_RE.finditer(cut)]
+    if ends and ends[-1] > limit // 2:
+        return cut[:ends[-1]].rstrip()
+    head = cut.rsplit(" ", 1)[0].rstrip()
+    return head + " ..." if head else ""
+
+
+def build_context(docs: List[Document], budget: Optional[int] = None) -> Tuple[str, List[Document]]:
+    """Context text for the prompt and the chunks it includes.
+
+    docs are in relevance order. Chunks from the same source page are merged
+    where they overlap or touch, so the splitter's repeated overlap is sent
+    once. Passages are then added best-ranked first until about ``budget``
+    tokens are used; the passage that does not fit is cut at a sentence end.
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    pages: Dict[Tuple, List[_Passage]] = {}
+    for rank, doc in enumerate(docs):
+        key = (doc.metadata.get("source"), doc.metadata.get("page"))
+        pages.setdefault(key, []).append(_Passage(doc, rank))
+    passages = sorted((passage for group in pages.values() for passage in _merge_page(group)),
+                      key=lambda passage: passage.rank)
+
+    parts: List[str] = []
+    used: List[Document] = []
+    remaining = budget
+    for passage in passages:
+        tokens = estimate_tokens(passage.text)
+        if tokens <= remaining:
+            parts.append(passage.text)
+            remaining -= tokens
+        elif remaining >= 50 or not parts:
+            truncated = _truncate(passage.text, remaining)
+            if not truncated:
+                # No budget at all
+                continue
+            parts.append(truncated)
+            remaining = 0
+        else:
+            # Too little room left to be useful, a shorter passage may still fit
+            continue
+        used.extend(passage.docs)
+        if remaining <= 0:
+            break
+    return "\n\n".join(parts), used
@@ -0,0 +1,122 @@
+"""
+Micro-batching of query embeddings across concurrent requests
+"""
+import asyncio
+import os
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from components.metrics import EMBEDDING_CALLS
+
+# Collect queries for this long after the last arrival (0 disables batching)
+QUERY_EMBED_BATCH_WINDOW = float(os.getenv("QUERY_EMBED_BATCH_WINDOW_MS", "5")) / 1000
+# Never hold the first query of a batch longer than this
+QUERY_EMBED_MAX_WAIT = float(os.getenv("QUERY_EMBED_MAX_WAIT_MS", "25")) / 1000
+QUERY_EMBED_MAX_BATCH = int(os.getenv("QUERY_EMBED_MAX_BATCH", "32"))
+
+
+class _Batch:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.last_arrival = self.started
+        self.waiters: Dict[str, List[asyncio.Future]] = {}
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+    def __len__(self) -> int:
+        return len(self.waiters)
+
+
+class QueryEmbeddingBatcher:
+    """Sends the query embeddings requested within a short window as one batched call.
+
+    ``embed_batch(texts)`` must return one vector per text, in order. Each
+    event loop collects its own batches, like ``llm_slot``.
+    """
+
+    def __init__(self, embed_batch: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 window: float = QUERY_EMBED_BATCH_WINDOW, max_wait: float = QUERY_EMBED_MAX_WAIT,
+                 max_batch: int = QUERY_EMBED_MAX_BATCH):
+        self.embed_batch = embed_batch
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.max_batch = max(1, max_batch)
+        self._batches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Batch]" = weakref.WeakKeyDictionary()
+        self.requests = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.failed_batches = 0
+        # Strong references to running batch calls, the loop only keeps weak ones
+        self._running = set()
+
+    async def embed(self, text: str) -> List[float]:
+        self.requests += 1
+        if self.window <= 0:
+            self.batches += 1
+            self.largest_batch = max(self.largest_batch, 1)
+            EMBEDDING_CALLS.inc(1, "query")
+            return (await self.embed_batch([text]))[0]
+
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(loop)
+        if batch is None:
+            batch = self._batches[loop] = _Batch()
+            batch.timer = loop.call_later(self.window, self._on_timer, loop, batch)
+        future = loop.create_future()
+        # Identical texts in one batch are embedded once
+        batch.waiters.setdefault(text, []).append(future)
+        batch.last_arrival = time.monotonic()
+        if len(batch) >= self.max_batch:
+            self._dispatch(loop, batch)
+        return await future
+
+    def _on_timer(self, loop: asyncio.AbstractEventLoop, batch: _Batch):
+        now = time.monotonic()
+        quiet_at = batch.last_arrival + self.window
+        deadline = batch.started + self.max_wait
+        if now < quiet_at and now < deadline:
+            # Still arriving: wait for a quiet window, but no longer than max_wait
+            batch.timer = loop.call_later(min(quiet_at, deadline) - now, self._on_timer, loop, batch)
+            return
+        self._dispatch(loop, batch)
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop, batch: _Batch):
+        if self._batches.get(loop) is batch:
+            del self._batches[loop]
+        if batch.timer is not None:
+            batch.timer.cancel()
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        task = loop.create_task(self._run(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, batch: _Batch):
+        texts = list(batch.waiters)
+        EMBEDDING_CALLS.inc(1, "query")
+        try:
+            vectors = await self.embed_batch(texts)
+        except Exception as e:
+            self.failed_batches += 1
+            for futures in batch.waiters.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for text, vector in zip(texts, vectors):
+            for future in batch.waiters[text]:
+                # Callers that gave up (e.g. an abandoned speculative search) are skipped
+                if not future.done():
+                    future.set_result(vector)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_ms": round(self.window * 1000, 2),
+            "max_wait_ms": round(self.max_wait * 1000, 2),
+            "max_batch": self.max_batch,
+            "requests": self.requests,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "failed_batches": self.failed_batches,
+            "avg_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,265 @@
+"""
+Persistent, content-addressed cache for embedding vectors
+"""
+import asyncio
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from components.embedding_batcher import QueryEmbeddingBatcher
+from components.metrics import EMBEDDING_CALLS, EMBEDDING_TEXTS
+from dotenv import load_dotenv
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+EMBEDDING_MODEL = "models/embedding-001"
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", os.path.join(BASE_DIR, "../artifacts/embedding_cache"))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+
+
+class EmbeddingStore:
+    """Fixed-width float32 vectors in a memory-mapped file with an LRU index.
+
+    ``vectors.f32`` holds one row per slot and grows by doubling up to
+    ``max_entries`` rows. ``index.pkl`` maps cache keys to slots in LRU order.
+    When the store is full the least recently used slot is reused.
+
+    The index is only saved every SAVE_EVERY puts, so after a crash it can
+    map a key to a slot since reused for another key. ``keys.bin`` holds a
+    digest of the key each slot was last written for; a read whose digest
+    does not match is a miss.
+    """
+
+    INITIAL_CAPACITY = 1024
+    SAVE_EVERY = 64
+    KEY_DIGEST_SIZE = 16
+
+    def __init__(self, directory: str, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.index_path = os.path.join(directory, "index.pkl")
+        self.keys_path = os.path.join(directory, "keys.bin")
+        self._lock = threading.RLock()
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._free: List[int] = []
+        self._dim: Optional[int] = None
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _key_digest(self, key: str) -> bytes:
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=self.KEY_DIGEST_SIZE).digest()
+
+    def _map(self):
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(self._capacity, self._dim))
+        self._keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+",
+                               shape=(self._capacity, self.KEY_DIGEST_SIZE))
+
+    def _load(self):
+        if not all(os.path.exists(path) for path in (self.index_path, self.vectors_path, self.keys_path)):
+            return
+        try:
+            with open(self.index_path, "rb") as f:
+                index = pickle.load(f)
+            self._dim = index["dim"]
+            self._capacity = index["capacity"]
+            self._slots = index["slots"]
+            self._free = index["free"]
+            self._map()
+        except Exception as e:
+            print("[WARN] Ignoring unreadable embedding cache:", e)
+            self._slots, self._free, self._dim, self._capacity = OrderedDict(), [], None, 0
+            self._vectors = self._keys = None
+
+    def _grow(self, dim: int):
+        """Allocate or enlarge the memory-mapped matrix."""
+        if self._dim is None:
+            self._dim = dim
+        new_capacity = min(self.max_entries, max(self.INITIAL_CAPACITY, self._capacity * 2))
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._keys.flush()
+            self._vectors = self._keys = None
+        with open(self.vectors_path, "ab") as f:
+            f.truncate(new_capacity * self._dim * 4)
+        with open(self.keys_path, "ab") as f:
+            f.truncate(new_capacity * self.KEY_DIGEST_SIZE)
+        self._free.extend(range(new_capacity - 1, self._capacity - 1, -1))
+        self._capacity = new_capacity
+        self._map()
+
+    def _allocate(self, dim: int) -> int:
+        if not self._free and self._capacity < self.max_entries:
+            self._grow(dim)
+        if self._free:
+            return self._free.pop()
+        _, slot = self._slots.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is not None and self._keys[slot].tobytes() != self._key_digest(key):
+                    # Reused for another key after the index was last saved
+                    del self._slots[key]
+                    self._free.append(slot)
+                    slot = None
+                if slot is None:
+                    self.misses += 1
+                    continue
+                self._slots.move_to_end(key)
+                self.hits += 1
+                found[key] = self._vectors[slot].tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        with self._lock:
+            for key, vector in items.items():
+                if self._dim is not None and len(vector) != self._dim:
+                    # Model output width changed, the stored vectors are useless
+                    self.clear()
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._allocate(len(vector))
+                self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+                self._keys[slot] = np.frombuffer(self._key_digest(key), dtype=np.uint8)
+                self._slots[key] = slot
+                self._slots.move_to_end(key)
+                self._dirty += 1
+            if self._dirty >= self.SAVE_EVERY:
+                self.flush()
+
+    def flush(self):
+        """Persist the index and sync the vector file."""
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            self._keys.flush()
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"dim": self._dim, "capacity": self._capacity,
+                             "slots": self._slots, "free": self._free}, f)
+            os.replace(tmp_path, self.index_path)
+            self._dirty = 0
+
+    def clear(self):
+        with self._lock:
+            self._slots, self._free, self._dim, self._capacity = OrderedDict(), [], None, 0
+            self._vectors = self._keys = None
+            for path in (self.vectors_path, self.keys_path, self.index_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._slots),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Drop-in Embeddings wrapper that only calls the model for unseen text.
+
+    Keys combine the model name, the embedding kind (query or document, which
+    some providers embed differently) and a hash of the text. Async query
+    misses go through a QueryEmbeddingBatcher, so concurrent requests share
+    one embedding call.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, store: EmbeddingStore):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.store = store
+        self.query_batcher = QueryEmbeddingBatcher(self._aembed_query_batch)
+
+    def _key(self, kind: str, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\x00{kind}\x00{text}".encode("utf-8")).hexdigest()[:40]
+
+    def _lookup(self, kind: str, texts: List[str]):
+        keys = [self._key(kind, text) for text in texts]
+        found = self.store.get_many(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+        return keys, found, missing
+
+    def _remember(self, kind: str, texts: List[str], vectors: List[List[float]], found: Dict, requests: int = 1):
+        EMBEDDING_CALLS.inc(requests, kind)
+        EMBEDDING_TEXTS.inc(len(texts), kind)
+        fresh = {self._key(kind, text): list(vector) for text, vector in zip(texts, vectors)}
+        self.store.put_many(fresh)
+        found.update(fresh)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup("document", texts)
+        if missing:
+            self._remember("document", missing, self.underlying.embed_documents(missing), found)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, found, missing = self._lookup("query", [text])
+        if missing:
+            self._remember("query", missing, [self.underlying.embed_query(text)], found)
+        return found[keys[0]]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, found, missing = self._lookup("document", texts)
+        if missing:
+            self._remember("document", missing, await self.underlying.aembed_documents(missing), found)
+        return [found[key] for key in keys]
+
+    async def _aembed_query_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one request, with the query task type where supported"""
+        if isinstance(self.underlying, GoogleGenerativeAIEmbeddings):
+            return await self.underlying.aembed_documents(texts, task_type="retrieval_query")
+        if len(texts) == 1:
+            return [await self.underlying.aembed_query(texts[0])]
+        return await asyncio.gather(*(self.underlying.aembed_query(text) for text in texts))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, found, missing = self._lookup("query", [text])
+        if missing:
+            # The batcher counts the API request it makes for the whole batch
+            self._remember("query", missing, [await self.query_batcher.embed(text)], found, requests=0)
+        return found[keys[0]]
+
+
+_embeddings: Optional[CachedEmbeddings] = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """Process-wide cached embedding client used for both indexing and queries"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            underlying = GoogleGenerativeAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                google_api_key=GOOGLE_API_KEY,
+            )
+            directory = os.path.join(EMBEDDING_CACHE_DIR, EMBEDDING_MODEL.replace("/", "_"))
+            _embeddings = CachedEmbeddings(underlying, EMBEDDING_MODEL, EmbeddingStore(directory))
+        return _embeddings
@@ -0,0 +1,264 @@
+"""
+Versioned index snapshots: ingestion builds a new snapshot off to the side and publishes it atomically
+"""
+import glob
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, staging then always copies
+    fcntl = None
+
+MANIFEST_NAME = "processed_files.pkl"
+# Where the manifest lived before snapshots kept their own copy
+LEGACY_MANIFEST = "processed_files.pkl"
+# Linux ioctl making dst a copy-on-write clone of src (btrfs, XFS with reflink, overlayfs on those, ...)
+FICLONE = 0x40049409
+
+
+def manifest_path(persist_dir: str) -> str:
+    """Processed-files manifest belonging to a snapshot directory"""
+    return os.path.join(persist_dir, MANIFEST_NAME)
+
+
+class IndexSnapshot:
+    """Everything the serving path reads, built together and never mutated after publishing"""
+
+    def __init__(self, version: int, persist_dir: str, vectorstore, qa_chain, lexical_index=None,
+                 index_version: Optional[str] = None):
+        self.version = version
+        self.persist_dir = persist_dir
+        self.vectorstore = vectorstore
+        self.qa_chain = qa_chain
+        self.lexical_index = lexical_index
+        self.index_version = index_version
+        self.created_at = time.time()
+        self.refs = 0
+        self.retired = False
+
+
+class SnapshotManager:
+    """Publishes snapshots with a single pointer swap and garbage-collects old ones.
+
+    Readers pin the current snapshot with ``acquire()``; a retired snapshot is
+    deleted from disk once its last reader releases it. The directory a
+    snapshot lives in is recorded in ``<base_dir>.CURRENT`` so restarts pick up
+    the last published version.
+    """
+
+    def __init__(self, base_dir: str):
+        self.base_dir = os.path.normpath(base_dir)
+        self.pointer_path = f"{self.base_dir}.CURRENT"
+        self._current: Optional[IndexSnapshot] = None
+        self._lock = threading.Lock()
+        # Directories handed out by stage() and not yet published or discarded
+        self._staging = set()
+        # Highest version stage() handed out; a discarded directory's version is never reused, since
+        # chromadb caches clients by path and would hand the next ingest one for the deleted files
+        self._last_version = 0
+        # Bytes staged as copy-on-write clones vs full copies, and files hard-linked
+        self.staging_stats = {"cloned_bytes": 0, "copied_bytes": 0, "linked_files": 0}
+        self.published = 0
+        self.superseded = 0
+        self.collected = 0
+
+    def _versioned_dir(self, version: int) -> str:
+        return f"{self.base_dir}@v{version:04d}"
+
+    def _dir_version(self, path: str) -> int:
+        match = re.search(r"@v(\d+)$", path)
+        return int(match.group(1)) if match else 0
+
+    def current_dir(self) -> str:
+        """Directory of the last published snapshot (the base directory before the first publish)"""
+        if os.path.exists(self.pointer_path):
+            with open(self.pointer_path) as f:
+                name = f.read().strip()
+            path = os.path.join(os.path.dirname(self.base_dir), name)
+            if os.path.isdir(path):
+                return path
+        return self.base_dir
+
+    def current_version(self) -> int:
+        return self._dir_version(self.current_dir())
+
+    def index_manifest(self, persist_dir: Optional[str] = None) -> str:
+        """Manifest of a snapshot directory, falling back to the legacy location"""
+        path = manifest_path(persist_dir or self.current_dir())
+        return path if os.path.exists(path) else LEGACY_MANIFEST
+
+    def current(self) -> Optional[IndexSnapshot]:
+        return self._current
+
+    @contextmanager
+    def acquire(self) -> Iterator[Optional[IndexSnapshot]]:
+        """Pin the current snapshot for the duration of a request"""
+        with self._lock:
+            snapshot = self._current
+            if snapshot is not None:
+                snapshot.refs += 1
+        try:
+            yield snapshot
+        finally:
+            if snapshot is not None:
+                self._release(snapshot)
+
+    def _release(self, snapshot: IndexSnapshot):
+        with self._lock:
+            snapshot.refs -= 1
+            collect = snapshot.retired and snapshot.refs == 0
+        if collect:
+            self._collect(snapshot)
+
+    def _clone_file(self, src: str, dst: str) -> str:
+        """Copy a file as a copy-on-write clone if the filesystem supports it, else byte by byte.
+
+        Chroma updates its sqlite database and HNSW segment files in place, so
+        the staged copy must not share an inode with the serving snapshot.
+        A clone costs no data copy until ingestion writes to it.
+        """
+        size = os.path.getsize(src)
+        if fcntl is not None:
+            try:
+                with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+                    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                shutil.copystat(src, dst)
+                self.staging_stats["cloned_bytes"] += size
+                return dst
+            except OSError:
+                pass
+        shutil.copy2(src, dst)
+        self.staging_stats["copied_bytes"] += size
+        return dst
+
+    def _link_file(self, src: str, dst: str):
+        """Share a file that is only ever replaced atomically (written to a temp file, then renamed)"""
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+            self.staging_stats["linked_files"] += 1
+        except OSError:
+            self._clone_file(src, dst)
+
+    def stage(self, source_dir: Optional[str] = None) -> Tuple[int, str]:
+        """Copy the current index files to a new versioned directory for ingestion to modify.
+
+        Files are cloned copy-on-write where the filesystem allows it, so
+        staging costs about what ingestion then writes rather than the size of
+        the whole index. The BM25 index and manifest are hard-linked.
+        """
+        from components.lexical_index import lexical_index_path
+
+        source_dir = source_dir or self.current_dir()
+        existing = [self._dir_version(path) for path in glob.glob(f"{glob.escape(self.base_dir)}@v*")]
+        with self._lock:
+            version = max(existing + [self.current_version(), self._last_version]) + 1
+            self._last_version = version
+            target_dir = self._versioned_dir(version)
+            self._staging.add(os.path.normpath(target_dir))
+        if os.path.isdir(source_dir):
+            shutil.copytree(source_dir, target_dir, copy_function=self._clone_file)
+        else:
+            os.makedirs(target_dir)
+        if os.path.exists(lexical_index_path(source_dir)):
+            self._link_file(lexical_index_path(source_dir), lexical_index_path(target_dir))
+        source_manifest = self.index_manifest(source_dir)
+        if os.path.exists(source_manifest):
+            self._link_file(source_manifest, manifest_path(target_dir))
+        return version, target_dir
+
+    def discard(self, persist_dir: str, snapshot: Optional[IndexSnapshot] = None):
+        """Remove a staged directory that will not be published, closing the snapshot opened on it if any"""
+        with self._lock:
+            self._staging.discard(os.path.normpath(persist_dir))
+        if snapshot is not None:
+            self._close(snapshot)
+        self._remove_files(persist_dir)
+
+    def publish(self, snapshot: IndexSnapshot) -> bool:
+        """Make snapshot the one new requests see; the previous one is retired.
+
+        A snapshot older than the current one is not published (e.g. a slow
+        startup load finishing after an ingest published a newer version);
+        returns whether it was.
+        """
+        with self._lock:
+            previous = self._current
+            if previous is not None and previous.version > snapshot.version:
+                self.superseded += 1
+                return False
+            tmp_path = f"{self.pointer_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(os.path.basename(snapshot.persist_dir))
+            os.replace(tmp_path, self.pointer_path)
+            self._current = snapshot
+            self._staging.discard(os.path.normpath(snapshot.persist_dir))
+            self.published += 1
+            collect = False
+            if previous is not None and previous is not snapshot:
+                previous.retired = True
+                collect = previous.refs == 0
+        if collect:
+            self._collect(previous)
+        return True
+
+    def _collect(self, snapshot: IndexSnapshot):
+        self.collected += 1
+        current = self._current
+        if current is not None and os.path.normpath(current.persist_dir) == os.path.normpath(snapshot.persist_dir):
+            # Same directory reloaded into a new snapshot object, still in use
+            return
+        threading.Thread(target=self._dispose, args=(snapshot,), daemon=True).start()
+
+    def _close(self, snapshot: IndexSnapshot):
+        if snapshot.vectorstore is None:
+            return
+        from components.vector_backends import close_vectorstore
+
+        close_vectorstore(snapshot.vectorstore)
+
+    def _dispose(self, snapshot: IndexSnapshot):
+        # Chroma keeps sqlite connections and HNSW files open until its client is stopped
+        self._close(snapshot)
+        self._remove_files(snapshot.persist_dir)
+
+    def _remove_files(self, persist_dir: str):
+        # Imported here so the API can create the manager before LangChain is loaded
+        from components.lexical_index import lexical_index_path
+        from components.vector_backends import matrix_dir_for
+
+        if os.path.normpath(persist_dir) == self.base_dir:
+            return
+        shutil.rmtree(persist_dir, ignore_errors=True)
+        shutil.rmtree(matrix_dir_for(persist_dir), ignore_errors=True)
+        if os.path.exists(lexical_index_path(persist_dir)):
+            os.remove(lexical_index_path(persist_dir))
+
+    def cleanup_stale(self):
+        """Delete versioned directories left behind by crashed or superseded ingests"""
+        with self._lock:
+            keep = {os.path.normpath(self.current_dir())} | self._staging
+            if self._current is not None:
+                keep.add(os.path.normpath(self._current.persist_dir))
+        for path in glob.glob(f"{glob.escape(self.base_dir)}@v*"):
+            if re.search(r"@v\d+$", path) and os.path.normpath(path) not in keep:
+                self._remove_files(path)
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self._current
+        return {
+            "version": snapshot.version if snapshot else None,
+            "index_version": snapshot.index_version if snapshot else None,
+            "readers": snapshot.refs if snapshot else 0,
+            "published": self.published,
+            "superseded": self.superseded,
+            "collected": self.collected,
+            "staging": dict(self.staging_stats),
+        }
@@ -0,0 +1,181 @@
+"""
+Ingestion job queue: one writer at a time, bursts of uploads coalesced into one batch
+"""
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+
+class IngestJob:
+    """One submitted ingestion request and its progress"""
+
+    def __init__(self, files: Optional[List[str]], shards: Optional[List[str]] = None):
+        self.id = uuid.uuid4().hex
+        # None means "scan the whole documents directory"
+        self.files = files
+        # Subject shards to rebuild from scratch
+        self.shards = shards or []
+        self.status = "queued"
+        self.batch_id: Optional[int] = None
+        self.batch_size = 0
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.chunks: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        # Files of this job that were not ingested, all of them if the batch failed
+        self.failed_files: List[str] = []
+
+    def as_dict(self) -> Dict[str, Any]:
+        timings = {}
+        if self.started_at is not None:
+            timings["queued_seconds"] = round(self.started_at - self.submitted_at, 3)
+        if self.finished_at is not None and self.started_at is not None:
+            timings["run_seconds"] = round(self.finished_at - self.started_at, 3)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "files": self.files,
+            "shards": self.shards,
+            "batch_id": self.batch_id,
+            "batch_jobs": self.batch_size,
+            "chunks": self.chunks,
+            "timings": timings,
+            "error": self.error,
+        }
+
+
+class IngestJobQueue:
+    """Serializes ingestion through a single worker thread.
+
+    Jobs submitted within ``coalesce_window`` seconds of each other are merged
+    into one batch (bounded by ``max_batch_wait``), so a burst of uploads is
+    parsed, embedded and written once. ``run_batch`` receives the union of the
+    submitted files, or None if any job asked for a full directory scan, and
+    the union of the shards to rebuild. It returns an IngestStats (or None
+    when nothing was indexed). ``on_finished(job)`` is called on the worker
+    for every job once it is done or failed.
+    """
+
+    def __init__(self, run_batch: Callable, coalesce_window: float = 1.0,
+                 max_batch_wait: float = 10.0, max_jobs_kept: int = 500,
+                 on_finished: Optional[Callable[[IngestJob], None]] = None):
+        self.run_batch = run_batch
+        self.on_finished = on_finished
+        self.coalesce_window = coalesce_window
+        self.max_batch_wait = max_batch_wait
+        self.max_jobs_kept = max_jobs_kept
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._pending: List[IngestJob] = []
+        self._cond = threading.Condition()
+        self._batch_ids = itertools.count(1)
+        self._worker: Optional[threading.Thread] = None
+
+    def submit(self, files: Optional[List[str]] = None, shards: Optional[List[str]] = None) -> IngestJob:
+        job = IngestJob(list(files) if files is not None else None, shards)
+        with self._cond:
+            self._jobs[job.id] = job
+            self._evict()
+            self._pending.append(job)
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+                self._worker.start()
+            self._cond.notify()
+        return job
+
+    def _evict(self):
+        """Forget the oldest finished jobs beyond max_jobs_kept; queued and running jobs are always kept"""
+        excess = len(self._jobs) - self.max_jobs_kept
+        if excess <= 0:
+            return
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("done", "failed")]
+        for job_id in finished[:excess]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return counts
+
+    def _next_batch(self) -> List[IngestJob]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            # Debounce: keep collecting while submissions keep arriving
+            deadline = time.monotonic() + self.max_batch_wait
+            while True:
+                seen = len(self._pending)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(timeout=min(self.coalesce_window, remaining))
+                if len(self._pending) == seen:
+                    break
+            batch, self._pending = self._pending, []
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            batch_id = next(self._batch_ids)
+            full_scan = any(job.files is None for job in batch)
+            files = None if full_scan else list(dict.fromkeys(f for job in batch for f in job.files))
+            shards = list(dict.fromkeys(shard for job in batch for shard in job.shards))
+            started = time.time()
+            for job in batch:
+                job.status, job.batch_id, job.batch_size, job.started_at = "running", batch_id, len(batch), started
+            try:
+                stats = self.run_batch(files, shards)
+                error = None
+            except Exception as e:
+                print("[ERROR] Ingestion batch failed:", e)
+                stats, error = None, str(e)
+            finished = time.time()
+            failed_files = set(stats.failed_files) if stats is not None else set()
+            for job in batch:
+                job.finished_at = finished
+                job.chunks = self._job_chunks(job, stats)
+                job_failed = sorted(failed_files.intersection(job.files or failed_files))
+                job.failed_files = list(job.files or []) if error else job_failed
+                job.error = error or (f"Failed to ingest: {', '.join(job_failed)}" if job_failed else None)
+                job.status = "failed" if job.error else "done"
+            with self._cond:
+                self._evict()
+            if self.on_finished is not None:
+                for job in batch:
+                    try:
+                        self.on_finished(job)
+                    except Exception as e:
+                        print("[WARN] Ingestion job callback failed:", e)
+
+    @staticmethod
+    def _job_chunks(job: IngestJob, stats) -> Dict[str, Any]:
+        if stats is None:
+            return {}
+        if job.shards:
+            return {
+                "added": sum(stats.shard_chunks.get(shard, 0) for shard in job.shards),
+                "shards": {shard: stats.shard_chunks.get(shard, 0) for shard in job.shards},
+            }
+        if job.files is None:
+            return {
+                "added": stats.chunks_added,
+                "removed": stats.chunks_removed,
+                "unchanged": stats.chunks_unchanged,
+                "files": dict(stats.file_chunks),
+            }
+        files = {f: stats.file_chunks[f] for f in job.files if f in stats.file_chunks}
+        return {
+            "added": sum(info["added"] for info in files.values()),
+            "removed": sum(info["removed"] for info in files.values()),
+            "files": files,
+        }
@@ -0,0 +1,42 @@
+"""
+Deferred, timed imports of the heavy LangChain/GenAI/Chroma components
+"""
+import importlib
+import sys
+import time
+from types import ModuleType
+from typing import Dict, Iterable, Optional
+
+# Milliseconds each component took to import, including whatever it pulled in first
+import_timings: Dict[str, float] = {}
+
+
+def lazy_import(name: str) -> ModuleType:
+    """``components.<name>``, imported on first use.
+
+    Safe to call from worker threads: the import system makes a second
+    importer wait until the module is fully initialized.
+    """
+    full_name = f"components.{name}"
+    module = sys.modules.get(full_name)
+    if module is not None and not getattr(module.__spec__, "_initializing", False):
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(full_name)
+    import_timings.setdefault(name, round((time.perf_counter() - started) * 1000, 1))
+    return module
+
+
+def imported(name: str) -> Optional[ModuleType]:
+    """``components.<name>`` if it is already imported, without importing it"""
+    module = sys.modules.get(f"components.{name}")
+    if module is None or getattr(module.__spec__, "_initializing", False):
+        return None
+    return module
+
+
+def import_all(names: Iterable[str]) -> Dict[str, float]:
+    """Import the given components in order; returns their import times"""
+    for name in names:
+        lazy_import(name)
+    return dict(import_timings)
@@ -0,0 +1,167 @@
+"""
+In-process BM25 index over the same chunks that are stored in Chroma
+"""
+import gzip
+import math
+import os
+import pickle
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a an and are as at be but by can could do does explain for from give how i in is it me of on or please
+show tell that the this to what when where which who why with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def lexical_index_path(persist_dir: str) -> str:
+    """Where the BM25 index of a Chroma persist directory lives (next to it)"""
+    return os.path.normpath(persist_dir) + ".bm25.gz"
+
+
+class BM25Index:
+    """Okapi BM25 over chunk texts, keyed by the chunk IDs used in Chroma"""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._texts: Dict[str, str] = {}
+        self._metadatas: Dict[str, Dict] = {}
+        self._lengths: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def add(self, ids: List[str], texts: List[str], metadatas: Optional[List[Dict]] = None):
+        metadatas = metadatas or [{} for _ in ids]
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            if doc_id in self._texts:
+                self.remove([doc_id])
+            tokens = tokenize(text)
+            self._texts[doc_id] = text
+            self._metadatas[doc_id] = metadata
+            self._lengths[doc_id] = len(tokens)
+            self._total_length += len(tokens)
+            for term, tf in Counter(tokens).items():
+                self._postings[term][doc_id] = tf
+
+    def remove(self, ids: List[str]):
+        for doc_id in ids:
+            text = self._texts.pop(doc_id, None)
+            if text is None:
+                continue
+            self._metadatas.pop(doc_id, None)
+            self._total_length -= self._lengths.pop(doc_id, 0)
+            for term in set(tokenize(text)):
+                postings = self._postings.get(term)
+                if postings is not None:
+                    postings.pop(doc_id, None)
+                    if not postings:
+                        del self._postings[term]
+
+    def _idf(self, term: str) -> float:
+        df = len(self._postings.get(term, ()))
+        return math.log(1 + (len(self._texts) - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int = 10) -> Tuple[List[Document], float]:
+        """Top-k chunks for the query and a confidence in [0, 1].
+
+        The confidence is the best chunk's score relative to that of an
+        average-length chunk containing each query term once, times the
+        fraction of query terms the best chunk actually contains.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self._texts:
+            return [], 0.0
+        avg_length = self._total_length / len(self._texts) or 1.0
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, int] = defaultdict(int)
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(term)
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_id] += 1
+        if not scores:
+            return [], 0.0
+        ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+        best = ranked[0]
+        reference = sum(self._idf(term) for term in terms)
+        confidence = min(1.0, scores[best] / reference) * matched[best] / len(terms) if reference else 0.0
+        docs = [
+            Document(id=doc_id, page_content=self._texts[doc_id],
+                     metadata={**self._metadatas[doc_id], "bm25_score": round(scores[doc_id], 4)})
+            for doc_id in ranked
+        ]
+        return docs, confidence
+
+    def save(self, path: str):
+        """Write the chunks gzip-compressed; postings are rebuilt on load"""
+        tmp_path = f"{path}.tmp"
+        ids = list(self._texts)
+        payload = {
+            "k1": self.k1,
+            "b": self.b,
+            "ids": ids,
+            "texts": [self._texts[doc_id] for doc_id in ids],
+            "metadatas": [self._metadatas[doc_id] for doc_id in ids],
+        }
+        with gzip.open(tmp_path, "wb", compresslevel=6) as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with gzip.open(path, "rb") as f:
+            payload = pickle.load(f)
+        index = cls(k1=payload["k1"], b=payload["b"])
+        index.add(payload["ids"], payload["texts"], payload["metadatas"])
+        return index
+
+    @classmethod
+    def from_vectorstore(cls, vectorstore) -> "BM25Index":
+        """Build the index from every chunk already stored in a Chroma collection"""
+        data = vectorstore.get(include=["documents", "metadatas"])
+        index = cls()
+        index.add(data["ids"], data["documents"], data["metadatas"])
+        return index
+
+
+def load_or_build_lexical_index(persist_dir: str, vectorstore=None) -> Optional[BM25Index]:
+    """Load the BM25 index stored next to persist_dir, building it from Chroma if missing"""
+    path = lexical_index_path(persist_dir)
+    if os.path.exists(path):
+        try:
+            return BM25Index.load(path)
+        except Exception as e:
+            print("[WARN] Rebuilding unreadable BM25 index:", e)
+    if vectorstore is None:
+        return None
+    index = BM25Index.from_vectorstore(vectorstore)
+    index.save(path)
+    return index
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """Fuse ranked result lists; documents are matched on their content"""
+    scores: Dict[str, float] = defaultdict(float)
+    docs: Dict[str, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            scores[doc.page_content] += 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(doc.page_content, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[content] for content in ranked]
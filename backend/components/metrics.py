@@ -0,0 +1,204 @@
+"""
+Per-stage tracing spans and Prometheus-format metrics for the ask and ingest pipelines
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds, covering cache hits (sub-millisecond) to slow generations
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, *labels: str):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelValues, List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (plus +Inf), sum, count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            snapshot = [(labels, list(series[0]), series[1], series[2]) for labels, series in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+class Registry:
+    """Metrics plus collectors that report gauges read at scrape time"""
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Sequence[Tuple[str, str, str, Dict[str, str], float]]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Sequence[Tuple[str, str, str, Dict[str, str], float]]]):
+        """collector() returns (name, type, help, labels, value) samples"""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        described = set()
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                print("[WARN] Metrics collector failed:", e)
+                continue
+            for name, kind, help, labels, value in samples:
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {name} {help}")
+                    lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "prepbot_stage_seconds", "Time spent in each pipeline stage", ("pipeline", "stage")))
+HTTP_REQUEST_SECONDS = registry.register(Histogram(
+    "prepbot_http_request_seconds", "HTTP request latency until the response starts", ("method", "route", "status")))
+LLM_CALLS = registry.register(Counter(
+    "prepbot_llm_calls_total", "Chat model calls", ("purpose",)))
+LLM_TOKENS = registry.register(Counter(
+    "prepbot_llm_tokens_total", "Chat model tokens reported by the API", ("purpose", "kind")))
+EMBEDDING_CALLS = registry.register(Counter(
+    "prepbot_embedding_calls_total", "Embedding API requests (cache misses only)", ("kind",)))
+EMBEDDING_TEXTS = registry.register(Counter(
+    "prepbot_embedding_texts_total", "Texts sent to the embedding API", ("kind",)))
+
+_trace: ContextVar[Optional[Dict[str, float]]] = ContextVar("prepbot_trace", default=None)
+
+
+@contextmanager
+def trace() -> Iterator[Dict[str, float]]:
+    """Collect the stage durations (in ms) of everything run inside the block.
+
+    Tasks started inside the block inherit the trace, so concurrent stages
+    (e.g. the speculative search) are recorded too.
+    """
+    stages: Dict[str, float] = {}
+    token = _trace.set(stages)
+    try:
+        yield stages
+    finally:
+        _trace.reset(token)
+
+
+def current_trace() -> Optional[Dict[str, float]]:
+    """Stage durations of the trace the caller runs in, if any"""
+    return _trace.get()
+
+
+def observe_stage(pipeline: str, stage: str, seconds: float):
+    """Record a stage that was timed elsewhere (e.g. in a worker process)"""
+    STAGE_SECONDS.observe(seconds, pipeline, stage)
+    stages = _trace.get()
+    if stages is not None:
+        stages[stage] = round(stages.get(stage, 0.0) + seconds * 1000, 1)
+
+
+@contextmanager
+def span(stage: str, pipeline: str = "ask"):
+    """Time a stage into prepbot_stage_seconds and the current trace"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(pipeline, stage, time.perf_counter() - started)
+
+
+def record_llm_call(purpose: str, message=None):
+    """Count a chat model call and the tokens in its usage metadata, if any"""
+    LLM_CALLS.inc(1, purpose)
+    usage = getattr(message, "usage_metadata", None) or {}
+    for kind in ("input_tokens", "output_tokens"):
+        if usage.get(kind):
+            LLM_TOKENS.inc(usage[kind], purpose, kind.split("_")[0])
+
+
+def server_timing(stages: Dict[str, float]) -> str:
+    """Format a stage breakdown as a Server-Timing header value"""
+    return ", ".join(f"{stage};dur={duration}" for stage, duration in stages.items())
+
+
+def render_metrics() -> str:
+    return registry.render()
@@ -0,0 +1,76 @@
+"""
+On-disk cache of the page text extracted from each PDF, keyed by file content and parser version
+"""
+import glob
+import gzip
+import json
+import os
+from importlib import metadata
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PARSE_CACHE_DIR = os.getenv("PARSE_CACHE_DIR", os.path.join(BASE_DIR, "../artifacts/parse_cache"))
+PARSE_CACHE = os.getenv("PARSE_CACHE", "true").lower() in ("1", "true", "yes")
+# Bump when the extraction changes without a library upgrade, e.g. new loader options
+PARSE_CACHE_FORMAT = 1
+
+
+def _package_version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Text extracted by another pypdf or loader version is parsed again
+PARSER_VERSION = f"pypdf-{_package_version('pypdf')}_lc-{_package_version('langchain-community')}_f{PARSE_CACHE_FORMAT}"
+
+
+def cache_path(file_hash: str) -> str:
+    return os.path.join(PARSE_CACHE_DIR, file_hash[:2], f"{file_hash}.{PARSER_VERSION}.json.gz")
+
+
+def load_pages(file_path: str, file_hash: str) -> Optional[List[Document]]:
+    """The cached pages of a file, with ``source`` set to file_path, or None on a miss"""
+    path = cache_path(file_hash)
+    if not os.path.exists(path):
+        return None
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            payload = json.load(f)
+    except (OSError, ValueError) as e:
+        print("[WARN] Ignoring unreadable parse cache entry:", e)
+        return None
+    # The same content may have been uploaded under another name
+    return [Document(page_content=page["text"], metadata={**page["metadata"], "source": file_path})
+            for page in payload["pages"]]
+
+
+def store_pages(file_hash: str, documents: List[Document]):
+    """Cache the pages parsed from a file, replacing entries of older parser versions"""
+    path = cache_path(file_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    payload = {
+        "parser": PARSER_VERSION,
+        "pages": [
+            {"text": doc.page_content, "metadata": {k: v for k, v in doc.metadata.items() if k != "source"}}
+            for doc in documents
+        ],
+    }
+    # Parse workers are separate processes, give each its own temporary file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(payload, f, default=str)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print("[WARN] Failed to write parse cache entry:", e)
+        return
+    for stale in glob.glob(os.path.join(os.path.dirname(path), f"{file_hash}.*.json.gz")):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
@@ -0,0 +1,178 @@
+"""
+Local pre-refiner: expands abbreviations and decides whether a query needs the LLM refiner at all
+"""
+import json
+import os
+import re
+from typing import Dict, Tuple
+
+from components.lexical_index import STOPWORDS
+from prompt.db_summary import Summary, template
+
+# The refiner's answer to anything that is not about studying
+OFF_TOPIC_REPLY = "This assistant only responds to academic or study-related queries."
+
+# JSON object of extra or overriding abbreviations, e.g. {"oops": "object oriented programming"}
+ABBREVIATIONS_PATH = os.getenv("ABBREVIATIONS_PATH") or None
+# Skip the LLM for queries the heuristics consider clear already
+LOCAL_REFINE = os.getenv("LOCAL_REFINE", "true").lower() in ("1", "true", "yes")
+# Longer queries usually carry several asks, leave those to the LLM
+LOCAL_REFINE_MAX_WORDS = int(os.getenv("LOCAL_REFINE_MAX_WORDS", "20"))
+
+DEFAULT_ABBREVIATIONS = {
+    "dp": "dynamic programming",
+    "cp": "competitive programming",
+    "mcq": "multiple choice questions",
+    "mcqs": "multiple choice questions",
+    "prob": "probability",
+    "ques": "questions",
+    "qs": "questions",
+    "gen": "generate",
+    "dsa": "data structures and algorithms",
+    "ds": "data structures",
+    "algo": "algorithm",
+    "algos": "algorithms",
+    "bfs": "breadth-first search",
+    "dfs": "depth-first search",
+    "bst": "binary search tree",
+    "ll": "linked list",
+    "js": "JavaScript",
+    "std dev": "standard deviation",
+    "sd": "standard deviation",
+    "avg": "average",
+    "stats": "statistics",
+    "dist": "distribution",
+    "hyp": "hypothesis",
+    "ci": "confidence interval",
+    "eg": "example",
+    "ex": "example",
+    "diff": "difference",
+    "btw": "between",
+    "b/w": "between",
+    "w/": "with",
+    "pls": "please",
+    "plz": "please",
+    "u": "you",
+    "abt": "about",
+    "wat": "what",
+    "wht": "what",
+    "expl": "explain",
+    "imp": "important",
+    "sem": "semester",
+    "webdev": "web development",
+    "wab": "web development",
+}
+
+# Words an already-clear academic query is made of, besides the syllabus itself
+COMMON_WORDS = frozenset("""
+about all also any approach approaches are ask basic basics best between both brief briefly calculate can
+case cases chapter code coding compare comparison complexity concept concepts create define definition
+describe detail detailed difference different each easy example examples exam exams explain explanation
+find five formula formulas four generate get give good hard help important implement implementation
+into important key list long make many mean meaning method methods more most need notes number
+numericals one over overview point points possible practice prepare problem problems program programs
+provide question questions quick real revise revision role short show simple solution solutions solve
+some step steps summary summarize ten than theorem three topic topics tricks two type types unit use used
+uses using versus vs way ways work works write
+""".split())
+
+# Topic words that mark a query as academic even if the syllabus text does not list them
+ACADEMIC_TERMS = frozenset("""
+algorithm algorithms api array arrays average bayes binary binomial bubble class closure closures code
+coding complexity component components correlation css data deviation distribution dom dynamic exam
+fetch formula function functions graph graphs hash hashing heap hook hooks html http hypothesis insertion
+javascript js json linked list matrix mean median merge mode normal node poisson probability programming
+promise promises python queue queues quick react recursion regression sample sampling search searching
+selection sort sorting stack stacks statistics syllabus tree trees variance
+""".split())
+
+# Everyday topics the assistant refuses, when no academic term is present. Words with a
+# technical sense too (match, date, game, love, party, tea...) are left to the LLM refiner
+OFF_TOPIC_WORDS = frozenset("""
+coffee pizza recipe movie movies film song songs music singer weather joke jokes girlfriend boyfriend
+dating cricket football ipl gaming vacation horoscope celebrity netflix instagram politics election
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9][a-z0-9+#'/-]*")
+
+pre_refine_stats = {"local": 0, "off_topic": 0, "llm": 0}
+
+
+def _load_abbreviations() -> Dict[str, str]:
+    abbreviations = dict(DEFAULT_ABBREVIATIONS)
+    if ABBREVIATIONS_PATH and os.path.exists(ABBREVIATIONS_PATH):
+        with open(ABBREVIATIONS_PATH) as f:
+            abbreviations.update({key.lower(): value for key, value in json.load(f).items()})
+    return abbreviations
+
+
+ABBREVIATIONS = _load_abbreviations()
+# Longest keys first so "std dev" wins over a shorter match inside it. Never inside a
+# contraction or hyphenated word: "I'll", "u-substitution"
+_ABBREVIATION_RE = re.compile(
+    r"(?<![\w/'-])(" + "|".join(re.escape(key) for key in sorted(ABBREVIATIONS, key=len, reverse=True))
+    + r")(?![\w/'-])",
+    re.IGNORECASE,
+)
+
+
+def _stem(word: str) -> str:
+    for suffix in ("ies", "es", "s"):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            return word[: -len(suffix)] + ("y" if suffix == "ies" else "")
+    return word
+
+
+def _words(text: str):
+    return WORD_RE.findall(text.lower())
+
+
+SYLLABUS_TERMS = frozenset(_stem(word) for word in _words(Summary) if word not in STOPWORDS) | \
+    frozenset(_stem(word) for word in ACADEMIC_TERMS)
+KNOWN_WORDS = SYLLABUS_TERMS | frozenset(_stem(word) for word in _words(template)) | \
+    frozenset(_stem(word) for word in COMMON_WORDS | STOPWORDS) | \
+    frozenset(_stem(word) for value in ABBREVIATIONS.values() for word in _words(value))
+# _stem is crude ("movies" -> "movy", "jokes" -> "jok"), so the plural of each word is stemmed too
+OFF_TOPIC_TERMS = frozenset(_stem(form) for word in OFF_TOPIC_WORDS for form in (word, word + "s"))
+
+
+def expand_abbreviations(query: str) -> str:
+    """Replace known short forms with their full forms"""
+    return _ABBREVIATION_RE.sub(lambda match: ABBREVIATIONS[match.group(1).lower()], query)
+
+
+def pre_refine(query: str) -> Tuple[str, str]:
+    """Returns (query, route) where route says how the query was handled.
+
+    - ``"local"``: abbreviations were expanded and the query is clear enough
+      to search with as-is.
+    - ``"off_topic"``: the query is obviously not about studying, the returned
+      query is the refiner's refusal.
+    - ``"llm"``: the (expanded) query still needs the LLM refiner, e.g. it
+      has unknown words that may be typos.
+    """
+    expanded = " ".join(expand_abbreviations(query).split())
+    # "what's" -> "what"
+    words = [_stem(word.split("'")[0].strip("-/")) for word in _words(expanded)]
+    words = [word for word in words if word and not word.isdigit()]
+    academic = [word for word in words if word in SYLLABUS_TERMS]
+    if not academic and any(word in OFF_TOPIC_TERMS for word in words):
+        route = "off_topic"
+    elif (LOCAL_REFINE and academic and len(words) <= LOCAL_REFINE_MAX_WORDS
+          and all(word in KNOWN_WORDS for word in words)):
+        route = "local"
+    else:
+        route = "llm"
+    pre_refine_stats[route] += 1
+    if route == "off_topic":
+        return OFF_TOPIC_REPLY, route
+    if route == "local":
+        expanded = expanded[:1].upper() + expanded[1:]
+    return expanded, route
+
+
+def get_pre_refine_stats() -> Dict:
+    """How many queries skipped the LLM refiner, and why"""
+    total = sum(pre_refine_stats.values())
+    skipped = pre_refine_stats["local"] + pre_refine_stats["off_topic"]
+    return {**pre_refine_stats, "skip_rate": round(skipped / total, 4) if total else 0.0}
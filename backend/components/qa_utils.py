@@ -2,34 +2,55 @@
 Utility functions for question answering with a vector database
 """
 
-from langchain.chains.conversation.memory import ConversationSummaryMemory
 from langchain.chains import LLMChain
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
+from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
 from langchain_chroma import Chroma
-from components.query_refine import refine_user_query
+from components.concurrency import llm_slot
+from components.context_builder import build_context, estimate_tokens
+from components.embedding_cache import get_embeddings
+from components.lexical_index import reciprocal_rank_fusion
+from components.metrics import record_llm_call, span
+from components.pre_refine import OFF_TOPIC_REPLY
+from components.query_refine import allm_refine, refine_locally
+from components.subject_shards import ShardedVectorStore
 from prompt.db_summary import template
 
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
-from typing import Dict, Any
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
+
+import numpy as np
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Chunks retrieved per question; the context builder keeps the prompt within CONTEXT_TOKEN_BUDGET
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "6"))
+# Search the raw question while it is being refined
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() in ("1", "true", "yes")
+# Cosine similarity above which the speculative results are used as-is
+SPECULATION_THRESHOLD = float(os.getenv("SPECULATION_THRESHOLD", "0.9"))
+
+# "vector" searches Chroma only, "hybrid" fuses it with the BM25 index
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+# Answer from BM25 alone, skipping the query embedding, when it is this confident
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "true").lower() in ("1", "true", "yes")
+LEXICAL_CONFIDENCE = float(os.getenv("LEXICAL_CONFIDENCE", "0.8"))
+
+speculation_stats = {"launched": 0, "reused": 0, "merged": 0, "cancelled": 0, "failed": 0}
+retrieval_stats = {"vector": 0, "hybrid": 0, "lexical_fast_path": 0}
+
 def load_vector_db_from_persist_dir(persist_directory: str):
     """Load a vector database from a persist directory"""
     if not os.path.exists(persist_directory):
         raise FileNotFoundError(f"Vector database directory not found: {persist_directory}")
 
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001",
-        google_api_key=GOOGLE_API_KEY,
-    )
-
     vectorstore = Chroma(
         persist_directory=persist_directory,
-        embedding_function=embeddings
+        embedding_function=get_embeddings()
     )
 
     return vectorstore
@@ -43,27 +64,323 @@ def create_qa_chain(vectorstore, model_name: str = "gemini-2.0-flash-001", tempe
     )
 
     prompt = PromptTemplate(
-        input_variables=["context", "query"],
+        input_variables=["history", "context", "query"],
         template=template
     )
     
     qa_chain = prompt | llm
     return qa_chain
 
-def answer_question(qa_chain, question: str, vectorstore) -> Dict[str, Any]:
-    question = refine_user_query(question)
+def _doc_sources(docs) -> List[Dict[str, Any]]:
+    """Unique (source, page) pairs of the retrieved documents, in rank order"""
+    seen = set()
+    sources = []
+    for doc in docs:
+        key = (doc.metadata.get("source", "Unknown"), doc.metadata.get("page"))
+        if key not in seen:
+            seen.add(key)
+            sources.append({"source": key[0], "page": key[1]})
+    return sources
+
+def _route(vectorstore, question: str):
+    """The shards of a sharded store the question is about, any other store as-is"""
+    if isinstance(vectorstore, ShardedVectorStore):
+        return vectorstore.for_query(question)
+    return vectorstore
+
+def _shards_of(vectorstore, store) -> Optional[List[str]]:
+    """The shards store (vectorstore routed to a question) searches, None when unsharded"""
+    return store.shards if isinstance(vectorstore, ShardedVectorStore) else None
+
+async def _asearch(text: str, vectorstore):
+    """Embed text and run the MMR search, returning (vector, docs, shards searched)"""
+    with span("speculative_search"):
+        vector = await vectorstore.embeddings.aembed_query(text)
+        store = _route(vectorstore, text)
+        docs = await store.amax_marginal_relevance_search_by_vector(vector, k=RETRIEVAL_K)
+    return vector, docs, _shards_of(vectorstore, store)
+
+def _merge_docs(primary, secondary, k: int):
+    """Rank-preserving union of two result lists, deduplicated on content"""
+    seen = set()
+    merged = []
+    for doc in list(primary) + list(secondary):
+        if doc.page_content in seen:
+            continue
+        seen.add(doc.page_content)
+        merged.append(doc)
+    return merged[:k]
+
+def _cosine(a, b) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / denom) if denom else 0.0
+
+def _abandon(task: "asyncio.Task"):
+    """Cancel a speculative search whose result is no longer needed"""
+    task.cancel()
+    # Retrieve any exception so it is not reported as never retrieved
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+def get_speculation_stats() -> Dict[str, Any]:
+    """How often speculative retrieval on the raw query was reused"""
+    finished = speculation_stats["reused"] + speculation_stats["merged"]
+    return {
+        **speculation_stats,
+        "reuse_rate": round(speculation_stats["reused"] / finished, 4) if finished else 0.0,
+    }
+
+def get_retrieval_stats() -> Dict[str, Any]:
+    """How many requests used each retrieval path"""
+    return dict(retrieval_stats)
+
+async def aretrieve_context(question: str, vectorstore, answer_cache=None, speculative: Optional[bool] = None,
+                            lexical_index=None) -> Dict[str, Any]:
+    """Refine the question and fetch its context, or a cached answer if one matches.
+
+    With speculative retrieval the raw question is embedded and searched while
+    the LLM refines it. The speculative results are reused when the refined
+    question is close enough to the raw one, otherwise they are merged with a
+    second search on the refined question. Questions refined without the LLM
+    (refine cache hits, pre-refined queries) are not speculated on.
+
+    With a BM25 lexical_index, a confident keyword match is answered from the
+    lexical results alone, without a query embedding; the answer cache is then
+    looked up by the refined question's text. In hybrid mode lexical and vector
+    results are fused by reciprocal rank.
+    """
+    if speculative is None:
+        speculative = SPECULATIVE_RETRIEVAL
+    timings = {}
+    started = time.perf_counter()
+    speculation = None
+    try:
+        with span("refine"):
+            refined, expanded = refine_locally(question)
+            timings["refine"] = "local" if refined is not None else "llm"
+            if refined is None:
+                # Only an LLM refinement leaves time to search while waiting
+                if speculative:
+                    speculation = asyncio.create_task(_asearch(question, vectorstore))
+                    speculation_stats["launched"] += 1
+                refined = await allm_refine(question, expanded)
+        question = refined
+    except BaseException:
+        if speculation is not None:
+            _abandon(speculation)
+        raise
+    timings["refine_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if not question or question == OFF_TOPIC_REPLY:
+        if speculation is not None:
+            _abandon(speculation)
+            speculation_stats["cancelled"] += 1
+        # Off-topic questions are refused without retrieval or generation
+        return {"question": question, "refused": bool(question), "timings": timings}
+
+    try:
+        return await _retrieve_refined(question, vectorstore, answer_cache, lexical_index, speculation, timings)
+    finally:
+        if speculation is not None:
+            # Stop it if still running, and consume its exception if it failed unobserved
+            _abandon(speculation)
+
+async def _retrieve_refined(question: str, vectorstore, answer_cache, lexical_index,
+                            speculation: Optional["asyncio.Task"], timings: Dict[str, Any]) -> Dict[str, Any]:
+    """aretrieve_context after refinement: the answer cache, then lexical, vector or hybrid retrieval"""
+    started = time.perf_counter()
+    lexical_docs = []
+    if lexical_index is not None and (LEXICAL_FAST_PATH or RETRIEVAL_MODE == "hybrid"):
+        with span("lexical"):
+            lexical_docs, confidence = lexical_index.search(question, k=RETRIEVAL_K * 3)
+        timings["lexical_confidence"] = round(confidence, 4)
+        if LEXICAL_FAST_PATH and confidence >= LEXICAL_CONFIDENCE:
+            if speculation is not None:
+                _abandon(speculation)
+                speculation_stats["cancelled"] += 1
+            timings["retrieval"] = "lexical"
+            retrieval_stats["lexical_fast_path"] += 1
+            if answer_cache is not None:
+                with span("cache_lookup"):
+                    cached = answer_cache.lookup_query(question)
+                if cached is not None:
+                    timings["retrieve_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                    return {"question": question, "cached": cached, "timings": timings}
+            context, docs = build_context(lexical_docs[:RETRIEVAL_K])
+            timings["context_tokens"] = estimate_tokens(context)
+            timings["retrieve_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return {
+                "question": question,
+                "query_vector": None,
+                "docs": docs,
+                "context": context,
+                "timings": timings,
+            }
+
+    # Embed once: the vector keys the answer cache and drives the MMR search
+    with span("embed"):
+        query_vector = await vectorstore.embeddings.aembed_query(question)
+    if answer_cache is not None:
+        with span("cache_lookup"):
+            cached = answer_cache.lookup(query_vector)
+        if cached is not None:
+            if speculation is not None:
+                _abandon(speculation)
+                speculation_stats["cancelled"] += 1
+            timings["retrieve_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            return {"question": question, "cached": cached, "timings": timings}
+
+    with span("retrieve"):
+        # A sharded store only searches the subjects the refined question is about
+        store = _route(vectorstore, question)
+        if isinstance(vectorstore, ShardedVectorStore):
+            timings["shards"] = store.shards
+        speculated = None
+        if speculation is not None:
+            try:
+                speculated = await speculation
+            except Exception as e:
+                # The refined search alone can still answer
+                print("[WARN] Speculative search failed:", e)
+                timings["speculation"] = "failed"
+                speculation_stats["failed"] += 1
+        if speculated is not None:
+            raw_vector, raw_docs, raw_shards = speculated
+            similarity = _cosine(raw_vector, query_vector)
+            timings["speculation_similarity"] = round(similarity, 4)
+            # Reused only if the raw question searched the same shards the refined one is routed to
+            if similarity >= SPECULATION_THRESHOLD and raw_shards == _shards_of(vectorstore, store):
+                docs = raw_docs
+                timings["speculation"] = "reused"
+                speculation_stats["reused"] += 1
+            else:
+                refined_docs = await store.amax_marginal_relevance_search_by_vector(query_vector, k=RETRIEVAL_K)
+                docs = _merge_docs(refined_docs, raw_docs, RETRIEVAL_K)
+                timings["speculation"] = "merged"
+                speculation_stats["merged"] += 1
+        else:
+            docs = await store.amax_marginal_relevance_search_by_vector(query_vector, k=RETRIEVAL_K)
+        if RETRIEVAL_MODE == "hybrid" and lexical_docs:
+            docs = reciprocal_rank_fusion([docs, lexical_docs], k=RETRIEVAL_K)
+            timings["retrieval"] = "hybrid"
+            retrieval_stats["hybrid"] += 1
+        else:
+            timings["retrieval"] = "vector"
+            retrieval_stats["vector"] += 1
+    context, docs = build_context(docs)
+    timings["context_tokens"] = estimate_tokens(context)
+    timings["retrieve_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return {
+        "question": question,
+        "query_vector": query_vector,
+        "docs": docs,
+        "context": context,
+        "timings": timings,
+    }
+
+async def aanswer_question(qa_chain, question: str, vectorstore, answer_cache=None, speculative: Optional[bool] = None,
+                           lexical_index=None, history: str = "", index_version: Optional[str] = None) -> Dict[str, Any]:
+    """Answer a question; history is the session's conversation so far, if any.
+
+    index_version identifies the index vectorstore belongs to, so an answer
+    finished after a newer index was published is not cached.
+    """
+    retrieved = await aretrieve_context(question, vectorstore, answer_cache, speculative=speculative,
+                                        lexical_index=lexical_index)
+    question = retrieved["question"]
     if not question:
         return {"answer": "Unable to refine the question", "sources": []}
-    retriver = vectorstore.as_retriever(search_type = "mmr", search_kwargs={"k": 3})
-    docs = retriver.invoke(question)
-    context = "\n".join([doc.page_content for doc in docs])
-    result = qa_chain.invoke({"query": question, "context": context})
+    if retrieved.get("refused"):
+        return {"answer": question, "sources": []}
+    if "cached" in retrieved:
+        cached = retrieved["cached"]
+        cached["cached"] = True
+        return cached
+    with span("generate"):
+        async with llm_slot():
+            result = await qa_chain.ainvoke({"query": question, "context": retrieved["context"], "history": history})
+    record_llm_call("answer", result)
     answer = result.content
-    return {
+    response = {
         "answer": answer
     }
+    if answer_cache is not None:
+        answer_cache.store(question, retrieved["query_vector"], response, index_version=index_version)
+        response = {**response, "cached": False}
+    return response
+
+def answer_question(qa_chain, question: str, vectorstore, answer_cache=None, speculative: Optional[bool] = None,
+                    lexical_index=None, history: str = "") -> Dict[str, Any]:
+    """Blocking wrapper around aanswer_question for scripts (not for use inside an event loop)"""
+    return asyncio.run(aanswer_question(qa_chain, question, vectorstore, answer_cache, speculative=speculative,
+                                        lexical_index=lexical_index, history=history))
+
+async def _generate_into(queue: "asyncio.Queue", qa_chain, inputs: Dict[str, Any]):
+    """Stream the answer into queue inside an LLM slot, then put None.
+
+    The slot is released as soon as the model is done, however slowly the
+    client reads the tokens off the queue.
+    """
+    try:
+        async with llm_slot():
+            async for chunk in qa_chain.astream(inputs):
+                queue.put_nowait(chunk)
+    finally:
+        queue.put_nowait(None)
+
+async def astream_answer(qa_chain, question: str, vectorstore, answer_cache=None, speculative: Optional[bool] = None,
+                         lexical_index=None, history: str = "",
+                         index_version: Optional[str] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ("token", ...) events as the answer is generated, then one ("done", ...) event"""
+    started = time.perf_counter()
+    retrieved = await aretrieve_context(question, vectorstore, answer_cache, speculative=speculative,
+                                        lexical_index=lexical_index)
+    question = retrieved["question"]
+    timings = retrieved["timings"]
+    if not question or retrieved.get("refused"):
+        yield "token", {"text": question or "Unable to refine the question"}
+        yield "done", {"sources": [], "cached": False, "timings": timings}
+        return
+    if "cached" in retrieved:
+        cached = retrieved["cached"]
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        yield "token", {"text": cached["answer"]}
+        yield "done", {"sources": cached.get("sources", []), "cached": True, "timings": timings}
+        return
 
+    sources = _doc_sources(retrieved["docs"])
+    parts = []
+    # Chunks add up their usage metadata, the last sum carries the token counts
+    message = None
+    queue: asyncio.Queue = asyncio.Queue()
+    inputs = {"query": question, "context": retrieved["context"], "history": history}
+    generation = asyncio.create_task(_generate_into(queue, qa_chain, inputs))
+    try:
+        with span("generate"):
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                message = chunk if message is None else message + chunk
+                if not chunk.content:
+                    continue
+                if not parts:
+                    timings["first_token_ms"] = round((time.perf_counter() - started) * 1000, 1)
+                parts.append(chunk.content)
+                yield "token", {"text": chunk.content}
+            # Raises if the model stream failed
+            await generation
+    finally:
+        # The client went away before the answer was complete
+        if not generation.done():
+            generation.cancel()
+    record_llm_call("answer", message)
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
 
+    if answer_cache is not None:
+        answer_cache.store(question, retrieved["query_vector"], {"answer": "".join(parts), "sources": sources},
+                           index_version=index_version)
+    yield "done", {"sources": sources, "cached": False, "timings": timings}
 
 
 
@@ -5,6 +5,10 @@ import os
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from prompt.db_summary import  Summary
+from components.cache_utils import LRUTTLCache
+from components.concurrency import llm_slot
+from components.metrics import record_llm_call
+from components.pre_refine import get_pre_refine_stats, pre_refine
 from dotenv import load_dotenv
 
 
@@ -13,12 +17,12 @@ load_dotenv()
 
 google_api_key = os.getenv("GOOGLE_API_KEY")
 
-def refine_user_query(query):
-
-    
+# Refinements are memoized on the normalized query text
+REFINE_CACHE_SIZE = int(os.getenv("REFINE_CACHE_SIZE", "1024"))
+REFINE_CACHE_TTL = float(os.getenv("REFINE_CACHE_TTL", str(24 * 3600)))
 
 
-    prompt = PromptTemplate(
+prompt = PromptTemplate(
     input_variables=["query"],
     template="""
 You are a helpful assistant. Your task is to revise the user's query to make it clearer and simpler by doing the following:
@@ -60,18 +64,75 @@ Created or Author by **Mayank Gupta**, you exist to **empower students** by maki
 
 ### Revised Query:
 """
+).partial(Summary=Summary)
+
+# Built once and shared by every request
+llm = ChatGoogleGenerativeAI(
+    model = "gemini-2.0-flash-001",
+    google_api_key=google_api_key,
+    temperature = 0
 )
 
-    llm = ChatGoogleGenerativeAI(
-        model = "gemini-2.0-flash-001",
-        google_api_key=google_api_key,
-        temperature = 0
-    )
+llm_chain = prompt | llm
+
+refine_cache = LRUTTLCache(maxsize=REFINE_CACHE_SIZE, ttl=REFINE_CACHE_TTL)
+
 
-    llm_chain = prompt | llm
-    response = llm_chain.invoke({"query": query, "Summary" : Summary}  )
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and strip surrounding punctuation."""
+    return " ".join(query.casefold().split()).strip(" ?!.,;:")
 
-    return response.content
+
+def refine_locally(query):
+    """Returns (refined, expanded). refined is set when no LLM call is needed:
+    a cached refinement, or a clear or off-topic query the pre-refiner handled.
+    Otherwise expanded is the query to send to the LLM refiner."""
+    cached = refine_cache.get(normalize_query(query))
+    if cached is not None:
+        return cached, query
+
+    # Clear and off-topic queries are handled locally, the rest go to the LLM already expanded
+    expanded, route = pre_refine(query)
+    if route != "llm":
+        return expanded, expanded
+    return None, expanded
+
+
+def refine_user_query(query):
+    refined, expanded = refine_locally(query)
+    if refined is not None:
+        return refined
+
+    response = llm_chain.invoke({"query": expanded})
+    record_llm_call("refine", response)
+    refined = response.content
+    if refined:
+        refine_cache.set(normalize_query(query), refined)
+    return refined
+
+
+async def allm_refine(query, expanded):
+    """Refine with the LLM; expanded comes from refine_locally(query)."""
+    async with llm_slot():
+        response = await llm_chain.ainvoke({"query": expanded})
+    record_llm_call("refine", response)
+    refined = response.content
+    if refined:
+        refine_cache.set(normalize_query(query), refined)
+    return refined
+
+
+async def arefine_user_query(query):
+    """Async variant of refine_user_query sharing the same cache."""
+    refined, expanded = refine_locally(query)
+    if refined is not None:
+        return refined
+    return await allm_refine(query, expanded)
+
+
+def get_refine_cache_stats():
+    """Hit/miss counters of the refinement cache, and how often the LLM was skipped."""
+    return {**refine_cache.stats(), "pre_refine": get_pre_refine_stats()}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,299 @@
+"""
+Conversation sessions with a bounded, incrementally updated rolling summary
+"""
+import asyncio
+import glob
+import hashlib
+import os
+import pickle
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from components.cache_utils import LRUTTLCache
+from components.concurrency import llm_slot
+from components.metrics import record_llm_call
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "2000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(2 * 3600)))
+# Sessions pushed out of memory are written here and reloaded on their next question
+SESSION_SPILL_DIR = os.getenv("SESSION_SPILL_DIR") or None
+# Exchanges kept verbatim; older ones are folded into the summary
+SESSION_RECENT_TURNS = int(os.getenv("SESSION_RECENT_TURNS", "2"))
+SESSION_ANSWER_CHARS = 600
+SESSION_SUMMARY_MAX_WORDS = 150
+# Exchanges waiting to be summarized; beyond this (summaries failing) the oldest are dropped
+SESSION_MAX_UNSUMMARIZED = 4
+# Follow-ups are rewritten into standalone questions before refinement and retrieval
+SESSION_CONDENSE = os.getenv("SESSION_CONDENSE", "true").lower() in ("1", "true", "yes")
+# Follow-ups this short are always rewritten, longer ones only when they refer back
+SESSION_CONDENSE_MAX_WORDS = 6
+REFERRING_WORDS = frozenset("""
+    it its this that these those they them their above previous earlier same another other more else again also
+    one ones former latter similar instead
+""".split())
+
+SUMMARY_TEMPLATE = """
+Progressively summarize a study session between a student and a tutor bot.
+Extend the current summary with the new exchange and return only the new summary, in at most {max_words} words.
+Keep the subjects, topics and problems discussed and what the student struggled with; drop greetings and formatting.
+
+Current summary:
+{summary}
+
+New exchange:
+Student: {question}
+Tutor: {answer}
+
+New summary:
+"""
+
+CONDENSE_TEMPLATE = """
+Rewrite the student's follow-up so it can be understood without the conversation, for searching study notes.
+Replace words like "it", "that" or "another one" with what they refer to and otherwise keep the student's wording.
+Do not answer it. If it already stands on its own, return it unchanged. Return only the question.
+
+{history}
+Follow-up: {question}
+
+Standalone question:
+"""
+
+_summary_chain = None
+_condense_chain = None
+
+
+def get_summary_chain():
+    """Summarization chain, built on the first fold so importing this module stays cheap"""
+    global _summary_chain
+    if _summary_chain is None:
+        from langchain.prompts import PromptTemplate
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        summary_prompt = PromptTemplate(
+            input_variables=["summary", "question", "answer"],
+            template=SUMMARY_TEMPLATE,
+        ).partial(max_words=str(SESSION_SUMMARY_MAX_WORDS))
+        summary_llm = ChatGoogleGenerativeAI(
+            model="gemini-2.0-flash-001",
+            google_api_key=GOOGLE_API_KEY,
+            temperature=0
+        )
+        _summary_chain = summary_prompt | summary_llm
+    return _summary_chain
+
+
+def get_condense_chain():
+    """Follow-up rewriting chain, built on first use"""
+    global _condense_chain
+    if _condense_chain is None:
+        from langchain.prompts import PromptTemplate
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        condense_prompt = PromptTemplate(
+            input_variables=["history", "question"],
+            template=CONDENSE_TEMPLATE,
+        )
+        condense_llm = ChatGoogleGenerativeAI(
+            model="gemini-2.0-flash-001",
+            google_api_key=GOOGLE_API_KEY,
+            temperature=0
+        )
+        _condense_chain = condense_prompt | condense_llm
+    return _condense_chain
+
+
+def needs_condensing(question: str) -> bool:
+    """Whether a follow-up may depend on the conversation: short, or referring back"""
+    words = re.findall(r"[a-z]+", question.lower())
+    return len(words) <= SESSION_CONDENSE_MAX_WORDS or any(word in REFERRING_WORDS for word in words)
+
+
+def _clip_words(text: str, max_words: int) -> str:
+    words = text.split()
+    return text.strip() if len(words) <= max_words else " ".join(words[:max_words]) + " ..."
+
+
+def _clip_chars(text: str, max_chars: int) -> str:
+    return text if len(text) <= max_chars else text[:max_chars].rsplit(" ", 1)[0] + " ..."
+
+
+def _log_fold_failure(task: "asyncio.Task"):
+    if not task.cancelled() and task.exception() is not None:
+        print("[WARN] Session summary update failed:", task.exception())
+
+
+class ConversationSession:
+    """Rolling summary plus the last few exchanges of one conversation"""
+
+    def __init__(self, session_id: str):
+        self.id = session_id
+        self.summary = ""
+        self.recent: List[Tuple[str, str]] = []
+        # Exchanges that left the recent window but are not in the summary yet
+        self.unsummarized: List[Tuple[str, str]] = []
+        self.turns = 0
+        self.updated_at = time.time()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_lock"] = None
+        return state
+
+    def history(self) -> str:
+        """Conversation so far, for the {history} prompt variable ("" for a new session)"""
+        if not self.summary and not self.recent and not self.unsummarized:
+            return ""
+        lines = ["# Conversation so far"]
+        if self.summary:
+            lines.append(f"Summary of earlier questions: {self.summary}")
+        # Folding runs in the background, until it catches up show those turns verbatim
+        for question, answer in self.unsummarized + self.recent:
+            lines.append(f"Student: {question}")
+            lines.append(f"Tutor: {answer}")
+        return "\n".join(lines) + "\n"
+
+    def record(self, question: str, answer: str):
+        self.turns += 1
+        self.updated_at = time.time()
+        self.recent.append((question, _clip_chars(answer, SESSION_ANSWER_CHARS)))
+        while len(self.recent) > SESSION_RECENT_TURNS:
+            self.unsummarized.append(self.recent.pop(0))
+        # If summarizing keeps failing, forget the oldest turns rather than grow
+        del self.unsummarized[:-SESSION_MAX_UNSUMMARIZED]
+
+    async def fold(self):
+        """Merge the exchanges that left the recent window into the summary, one LLM call each"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while self.unsummarized:
+                turn = self.unsummarized[0]
+                question, answer = turn
+                async with llm_slot():
+                    response = await get_summary_chain().ainvoke({
+                        "summary": self.summary or "(empty)",
+                        "question": question,
+                        "answer": answer,
+                    })
+                record_llm_call("summary", response)
+                self.summary = _clip_words(response.content, SESSION_SUMMARY_MAX_WORDS)
+                if turn in self.unsummarized:
+                    self.unsummarized.remove(turn)
+
+
+class SessionStore:
+    """Sessions in an LRU/TTL cache, spilling evicted ones to disk when SESSION_SPILL_DIR is set"""
+
+    def __init__(self, maxsize: int = SESSION_MAX, ttl: float = SESSION_TTL, spill_dir: Optional[str] = SESSION_SPILL_DIR):
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self._sessions = LRUTTLCache(maxsize=maxsize, ttl=ttl, on_evict=self._spill if spill_dir else None)
+        self._folds = set()
+        self.created = 0
+        self.spilled = 0
+        self.restored = 0
+        self.condensed = 0
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def _spill_path(self, session_id: str) -> str:
+        digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.spill_dir, f"{digest}.pkl")
+
+    def _spill(self, session_id: str, session: ConversationSession):
+        path = self._spill_path(session_id)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(session, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            self.spilled += 1
+        except OSError as e:
+            print("[WARN] Could not spill session to disk:", e)
+        if self.spilled % 100 == 0:
+            self.purge_spilled()
+
+    def _restore(self, session_id: str) -> Optional[ConversationSession]:
+        path = self._spill_path(session_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            expired = time.time() - os.path.getmtime(path) > self.ttl
+            session = None
+            if not expired:
+                with open(path, "rb") as f:
+                    session = pickle.load(f)
+        except Exception as e:
+            print("[WARN] Dropping unreadable spilled session:", e)
+            session = None
+        os.remove(path)
+        if session is not None:
+            self.restored += 1
+        return session
+
+    def purge_spilled(self):
+        """Delete spilled sessions older than the TTL"""
+        cutoff = time.time() - self.ttl
+        for path in glob.glob(os.path.join(self.spill_dir, "*.pkl")):
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, session_id: str) -> ConversationSession:
+        """The session for session_id, restored from disk or created if needed"""
+        session = self._sessions.get(session_id)
+        if session is None and self.spill_dir:
+            session = self._restore(session_id)
+        if session is None:
+            session = ConversationSession(session_id)
+            self.created += 1
+        self._sessions.set(session_id, session)
+        return session
+
+    async def condense(self, session: ConversationSession, question: str) -> str:
+        """The follow-up as a standalone question, resolved against the session's history.
+
+        Refinement and retrieval only see this question, so "give another
+        example of that" must name what "that" is. Questions that stand on
+        their own, and first questions, are returned as they are.
+        """
+        history = session.history()
+        if not SESSION_CONDENSE or not history or not needs_condensing(question):
+            return question
+        async with llm_slot():
+            response = await get_condense_chain().ainvoke({"history": history, "question": question})
+        record_llm_call("condense", response)
+        standalone = response.content.strip()
+        if not standalone:
+            return question
+        self.condensed += 1
+        return standalone
+
+    def record(self, session: ConversationSession, question: str, answer: str):
+        """Add an exchange and update the summary in the background"""
+        session.record(question, answer)
+        self._sessions.set(session.id, session)
+        if session.unsummarized:
+            task = asyncio.ensure_future(session.fold())
+            self._folds.add(task)
+            task.add_done_callback(self._folds.discard)
+            task.add_done_callback(_log_fold_failure)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._sessions.stats(),
+            "created": self.created,
+            "spilled": self.spilled,
+            "restored": self.restored,
+            "condensed": self.condensed,
+            "summaries_pending": len(self._folds),
+        }
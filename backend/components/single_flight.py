@@ -0,0 +1,128 @@
+"""
+Single-flight coalescing: identical requests in flight at the same time share one execution
+"""
+import asyncio
+import weakref
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class _StreamFlight:
+    """Events of one running stream, replayed to every subscriber from the start"""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def push(self, event: Any):
+        self.events.append(event)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def replay(self) -> AsyncIterator[Any]:
+        position = 0
+        while True:
+            while position < len(self.events):
+                yield self.events[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key onto one running task.
+
+    The shared work runs in its own task, so a caller that disconnects does not
+    cancel it for the others. Keys only match within one event loop.
+    """
+
+    def __init__(self):
+        self._calls: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, asyncio.Task]]" = \
+            weakref.WeakKeyDictionary()
+        self._streams: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Hashable, _StreamFlight]]" = \
+            weakref.WeakKeyDictionary()
+        self.leaders = 0
+        self.coalesced = 0
+        self.stream_leaders = 0
+        self.stream_coalesced = 0
+        # Strong references to running streams, the loop only keeps weak ones
+        self._pumps = set()
+
+    def _table(self, tables: weakref.WeakKeyDictionary) -> Dict:
+        loop = asyncio.get_running_loop()
+        table = tables.get(loop)
+        if table is None:
+            table = tables[loop] = {}
+        return table
+
+    async def run(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Await fn() or join the identical call already in flight; returns (result, coalesced)"""
+        calls = self._table(self._calls)
+        task = calls.get(key)
+        coalesced = task is not None
+        if coalesced:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            calls[key] = task
+            task.add_done_callback(lambda t: calls.get(key) is t and calls.pop(key))
+            # Nobody may be left to await a failure if every caller disconnected
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task), coalesced
+
+    async def stream(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Tuple[Any, bool]]:
+        """Iterate factory() or join the identical stream in flight; yields (event, coalesced)"""
+        streams = self._table(self._streams)
+        flight = streams.get(key)
+        coalesced = flight is not None
+        if coalesced:
+            self.stream_coalesced += 1
+        else:
+            self.stream_leaders += 1
+            flight = streams[key] = _StreamFlight()
+
+            async def pump():
+                try:
+                    async for event in factory():
+                        flight.push(event)
+                except BaseException as e:
+                    flight.finish(e)
+                else:
+                    flight.finish()
+                finally:
+                    if streams.get(key) is flight:
+                        del streams[key]
+
+            task = asyncio.ensure_future(pump())
+            self._pumps.add(task)
+            task.add_done_callback(self._pumps.discard)
+        async for event in flight.replay():
+            yield event, coalesced
+
+    def in_flight(self) -> int:
+        return sum(len(table) for table in self._calls.values()) + sum(len(table) for table in self._streams.values())
+
+    def stats(self) -> Dict[str, Any]:
+        requests = self.leaders + self.coalesced + self.stream_leaders + self.stream_coalesced
+        coalesced = self.coalesced + self.stream_coalesced
+        return {
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "stream_leaders": self.stream_leaders,
+            "stream_coalesced": self.stream_coalesced,
+            "in_flight": self.in_flight(),
+            "coalesce_rate": round(coalesced / requests, 4) if requests else 0.0,
+        }
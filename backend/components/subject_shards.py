@@ -0,0 +1,364 @@
+"""
+Subject shards: one Chroma collection per subject, with questions routed to the shards they are about
+"""
+import asyncio
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_chroma import Chroma
+
+from components.lexical_index import reciprocal_rank_fusion, tokenize
+
+# Split new indexes into subject shards. Turning it on also migrates an existing unsharded
+# index into shards on its next ingest. An index that is sharded already stays sharded.
+SUBJECT_SHARDS = os.getenv("SUBJECT_SHARDS", "false").lower() in ("1", "true", "yes")
+# JSON object replacing the default rules, e.g. {"maths": ["probability", "bayes theorem"], ...}
+SHARD_RULES_PATH = os.getenv("SHARD_RULES_PATH") or None
+# Rule hits a chunk needs before it is assigned to a subject on its own evidence
+SHARD_MIN_SCORE = int(os.getenv("SHARD_MIN_SCORE", "2"))
+# A question also searches every subject scoring at least this fraction of the best one
+SHARD_ROUTE_RATIO = float(os.getenv("SHARD_ROUTE_RATIO", "0.5"))
+# The winning subject must beat the runner-up by this factor, otherwise the chunk is ambiguous
+SHARD_MARGIN = 1.5
+
+# Chunks no rule claims; always searched
+GENERAL_SHARD = "general"
+# langchain_chroma's default collection, where unsharded indexes keep their chunks
+UNSHARDED_COLLECTION = "langchain"
+# Lists the shards of a persist directory; its presence marks the index as sharded
+SHARDS_FILE = "shards.json"
+
+# The three subjects of prompt/db_summary.Summary
+DEFAULT_SHARD_RULES = {
+    "maths": """
+        statistics statistical probability probabilities mean median mode variance deviation dispersion
+        quartile percentile correlation regression covariance bayes binomial poisson gaussian distribution
+        hypothesis hypotheses estimation estimator confidence sample sampling population random variable
+        expectation expected z-score p-value significance conditional independent events outcome
+        "central tendency" "standard deviation" "normal distribution" "confidence interval" "null hypothesis"
+    """,
+    "webdev": """
+        html css javascript dom react component props hooks usestate useeffect usecontext jsx http api fetch
+        json frontend backend browser element selector flexbox stylesheet promise await async event
+        listener render lifecycle request response endpoint url rest server client tag attribute
+        "web development" "event listener" "http method"
+    """,
+    "dsa": """
+        array stack queue tree graph sorting sort searching recursion recursive algorithm complexity heap
+        hash hashing bfs dfs traversal vertex vertices edge pointer python bubble insertion merge quicksort
+        memoization subproblem node "linked list" "binary search" "dynamic programming" "time complexity"
+        "data structure" "big o"
+    """,
+}
+
+_SHARD_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,40}$")
+
+shard_stats: Dict[str, Any] = {"queries": 0, "shards_searched": 0, "routed": Counter(), "fallback_all": 0}
+
+
+def _norm(token: str) -> str:
+    # Plurals count as the singular
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def _terms(text: str) -> List[str]:
+    return [_norm(token) for token in tokenize(text)]
+
+
+def _parse_rules(rules: Dict[str, Any]) -> Dict[str, Dict[str, List]]:
+    """Split each subject's rules into single words and phrases, normalized like the text they match"""
+    parsed = {}
+    for shard, entries in rules.items():
+        if not _SHARD_NAME_RE.match(shard) or shard == GENERAL_SHARD:
+            raise ValueError(f"Invalid shard name: {shard!r}")
+        if isinstance(entries, str):
+            entries = re.findall(r'"([^"]+)"|(\S+)', entries)
+            entries = [phrase or word for phrase, word in entries]
+        words, phrases = set(), []
+        for entry in entries:
+            terms = _terms(entry)
+            if len(terms) == 1:
+                words.add(terms[0])
+            elif terms:
+                phrases.append(" ".join(terms))
+        parsed[shard] = {"words": words, "phrases": phrases}
+    return parsed
+
+
+def _load_rules() -> Dict[str, Dict[str, List]]:
+    rules = DEFAULT_SHARD_RULES
+    if SHARD_RULES_PATH and os.path.exists(SHARD_RULES_PATH):
+        with open(SHARD_RULES_PATH) as f:
+            rules = json.load(f)
+    return _parse_rules(rules)
+
+
+SHARD_RULES = _load_rules()
+
+
+def shard_names() -> List[str]:
+    """Every shard the rules can assign a chunk to"""
+    return sorted(SHARD_RULES) + [GENERAL_SHARD]
+
+
+def collection_name(shard: str) -> str:
+    return f"subject_{shard}"
+
+
+def shard_scores(text: str) -> Dict[str, int]:
+    """Rule hits per subject; subjects without any are left out"""
+    terms = _terms(text)
+    counts = Counter(terms)
+    joined = f" {' '.join(terms)} "
+    scores = {}
+    for shard, rules in SHARD_RULES.items():
+        score = sum(counts[word] for word in rules["words"]) + \
+            sum(joined.count(f" {phrase} ") for phrase in rules["phrases"])
+        if score:
+            scores[shard] = score
+    return scores
+
+
+def _winner(scores: Dict[str, int], min_score: int) -> Optional[str]:
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    if not ranked or ranked[0][1] < min_score:
+        return None
+    if len(ranked) > 1 and ranked[0][1] < ranked[1][1] * SHARD_MARGIN:
+        return None
+    return ranked[0][0]
+
+
+def assign_shards(texts: List[str]) -> List[str]:
+    """Shard of each chunk of one file.
+
+    A chunk with a clear subject goes to that subject. Ambiguous chunks
+    (definitions, worked numbers, exercises) follow the subject of the file
+    as a whole, or go to the general shard if the file is mixed too.
+    """
+    scores = [shard_scores(text) for text in texts]
+    totals: Counter = Counter()
+    for chunk_scores in scores:
+        totals.update(chunk_scores)
+    file_shard = _winner(totals, SHARD_MIN_SCORE)
+    return [_winner(chunk_scores, SHARD_MIN_SCORE) or file_shard or GENERAL_SHARD for chunk_scores in scores]
+
+
+def route_query(question: str, available: Optional[Iterable[str]] = None) -> List[str]:
+    """Shards a question should search, best match first.
+
+    Every subject scoring at least SHARD_ROUTE_RATIO of the best one is
+    searched, plus the general shard. A question no rule matches searches
+    every shard.
+    """
+    available = list(available) if available is not None else shard_names()
+    scores = {shard: score for shard, score in shard_scores(question).items() if shard in available}
+    shard_stats["queries"] += 1
+    if not scores:
+        shard_stats["fallback_all"] += 1
+        routed = list(available)
+    else:
+        best = max(scores.values())
+        routed = [shard for shard, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)
+                  if score >= best * SHARD_ROUTE_RATIO]
+        if GENERAL_SHARD in available:
+            routed.append(GENERAL_SHARD)
+    shard_stats["shards_searched"] += len(routed)
+    shard_stats["routed"].update(routed)
+    return routed
+
+
+def get_shard_stats() -> Dict[str, Any]:
+    """How many shards questions were routed to"""
+    queries = shard_stats["queries"]
+    return {
+        "enabled": SUBJECT_SHARDS,
+        "queries": queries,
+        "fallback_all": shard_stats["fallback_all"],
+        "avg_shards_searched": round(shard_stats["shards_searched"] / queries, 2) if queries else 0.0,
+        "routed": dict(shard_stats["routed"]),
+    }
+
+
+def _count(store) -> int:
+    if hasattr(store, "_collection"):
+        return store._collection.count()
+    return len(store)
+
+
+class ShardView:
+    """The shards one question was routed to, searched like a single store"""
+
+    def __init__(self, stores: Dict[str, Any]):
+        self.stores = stores
+        self.shards = list(stores)
+
+    @property
+    def embeddings(self):
+        return next(iter(self.stores.values())).embeddings
+
+    async def amax_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        if len(self.stores) == 1:
+            store = next(iter(self.stores.values()))
+            return await store.amax_marginal_relevance_search_by_vector(embedding, k=k, **kwargs)
+        results = await asyncio.gather(*(store.amax_marginal_relevance_search_by_vector(embedding, k=k, **kwargs)
+                                         for store in self.stores.values()))
+        return reciprocal_rank_fusion(list(results), k=k)
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        results = [store.max_marginal_relevance_search_by_vector(embedding, k=k, **kwargs)
+                   for store in self.stores.values()]
+        return results[0] if len(results) == 1 else reciprocal_rank_fusion(results, k=k)
+
+
+class ShardedVectorStore:
+    """One vector store per subject behind the calls ingestion and retrieval make.
+
+    Not a full LangChain VectorStore: searches go through ``for_query()``,
+    which narrows them to the shards the question is routed to. Searching the
+    store itself covers every shard. Writes are routed by each chunk's
+    ``shard`` metadata.
+    """
+
+    def __init__(self, shards: Dict[str, Any]):
+        if not shards:
+            raise ValueError("A sharded store needs at least one shard")
+        self.shards = shards
+        # Snapshots are never written to, so the sizes taken here stay valid for routing
+        self.sizes = self.counts()
+
+    @property
+    def embeddings(self):
+        return next(iter(self.shards.values())).embeddings
+
+    def counts(self) -> Dict[str, int]:
+        return {shard: _count(store) for shard, store in self.shards.items()}
+
+    def __len__(self) -> int:
+        return sum(self.counts().values())
+
+    def for_query(self, question: str) -> ShardView:
+        """The non-empty shards question is routed to"""
+        available = [shard for shard, size in self.sizes.items() if size]
+        routed = route_query(question, available) if available else []
+        return ShardView({shard: self.shards[shard] for shard in routed} or self.shards)
+
+    async def amax_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        return await ShardView(self.shards).amax_marginal_relevance_search_by_vector(embedding, k=k, **kwargs)
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs):
+        return ShardView(self.shards).max_marginal_relevance_search_by_vector(embedding, k=k, **kwargs)
+
+    def get(self, **kwargs) -> Dict[str, List]:
+        """Chroma-style ``get`` over every shard, results concatenated"""
+        merged: Dict[str, List] = defaultdict(list)
+        for store in self.shards.values():
+            result = store.get(**kwargs)
+            for key in ("ids", "documents", "metadatas", "embeddings"):
+                if result.get(key) is not None:
+                    merged[key].extend(list(result[key]))
+        merged.setdefault("ids", [])
+        return dict(merged)
+
+    def delete(self, ids: List[str]):
+        for store in self.shards.values():
+            store.delete(ids=ids)
+
+    def upsert(self, ids: List[str], embeddings: List, documents: List[str], metadatas: List[Dict]):
+        """Write pre-embedded chunks to the collection named by their ``shard`` metadata"""
+        groups: Dict[str, List[int]] = defaultdict(list)
+        for position, metadata in enumerate(metadatas):
+            groups[metadata.get("shard", GENERAL_SHARD)].append(position)
+        for shard, positions in groups.items():
+            if shard not in self.shards:
+                raise ValueError(f"Unknown shard: {shard}")
+            self.shards[shard]._collection.upsert(
+                ids=[ids[i] for i in positions],
+                embeddings=[embeddings[i] for i in positions],
+                documents=[documents[i] for i in positions],
+                metadatas=[metadatas[i] for i in positions],
+            )
+
+
+def read_shard_manifest(persist_dir: str) -> Optional[Dict[str, int]]:
+    """Chunk count per shard of a sharded index, or None if the index is not sharded"""
+    path = os.path.join(persist_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["shards"]
+
+
+def shard_generation(persist_dir: str) -> int:
+    """How many times chunks were redistributed between the shards of persist_dir, 0 if unsharded"""
+    path = os.path.join(persist_dir, SHARDS_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get("generation", 0)
+
+
+def write_shard_manifest(persist_dir: str, store: ShardedVectorStore, redistributed: bool = False):
+    """Record the shards of store; redistributed marks a migration or rebuild that moved chunks between them"""
+    path = os.path.join(persist_dir, SHARDS_FILE)
+    generation = shard_generation(persist_dir) + redistributed
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"shards": store.counts(), "generation": generation}, f)
+    os.replace(tmp_path, path)
+
+
+def open_sharded_chroma(persist_dir: str, embedding) -> ShardedVectorStore:
+    """Every shard collection of persist_dir, including shards the current rules no longer produce"""
+    names = set(shard_names()) | set(read_shard_manifest(persist_dir) or ())
+    return ShardedVectorStore({
+        name: Chroma(collection_name=collection_name(name), persist_directory=persist_dir,
+                     embedding_function=embedding)
+        for name in sorted(names)
+    })
+
+
+def migrate_unsharded(persist_dir: str, store: ShardedVectorStore, embedding, batch_size: int = 2000) -> int:
+    """Move the chunks of an unsharded index into the shards, reusing their stored embeddings"""
+    unsharded = Chroma(persist_directory=persist_dir, embedding_function=embedding)
+    data = unsharded.get(include=["embeddings", "documents", "metadatas"])
+    total = len(data["ids"])
+    if total:
+        # Classify file by file so ambiguous chunks can follow their file's subject
+        by_source: Dict[str, List[int]] = defaultdict(list)
+        for position, metadata in enumerate(data["metadatas"]):
+            by_source[(metadata or {}).get("source", "")].append(position)
+        metadatas = [dict(metadata or {}) for metadata in data["metadatas"]]
+        for positions in by_source.values():
+            for position, shard in zip(positions, assign_shards([data["documents"][i] for i in positions])):
+                metadatas[position]["shard"] = shard
+        for start in range(0, total, batch_size):
+            end = start + batch_size
+            store.upsert(
+                ids=data["ids"][start:end],
+                embeddings=[list(vector) for vector in data["embeddings"][start:end]],
+                documents=data["documents"][start:end],
+                metadatas=metadatas[start:end],
+            )
+    unsharded.delete_collection()
+    return total
+
+
+def open_ingest_store(persist_dir: str, embedding):
+    """The store ingestion writes to.
+
+    Sharded when the index already is, or when SUBJECT_SHARDS is on; an
+    unsharded index is migrated into shards first.
+    """
+    if read_shard_manifest(persist_dir) is None:
+        if not SUBJECT_SHARDS:
+            return Chroma(persist_directory=persist_dir, embedding_function=embedding)
+        store = open_sharded_chroma(persist_dir, embedding)
+        migrated = migrate_unsharded(persist_dir, store, embedding)
+        if migrated:
+            print(f"[ingest] moved {migrated} chunks into subject shards")
+        write_shard_manifest(persist_dir, store, redistributed=bool(migrated))
+        return store
+    return open_sharded_chroma(persist_dir, embedding)
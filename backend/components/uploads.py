@@ -0,0 +1,201 @@
+"""
+Streaming uploads: copied to disk in chunks, hashed while copying and deduplicated against indexed documents
+"""
+import asyncio
+import hashlib
+import os
+import stat
+import threading
+import zipfile
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+# Largest accepted PDF, also per PDF inside a zip archive
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Bulk uploads: whole request (or zip archive) size, and PDFs accepted per request
+BULK_UPLOAD_MAX_BYTES = int(os.getenv("BULK_UPLOAD_MAX_BYTES", str(500 * 1024 * 1024)))
+BULK_UPLOAD_MAX_FILES = int(os.getenv("BULK_UPLOAD_MAX_FILES", "200"))
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, limit: int):
+        super().__init__(f"File exceeds the upload limit of {limit} bytes")
+        self.limit = limit
+
+
+async def stream_to_file(read: Callable[[int], Awaitable[bytes]], path: str,
+                         max_bytes: int = UPLOAD_MAX_BYTES) -> Tuple[str, int]:
+    """Copy an async byte source to path chunk by chunk; returns (sha256, size).
+
+    Disk writes run in a worker thread so a large upload never blocks the
+    event loop. The hash is computed during the copy, sparing a re-read of
+    the stored file. For an UploadFile the source is Starlette's spooled
+    temporary file, so the body has already been received once. The partial
+    file is removed if the source exceeds max_bytes or the copy fails.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    f = await asyncio.to_thread(open, path, "wb")
+    try:
+        while True:
+            chunk = await read(UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            hasher.update(chunk)
+            await asyncio.to_thread(f.write, chunk)
+    except BaseException:
+        f.close()
+        os.remove(path)
+        raise
+    await asyncio.to_thread(f.close)
+    return hasher.hexdigest(), size
+
+
+def stored_name(filename: str, digest: str) -> str:
+    """Name an upload is kept under; the same content always gets the same prefix"""
+    name = os.path.basename(filename.replace("\\", "/"))
+    return f"{digest[:16]}_{name}"
+
+
+def _member_problem(info: zipfile.ZipInfo) -> Optional[str]:
+    """Why a zip member is not extracted, or None if it is a PDF that can be"""
+    parts = info.filename.replace("\\", "/").split("/")
+    if info.filename.startswith(("/", "\\")) or ".." in parts or ":" in parts[0]:
+        # Only the basename is ever used, but a path escaping the archive is a red flag
+        return "unsafe path"
+    if stat.S_ISLNK(info.external_attr >> 16):
+        return "symbolic link"
+    if info.flag_bits & 0x1:
+        return "encrypted"
+    if not info.filename.lower().endswith(".pdf"):
+        return "not a PDF"
+    if info.file_size > UPLOAD_MAX_BYTES:
+        return f"exceeds the upload limit of {UPLOAD_MAX_BYTES} bytes"
+    return None
+
+
+def _is_junk(info: zipfile.ZipInfo) -> bool:
+    # Directories, macOS resource forks and other hidden files
+    name = info.filename.replace("\\", "/")
+    return info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith(".")
+
+
+async def zip_members(archive_path: str) -> AsyncIterator[Tuple[str, Optional[Callable[[int], Awaitable[bytes]]],
+                                                               Optional[str]]]:
+    """Yield (name, read, None) for each PDF of a zip archive and (name, None, reason) for refused members.
+
+    Members are decompressed one chunk at a time as ``read`` is awaited,
+    nothing is extracted to disk by this function. ``read`` is only valid
+    until the next member is requested. Raises zipfile.BadZipFile for a
+    file that is not a zip archive.
+    """
+    archive = await asyncio.to_thread(zipfile.ZipFile, archive_path)
+    try:
+        for info in archive.infolist():
+            if _is_junk(info):
+                continue
+            problem = _member_problem(info)
+            if problem is not None:
+                yield info.filename, None, problem
+                continue
+            member = await asyncio.to_thread(archive.open, info)
+            try:
+                async def read(size: int, member=member) -> bytes:
+                    return await asyncio.to_thread(member.read, size)
+                yield info.filename, read, None
+            finally:
+                member.close()
+    finally:
+        archive.close()
+
+
+class UploadDeduplicator:
+    """Recognizes uploads whose content is already indexed or on its way into the index.
+
+    ``load_indexed()`` returns {sha256: path} for the published index; it is
+    called again only when the ``index_key`` passed to ``reserve`` changes.
+    ``is_pending(job_id)`` says whether an ingestion job is still queued or
+    running. Report every finished job to ``job_finished`` so its
+    reservations are promoted to indexed or released.
+    """
+
+    def __init__(self, load_indexed: Callable[[], Dict[str, str]], is_pending: Callable[[str], bool]):
+        self.load_indexed = load_indexed
+        self.is_pending = is_pending
+        self._indexed: Dict[str, str] = {}
+        self._indexed_key: Optional[Hashable] = None
+        # sha256 -> (path, job_id) of uploads not indexed yet; job_id is None until the job is submitted
+        self._pending: Dict[str, Tuple[str, Optional[str]]] = {}
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.duplicates = 0
+
+    def reserve(self, digest: str, path: str, index_key: Hashable) -> Optional[Dict[str, Any]]:
+        """The indexed or pending document with this content, or None once digest is reserved for path.
+
+        The check and the reservation happen under one lock, so of two
+        identical uploads arriving together only one is ingested. Follow a
+        reservation with ``assign_job``, or ``release`` it if the upload is
+        abandoned. May read the index manifest.
+        """
+        with self._lock:
+            self.uploads += 1
+            if index_key != self._indexed_key:
+                self._indexed = self.load_indexed()
+                self._indexed_key = index_key
+            duplicate = None
+            if digest in self._indexed:
+                duplicate = {"document": os.path.basename(self._indexed[digest]), "status": "indexed"}
+            elif digest in self._pending:
+                pending_path, job_id = self._pending[digest]
+                if job_id is None:
+                    # Reserved by an upload whose job is being submitted
+                    duplicate = {"document": os.path.basename(pending_path), "status": "pending"}
+                elif self.is_pending(job_id):
+                    duplicate = {"document": os.path.basename(pending_path), "status": "pending", "job_id": job_id}
+                # Otherwise finished (indexed once the new snapshot is loaded) or failed: let it through
+            if duplicate is not None:
+                self.duplicates += 1
+                return duplicate
+            self._pending[digest] = (path, None)
+            return None
+
+    def assign_job(self, digest: str, job_id: str):
+        """Record the ingestion job of a reserved upload"""
+        with self._lock:
+            path, _ = self._pending[digest]
+            if self.is_pending(job_id):
+                self._pending[digest] = (path, job_id)
+            else:
+                # Finished before it was assigned; reloading the published index tells whether it was indexed
+                del self._pending[digest]
+
+    def release(self, digest: str):
+        """Drop a reservation whose upload was abandoned"""
+        with self._lock:
+            self._pending.pop(digest, None)
+
+    def job_finished(self, job_id: str, failed_files: Iterable[str] = ()):
+        """Settle the reservations of a finished job: failed files are released, the rest are indexed"""
+        failed = set(failed_files)
+        with self._lock:
+            for digest, (path, pending_job) in list(self._pending.items()):
+                if pending_job != job_id:
+                    continue
+                del self._pending[digest]
+                if path not in failed:
+                    # Until the published index is loaded again
+                    self._indexed[digest] = path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "max_bytes": UPLOAD_MAX_BYTES,
+                "uploads": self.uploads,
+                "duplicates": self.duplicates,
+                "pending": len(self._pending),
+                "indexed_documents": len(self._indexed),
+            }
@@ -0,0 +1,321 @@
+"""
+Retrieval backends: the Chroma store, or a memory-mapped embedding matrix exported from it
+"""
+import gzip
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from components.embedding_cache import get_embeddings
+from components.subject_shards import ShardedVectorStore, collection_name, read_shard_manifest
+
+try:
+    import hnswlib
+except ImportError:  # optional, only needed for large corpora
+    hnswlib = None
+
+# "chroma" queries the Chroma store directly, "matrix" serves a NumPy export of it
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Use an HNSW index (requires hnswlib) once the matrix has this many rows
+HNSW_MIN_ITEMS = int(os.getenv("HNSW_MIN_ITEMS", "50000"))
+EXPORT_BATCH_SIZE = 2000
+
+
+def matrix_dir_for(persist_dir: str) -> str:
+    """Where the matrix export of a Chroma persist directory lives (next to it)"""
+    return os.path.normpath(persist_dir) + ".matrix"
+
+
+class MatrixVectorStore(VectorStore):
+    """Read-only vector store over a memory-mapped float32 matrix.
+
+    Rows are L2-normalized so similarity is a single matrix-vector product.
+    Top-k uses argpartition and MMR is vectorized over the fetched candidates.
+    With ``use_hnsw`` (or more than HNSW_MIN_ITEMS rows and hnswlib installed)
+    candidates come from an approximate HNSW index instead of a full scan.
+    Writes go to Chroma; refresh this store with ``export_chroma_to_matrix``.
+    """
+
+    def __init__(self, directory: str, embedding: Embeddings, use_hnsw: Optional[bool] = None):
+        self.directory = directory
+        self._embedding = embedding
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        count, dim = self.meta["count"], self.meta["dim"]
+        self._matrix = np.memmap(os.path.join(directory, "vectors.f32"), dtype=np.float32, mode="r",
+                                 shape=(count, dim)) if count else np.zeros((0, dim or 1), dtype=np.float32)
+        with gzip.open(os.path.join(directory, "docs.pkl.gz"), "rb") as f:
+            docs = pickle.load(f)
+        self._ids: List[str] = docs["ids"]
+        self._texts: List[str] = docs["texts"]
+        self._metadatas: List[Dict] = docs["metadatas"]
+        self._hnsw = None
+        if use_hnsw is None:
+            use_hnsw = count >= HNSW_MIN_ITEMS
+        if use_hnsw and count:
+            self._hnsw = self._load_hnsw()
+
+    def _load_hnsw(self):
+        if hnswlib is None:
+            print("[WARN] hnswlib is not installed, falling back to exact search")
+            return None
+        path = os.path.join(self.directory, "hnsw.bin")
+        index = hnswlib.Index(space="ip", dim=self.meta["dim"])
+        if os.path.exists(path):
+            index.load_index(path, max_elements=self.meta["count"])
+        else:
+            index.init_index(max_elements=self.meta["count"], ef_construction=200, M=16)
+            index.add_items(np.asarray(self._matrix), np.arange(self.meta["count"]))
+            index.save_index(path)
+        index.set_ef(100)
+        return index
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _document(self, row: int) -> Document:
+        return Document(id=self._ids[row], page_content=self._texts[row], metadata=dict(self._metadatas[row]))
+
+    def _mask(self, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        if not filter:
+            return None
+        return np.array([all(meta.get(key) == value for key, value in filter.items())
+                         for meta in self._metadatas], dtype=bool)
+
+    def _candidates(self, query: np.ndarray, n: int, filter: Optional[Dict[str, Any]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Row indices and scores of the n most similar rows, best first"""
+        count = len(self._ids)
+        if not count or n <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if self._hnsw is not None and not filter:
+            labels, distances = self._hnsw.knn_query(query, k=min(n, count))
+            return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+        scores = self._matrix @ query
+        mask = self._mask(filter)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+            count = int(mask.sum())
+        n = min(n, count)
+        if n == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vec = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None,
+                                               **kwargs: Any) -> List[Tuple[Document, float]]:
+        rows, scores = self._candidates(self._normalize(embedding), k, filter)
+        return [(self._document(row), float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self._embedding.embed_query(query), k, filter)
+
+    def max_marginal_relevance_search_by_vector(self, embedding: List[float], k: int = 4, fetch_k: int = 20,
+                                                lambda_mult: float = 0.5, filter: Optional[Dict[str, Any]] = None,
+                                                **kwargs: Any) -> List[Document]:
+        query = self._normalize(embedding)
+        rows, relevance = self._candidates(query, fetch_k, filter)
+        if not len(rows):
+            return []
+        candidates = np.asarray(self._matrix[rows])
+        selected = [int(np.argmax(relevance))]
+        redundancy = candidates @ candidates[selected[0]]
+        while len(selected) < min(k, len(rows)):
+            score = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+            score[selected] = -np.inf
+            best = int(np.argmax(score))
+            selected.append(best)
+            redundancy = np.maximum(redundancy, candidates @ candidates[best])
+        return [self._document(int(rows[i])) for i in selected]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20, lambda_mult: float = 0.5,
+                                      filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self._embedding.embed_query(query), k, fetch_k, lambda_mult, filter)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Optional[List[str]] = None, **kwargs: Any) -> Dict[str, Any]:
+        """Chroma-style ``get`` so the store can feed the BM25 index and exports"""
+        include = ["documents", "metadatas"] if include is None else include
+        wanted = set(ids) if ids is not None else None
+        mask = self._mask(where)
+        rows = [row for row, doc_id in enumerate(self._ids)
+                if (wanted is None or doc_id in wanted) and (mask is None or mask[row])]
+        result: Dict[str, Any] = {"ids": [self._ids[row] for row in rows]}
+        if "documents" in include:
+            result["documents"] = [self._texts[row] for row in rows]
+        if "metadatas" in include:
+            result["metadatas"] = [self._metadatas[row] for row in rows]
+        if "embeddings" in include:
+            norms = np.fromfile(os.path.join(self.directory, "norms.f32"), dtype=np.float32)
+            result["embeddings"] = [np.asarray(self._matrix[row]) * norms[row] for row in rows]
+        return result
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise TypeError("The matrix backend is read-only; ingest through Chroma and export the matrix again")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   **kwargs: Any) -> "MatrixVectorStore":
+        raise TypeError("The matrix backend is read-only; build it from a Chroma index with export_chroma_to_matrix")
+
+
+def export_chroma_to_matrix(vectorstore: Chroma, directory: str) -> str:
+    """Export every embedding, text and metadata of a Chroma store to a matrix directory"""
+    total = vectorstore._collection.count()
+    tmp_dir = f"{directory}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    ids, texts, metadatas, norms = [], [], [], []
+    dim = 0
+    with open(os.path.join(tmp_dir, "vectors.f32"), "wb") as f:
+        for offset in range(0, total, EXPORT_BATCH_SIZE):
+            batch = vectorstore.get(limit=EXPORT_BATCH_SIZE, offset=offset,
+                                    include=["embeddings", "documents", "metadatas"])
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+            if not len(vectors):
+                continue
+            dim = vectors.shape[1]
+            batch_norms = np.linalg.norm(vectors, axis=1)
+            (vectors / np.where(batch_norms == 0, 1, batch_norms)[:, None]).astype(np.float32).tofile(f)
+            norms.append(batch_norms.astype(np.float32))
+            ids.extend(batch["ids"])
+            texts.extend(batch["documents"])
+            metadatas.extend(meta or {} for meta in batch["metadatas"])
+    (np.concatenate(norms) if norms else np.zeros(0, dtype=np.float32)).tofile(os.path.join(tmp_dir, "norms.f32"))
+    with gzip.open(os.path.join(tmp_dir, "docs.pkl.gz"), "wb") as f:
+        pickle.dump({"ids": ids, "texts": texts, "metadatas": metadatas}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+        json.dump({"count": len(ids), "dim": dim, "exported_at": time.time()}, f)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+    return directory
+
+
+def import_matrix_into_chroma(directory: str, persist_dir: str) -> Chroma:
+    """Load a matrix export into the Chroma store at persist_dir (upserting by ID)"""
+    matrix_store = MatrixVectorStore(directory, get_embeddings(), use_hnsw=False)
+    data = matrix_store.get(include=["embeddings", "documents", "metadatas"])
+    vectorstore = Chroma(persist_directory=persist_dir, embedding_function=get_embeddings())
+    for start in range(0, len(data["ids"]), EXPORT_BATCH_SIZE):
+        end = start + EXPORT_BATCH_SIZE
+        vectorstore._collection.upsert(
+            ids=data["ids"][start:end],
+            embeddings=[vector.tolist() for vector in data["embeddings"][start:end]],
+            documents=data["documents"][start:end],
+            metadatas=data["metadatas"][start:end],
+        )
+    return vectorstore
+
+
+def _load_collection(persist_dir: str, backend: str, refresh: bool, shard: Optional[str] = None):
+    # Unsharded indexes live in langchain_chroma's default collection
+    collection = {"collection_name": collection_name(shard)} if shard else {}
+    if backend == "chroma":
+        return Chroma(persist_directory=persist_dir, embedding_function=get_embeddings(), **collection)
+    if backend != "matrix":
+        raise ValueError(f"Unknown vector backend: {backend}")
+    directory = matrix_dir_for(persist_dir)
+    if shard:
+        directory = os.path.join(directory, shard)
+    if refresh or not os.path.exists(os.path.join(directory, "meta.json")):
+        chroma = Chroma(persist_directory=persist_dir, embedding_function=get_embeddings(), **collection)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+        export_chroma_to_matrix(chroma, directory)
+    return MatrixVectorStore(directory, get_embeddings())
+
+
+def load_vector_backend(persist_dir: str, backend: Optional[str] = None, refresh: bool = False):
+    """Open the configured retrieval backend for a Chroma persist directory.
+
+    For the matrix backend the export is (re)built from Chroma when missing or
+    when ``refresh`` is set, e.g. after ingestion changed the store. A
+    sharded index opens every shard, each exported to its own matrix.
+    """
+    backend = backend or VECTOR_BACKEND
+    shards = read_shard_manifest(persist_dir)
+    if shards is not None:
+        return ShardedVectorStore({shard: _load_collection(persist_dir, backend, refresh, shard) for shard in shards})
+    return _load_collection(persist_dir, backend, refresh)
+
+
+def close_vectorstore(vectorstore):
+    """Stop the Chroma clients behind a store so its directory can be deleted.
+
+    Clients of one persist directory share a chromadb System (sqlite
+    connection, open HNSW segments). It is stopped and dropped from chromadb's
+    cache, so a later client for the same path starts a fresh one. Matrix
+    stores hold nothing that needs closing.
+    """
+    stores = vectorstore.shards.values() if isinstance(vectorstore, ShardedVectorStore) else [vectorstore]
+    stopped = set()
+    for store in stores:
+        identifier = getattr(getattr(store, "_client", None), "_identifier", None)
+        if identifier is None or identifier in stopped:
+            continue
+        stopped.add(identifier)
+        try:
+            from chromadb.api.client import SharedSystemClient
+
+            system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+            if system is not None:
+                system.stop()
+        except Exception as e:
+            print("[WARN] Failed to close Chroma client:", e)
+
+
+def benchmark_backends(persist_dir: str, queries: List[str], k: int = 3, repeats: int = 5) -> Dict[str, Dict[str, float]]:
+    """Time MMR retrieval of the same query vectors on Chroma and on the matrix export"""
+    embeddings = get_embeddings()
+    vectors = [embeddings.embed_query(query) for query in queries]
+    results = {}
+    for name in ("chroma", "matrix"):
+        started = time.perf_counter()
+        store = load_vector_backend(persist_dir, backend=name)
+        load_seconds = time.perf_counter() - started
+        latencies = []
+        for _ in range(repeats):
+            for vector in vectors:
+                started = time.perf_counter()
+                store.max_marginal_relevance_search_by_vector(vector, k=k)
+                latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        results[name] = {
+            "load_ms": round(load_seconds * 1000, 2),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    persist_dir = 'artifacts/chroma_db'
+    print(benchmark_backends(persist_dir, ["What is Bayes' theorem?", "Explain useEffect cleanup in React",
+                                           "Dynamic programming on trees"]))
@@ -1,17 +1,39 @@
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from components.embedding_cache import get_embeddings
+from components.lexical_index import lexical_index_path, load_or_build_lexical_index
+from components.metrics import observe_stage
+from components.parse_cache import PARSE_CACHE, load_pages, store_pages
+from components.subject_shards import (ShardedVectorStore, assign_shards, open_ingest_store, shard_generation,
+                                       write_shard_manifest)
 import pickle
 import glob
 import hashlib
+import multiprocessing
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
 from dotenv import load_dotenv
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Ingestion pipeline tuning
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "100"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+INGEST_WRITE_BATCH_SIZE = int(os.getenv("INGEST_WRITE_BATCH_SIZE", "2000"))
+HASH_BLOCK_SIZE = 1024 * 1024
+# Changing these re-splits every file on the next rebuild, from the parse cache
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "400"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
+CHUNKING = f"{CHUNK_SIZE}/{CHUNK_OVERLAP}"
+# Manifest entries written before the chunking was recorded used these settings
+LEGACY_CHUNKING = "400/100"
+
 
 def load_document(file_path: str):
     if file_path.endswith('.pdf'):
@@ -23,99 +45,516 @@ def load_document(file_path: str):
 
 def split_documents(documents):
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=400,
-        chunk_overlap=100
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        # Lets the context builder stitch neighbouring chunks back together
+        add_start_index=True
     )
     chunks = text_splitter.split_documents(documents)
     return chunks
 
 def get_file_hash(file_path: str) -> str:
-    """Get SHA-256 hash of file to detect changes."""
+    """Get SHA-256 hash of file to detect changes, streaming it in blocks."""
     hasher = hashlib.sha256()
     with open(file_path, 'rb') as f:
-        buf = f.read()
-        hasher.update(buf)
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            hasher.update(block)
     return hasher.hexdigest()
 
-def save_processed_files_info(processed_files: Dict[str, str], file_path: str):
-    """Save information about processed files and their hashes."""
-    with open(file_path, 'wb') as f:
+def entry_hash(entry) -> str:
+    """Content hash of a processed-files entry (older caches stored the bare hash)."""
+    return entry if isinstance(entry, str) else entry["hash"]
+
+def entry_chunking(entry) -> str:
+    """Chunk size/overlap a processed-files entry was split with."""
+    return entry.get("chunking", LEGACY_CHUNKING) if isinstance(entry, dict) else LEGACY_CHUNKING
+
+def get_file_fingerprint(file_path: str, previous=None) -> Dict:
+    """Size, mtime and content hash of a file.
+
+    The hash of the previous entry is reused without reading the file when its
+    size and mtime are unchanged.
+    """
+    st = os.stat(file_path)
+    if isinstance(previous, dict) and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        return previous
+    return {"hash": get_file_hash(file_path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+def save_processed_files_info(processed_files: Dict[str, Dict], file_path: str):
+    """Save information about processed files and their fingerprints."""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, 'wb') as f:
         pickle.dump(processed_files, f)
+    os.replace(tmp_path, file_path)
 
-def load_processed_files_info(file_path: str) -> Dict[str, str]:
+def load_processed_files_info(file_path: str) -> Dict[str, Dict]:
     """Load information about previously processed files."""
     if os.path.exists(file_path):
         with open(file_path, 'rb') as f:
             return pickle.load(f)
     return {}
 
-def process_pdf_directory(pdf_dir: str, persist_dir: str, processed_files_cache: str = 'processed_files.pkl'):
+def get_index_version(processed_files_cache: str = 'processed_files.pkl') -> str:
+    """Fingerprint of the indexed corpus, changes whenever a file is (re)indexed or shards are rebuilt."""
+    processed_files = load_processed_files_info(processed_files_cache)
+    hasher = hashlib.sha256()
+    for path in sorted(processed_files):
+        entry = processed_files[path]
+        hasher.update(f"{path}:{entry_hash(entry)}:{entry_chunking(entry)}\n".encode("utf-8"))
+    # Chunks moved between shards change what a routed question retrieves
+    generation = shard_generation(os.path.dirname(os.path.abspath(processed_files_cache)))
+    if generation:
+        hasher.update(f"shards:{generation}\n".encode("utf-8"))
+    return hasher.hexdigest()[:16]
 
-    os.makedirs(persist_dir, exist_ok=True)
-    os.makedirs(os.path.dirname(processed_files_cache) if os.path.dirname(processed_files_cache) else '.', exist_ok=True)
+class IngestStats:
+    """Per-stage counters and timings of one ingestion run."""
+
+    STAGES = ("parse", "embed", "write")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished = None
+        self.files_total = 0
+        self.files_done = 0
+        self.files_failed = 0
+        self.failed_files: List[str] = []
+        self.chunks_added = 0
+        self.chunks_removed = 0
+        self.chunks_unchanged = 0
+        # Files whose text came from the parse cache instead of PyPDFLoader
+        self.parse_cache_hits = 0
+        # Per-file chunk counts, keyed by path
+        self.file_chunks: Dict[str, Dict[str, int]] = {}
+        # Chunks written per subject shard
+        self.shard_chunks: Dict[str, int] = {}
+        self.chunks = {stage: 0 for stage in self.STAGES}
+        # Busy time summed over workers, so it can exceed wall time
+        self.busy = {stage: 0.0 for stage in self.STAGES}
+
+    def add(self, stage: str, seconds: float, chunks: int):
+        self.busy[stage] += seconds
+        self.chunks[stage] += chunks
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def wall_seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def as_dict(self) -> Dict:
+        wall = self.wall_seconds
+        return {
+            "files_total": self.files_total,
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "chunks_added": self.chunks_added,
+            "chunks_removed": self.chunks_removed,
+            "chunks_unchanged": self.chunks_unchanged,
+            "parse_cache_hits": self.parse_cache_hits,
+            "shard_chunks": dict(self.shard_chunks),
+            "wall_seconds": round(wall, 3),
+            "stages": {
+                stage: {
+                    "chunks": self.chunks[stage],
+                    "busy_seconds": round(self.busy[stage], 3),
+                    "chunks_per_second": round(self.chunks[stage] / wall, 1) if wall else 0.0,
+                }
+                for stage in self.STAGES
+            },
+        }
+
+    def report(self):
+        summary = self.as_dict()
+        print(f"[ingest] {summary['files_done']}/{summary['files_total']} files "
+              f"({summary['files_failed']} failed) in {summary['wall_seconds']}s: "
+              f"{summary['chunks_added']} chunks added, {summary['chunks_removed']} removed, "
+              f"{summary['chunks_unchanged']} unchanged, {summary['parse_cache_hits']} files from the parse cache")
+        for stage, info in summary["stages"].items():
+            print(f"[ingest]   {stage:<5} {info['chunks']:>6} chunks  "
+                  f"busy {info['busy_seconds']:>8}s  {info['chunks_per_second']:>8} chunks/s")
+
+
+def assign_chunk_ids(chunks) -> List[str]:
+    """Deterministic IDs derived from each chunk's source, page and content.
+
+    Identical chunks on the same page are told apart by their occurrence
+    number, so re-splitting an unchanged file always yields the same IDs.
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for chunk in chunks:
+        source = chunk.metadata.get("source", "")
+        page = chunk.metadata.get("page", "")
+        base = hashlib.sha256(f"{source}\x00{page}\x00{chunk.page_content}".encode("utf-8")).hexdigest()
+        occurrence = seen.get(base, 0)
+        seen[base] = occurrence + 1
+        ids.append(base[:32] if occurrence == 0 else f"{base[:32]}-{occurrence}")
+    return ids
+
+def _existing_chunk_ids(vectorstore, pdf_file: str) -> set:
+    """IDs of the chunks currently stored for a source file."""
+    return set(vectorstore.get(where={"source": pdf_file}, include=[])["ids"])
+
+def _delete_chunks(vectorstore, ids: List[str]):
+    for start in range(0, len(ids), INGEST_WRITE_BATCH_SIZE):
+        vectorstore.delete(ids=ids[start:start + INGEST_WRITE_BATCH_SIZE])
+
+def _load_and_split(pdf_file: str, file_hash: Optional[str] = None):
+    """Parse and split one PDF, returning the chunks and per-stage seconds. Runs in a worker process.
+
+    Page text comes from the parse cache when this content was parsed before;
+    the stage is then reported as ``cache_load`` instead of ``load``.
+    """
+    started = time.perf_counter()
+    stage = "load"
+    documents = None
+    if PARSE_CACHE:
+        file_hash = file_hash or get_file_hash(pdf_file)
+        documents = load_pages(pdf_file, file_hash)
+        if documents is not None:
+            stage = "cache_load"
+    if documents is None:
+        documents = load_document(pdf_file)
+        if PARSE_CACHE:
+            store_pages(file_hash, documents)
+    loaded = time.perf_counter()
+    chunks = split_documents(documents)
+    return chunks, {stage: loaded - started, "split": time.perf_counter() - loaded}
+
+def _clean_metadata(metadata: Dict) -> Dict:
+    # Chroma only accepts scalar metadata values
+    return {k: v for k, v in metadata.items() if isinstance(v, (str, int, float, bool))}
+
+def _parse_files(pdf_files: List[str], hashes: Optional[Dict[str, str]] = None):
+    """Yield (pdf_file, chunks, stage_seconds, error) as files finish parsing.
+
+    hashes maps files to their known content hash, sparing the parse cache lookup a re-read.
+    """
+    hashes = hashes or {}
+    if INGEST_PARSE_WORKERS <= 1 or len(pdf_files) == 1:
+        for pdf_file in pdf_files:
+            try:
+                chunks, seconds = _load_and_split(pdf_file, hashes.get(pdf_file))
+                yield pdf_file, chunks, seconds, None
+            except Exception as e:
+                yield pdf_file, [], {}, e
+        return
+
+    # spawn, not fork: the server process runs threads and gRPC clients
+    workers = min(INGEST_PARSE_WORKERS, len(pdf_files))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = {pool.submit(_load_and_split, pdf_file, hashes.get(pdf_file)): pdf_file for pdf_file in pdf_files}
+        for future in as_completed(futures):
+            pdf_file = futures[future]
+            try:
+                chunks, seconds = future.result()
+                yield pdf_file, chunks, seconds, None
+            except Exception as e:
+                yield pdf_file, [], {}, e
+
+def _write_batch(vectorstore, batch, stats: IngestStats):
+    """Bulk upsert pre-embedded chunks into the Chroma collection (or their subject shards)."""
+    started = time.perf_counter()
+    upsert = vectorstore.upsert if isinstance(vectorstore, ShardedVectorStore) else vectorstore._collection.upsert
+    upsert(
+        ids=[item["id"] for item in batch],
+        embeddings=[item["embedding"] for item in batch],
+        documents=[item["text"] for item in batch],
+        metadatas=[item["metadata"] for item in batch],
+    )
+    seconds = time.perf_counter() - started
+    stats.add("write", seconds, len(batch))
+    observe_stage("ingest", "write", seconds)
+    for item in batch:
+        shard = item["metadata"].get("shard")
+        if shard:
+            stats.shard_chunks[shard] = stats.shard_chunks.get(shard, 0) + 1
 
+def process_pdf_directory(pdf_dir: str, persist_dir: str, processed_files_cache: str = 'processed_files.pkl',
+                          stats: Optional[IngestStats] = None):
+    """Index new or modified PDFs of pdf_dir into the Chroma store at persist_dir."""
     pdf_files = glob.glob(os.path.join(pdf_dir, "*.pdf"))
     if not pdf_files:
         print(f"No PDF files found in {pdf_dir}")
         return
-    
+    return process_pdf_files(pdf_files, persist_dir, processed_files_cache, stats=stats)
+
+def process_pdf_files(pdf_files: List[str], persist_dir: str, processed_files_cache: str = 'processed_files.pkl',
+                      stats: Optional[IngestStats] = None):
+    """Index the given PDFs into the Chroma store at persist_dir, skipping unchanged ones.
+
+    Runs as a staged pipeline: PDFs are parsed and split in a process pool,
+    chunks are embedded in batches of INGEST_EMBED_BATCH_SIZE with up to
+    INGEST_EMBED_CONCURRENCY requests in flight, and embedded chunks are
+    written to Chroma in bulk. Pass an IngestStats to collect the per-stage
+    counters and timings.
+
+    Chunks get content-addressed IDs, so re-ingesting a modified file only
+    embeds the chunks that are new and deletes the ones that disappeared.
+    """
+    os.makedirs(persist_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(processed_files_cache) if os.path.dirname(processed_files_cache) else '.', exist_ok=True)
+
     processed_files = load_processed_files_info(processed_files_cache)
+    # Each file is hashed at most once per run, and not at all if size/mtime match
+    fingerprints = {}
     new_or_modified_files = []
     for pdf_file in pdf_files:
-        file_hash = get_file_hash(pdf_file)
-        if pdf_file not in processed_files or processed_files[pdf_file] != file_hash:
+        previous = processed_files.get(pdf_file)
+        fingerprint = get_file_fingerprint(pdf_file, previous)
+        fingerprints[pdf_file] = fingerprint
+        if previous is None or entry_hash(previous) != fingerprint["hash"] or entry_chunking(previous) != CHUNKING:
+            # New, modified, or split with other chunk settings (re-split from the parse cache)
             new_or_modified_files.append(pdf_file)
+        elif previous is not fingerprint:
+            # Touched but identical content (or an old-style entry): refresh it
+            processed_files[pdf_file] = {**fingerprint, "chunking": CHUNKING}
     
     if not new_or_modified_files:
         print("No new or modified files to process")
+        save_processed_files_info(processed_files, processed_files_cache)
         return
     
     print(f"Found {len(new_or_modified_files)} new or modified PDF files to process")
-    
-    embeddings = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001",
-        google_api_key=GOOGLE_API_KEY,
-    )
+    stats = stats if stats is not None else IngestStats()
+    stats.files_total = len(new_or_modified_files)
 
-    if os.path.exists(persist_dir):
-        print("Loading existing vector store...")
-        vectorstore = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings
-        )
-    else:
-        print("Creating new vector store...")
-        vectorstore = None
-    
-    for pdf_file in new_or_modified_files:
-        print(f"Processing {pdf_file}...")
-        try:
-            documents = load_document(pdf_file)
-            chunks = split_documents(documents)
-            
-            if not vectorstore:
-                vectorstore = Chroma.from_documents(
-                    documents=chunks,
-                    embedding=embeddings,
-                    persist_directory=persist_dir
-                )
-            else:
-                vectorstore.add_documents(chunks)
-            
-            processed_files[pdf_file] = get_file_hash(pdf_file)
-            print(f"  Added {len(chunks)} chunks from {pdf_file}")
-            
-        except Exception as e:
-            print(f"  Error processing {pdf_file}: {str(e)}")
-    
-    if vectorstore:
-        print("Vector store saved successfully")
+    # Cached: text embedded by an earlier run is never sent to the API again
+    embeddings = get_embeddings()
+    # One collection per subject shard, unless SUBJECT_SHARDS is off for an unsharded index
+    vectorstore = open_ingest_store(persist_dir, embeddings)
+    sharded = isinstance(vectorstore, ShardedVectorStore)
+    # The BM25 index mirrors every write and delete made to the collection
+    lexical_index = load_or_build_lexical_index(persist_dir, vectorstore)
+
+    pending_chunks: Dict[str, int] = {}
+    stale_ids: Dict[str, List[str]] = {}
+    failed = set()
+    embed_batch: List[Dict] = []
+    write_buffer: List[Dict] = []
+    in_flight = set()
+
+    def embed(batch):
+        started = time.perf_counter()
+        vectors = embeddings.embed_documents([item["text"] for item in batch])
+        return batch, vectors, time.perf_counter() - started
+
+    def finish_file(pdf_file):
+        # New chunks are in place, now drop the ones the file no longer has
+        if stale_ids.get(pdf_file):
+            _delete_chunks(vectorstore, stale_ids[pdf_file])
+            lexical_index.remove(stale_ids[pdf_file])
+            stats.chunks_removed += len(stale_ids[pdf_file])
+        processed_files[pdf_file] = {**fingerprints[pdf_file], "chunking": CHUNKING}
+        stats.files_done += 1
+
+    def mark_written(batch):
+        for item in batch:
+            pdf_file = item["file"]
+            pending_chunks[pdf_file] -= 1
+            if pending_chunks[pdf_file] == 0 and pdf_file not in failed:
+                finish_file(pdf_file)
+
+    def flush_writes(force: bool = False):
+        while write_buffer and (force or len(write_buffer) >= INGEST_WRITE_BATCH_SIZE):
+            batch = [item for item in write_buffer[:INGEST_WRITE_BATCH_SIZE] if item["file"] not in failed]
+            del write_buffer[:INGEST_WRITE_BATCH_SIZE]
+            if batch:
+                _write_batch(vectorstore, batch, stats)
+                lexical_index.add([item["id"] for item in batch], [item["text"] for item in batch],
+                                  [item["metadata"] for item in batch])
+                mark_written(batch)
+                print(f"[ingest] wrote {stats.chunks['write']} chunks, {stats.files_done}/{stats.files_total} files done")
+
+    def collect(done_futures):
+        for future in done_futures:
+            in_flight.discard(future)
+            try:
+                batch, vectors, seconds = future.result()
+            except Exception as e:
+                batch = future.batch
+                print(f"  Error embedding {len(batch)} chunks: {str(e)}")
+                for pdf_file in {item["file"] for item in batch}:
+                    if pdf_file not in failed:
+                        failed.add(pdf_file)
+                        stats.files_failed += 1
+                continue
+            stats.add("embed", seconds, len(batch))
+            observe_stage("ingest", "embed", seconds)
+            for item, vector in zip(batch, vectors):
+                item["embedding"] = vector
+            write_buffer.extend(batch)
+        flush_writes()
+
+    def submit(pool, batch):
+        # Keep at most INGEST_EMBED_CONCURRENCY embedding calls in flight
+        while len(in_flight) >= INGEST_EMBED_CONCURRENCY:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+        future = pool.submit(embed, batch)
+        future.batch = batch
+        in_flight.add(future)
+
+    with ThreadPoolExecutor(max_workers=INGEST_EMBED_CONCURRENCY) as embed_pool:
+        hashes = {pdf_file: fingerprints[pdf_file]["hash"] for pdf_file in new_or_modified_files}
+        for pdf_file, chunks, seconds, error in _parse_files(new_or_modified_files, hashes):
+            if error is not None:
+                print(f"  Error processing {pdf_file}: {str(error)}")
+                failed.add(pdf_file)
+                stats.files_failed += 1
+                continue
+            stats.add("parse", sum(seconds.values()), len(chunks))
+            stats.parse_cache_hits += "cache_load" in seconds
+            for stage, stage_seconds in seconds.items():
+                observe_stage("ingest", stage, stage_seconds)
+            chunk_ids = assign_chunk_ids(chunks)
+            existing = _existing_chunk_ids(vectorstore, pdf_file)
+            new_ids = set(chunk_ids)
+            stale_ids[pdf_file] = sorted(existing - new_ids)
+            added = [(chunk_id, chunk) for chunk_id, chunk in zip(chunk_ids, chunks) if chunk_id not in existing]
+            stats.chunks_added += len(added)
+            stats.chunks_unchanged += len(new_ids & existing)
+            stats.file_chunks[pdf_file] = {
+                "chunks": len(chunks),
+                "added": len(added),
+                "removed": len(stale_ids[pdf_file]),
+            }
+            print(f"[ingest] parsed {pdf_file}: {len(chunks)} chunks, "
+                  f"{len(added)} new, {len(stale_ids[pdf_file])} stale")
+            pending_chunks[pdf_file] = len(added)
+            if not added:
+                finish_file(pdf_file)
+                continue
+            # Classified over the whole file, ambiguous chunks follow the file's subject
+            shards = assign_shards([chunk.page_content for chunk in chunks]) if sharded else None
+            chunk_shards = dict(zip(chunk_ids, shards)) if shards else {}
+            for chunk_id, chunk in added:
+                metadata = _clean_metadata(chunk.metadata)
+                if sharded:
+                    metadata["shard"] = chunk_shards[chunk_id]
+                embed_batch.append({
+                    "id": chunk_id,
+                    "file": pdf_file,
+                    "text": chunk.page_content,
+                    "metadata": metadata,
+                })
+                if len(embed_batch) >= INGEST_EMBED_BATCH_SIZE:
+                    submit(embed_pool, embed_batch)
+                    embed_batch = []
+        if embed_batch:
+            submit(embed_pool, embed_batch)
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(done)
+    flush_writes(force=True)
+    embeddings.store.flush()
+    lexical_index.save(lexical_index_path(persist_dir))
+    if sharded:
+        write_shard_manifest(persist_dir, vectorstore)
+    stats.failed_files = sorted(failed)
+
+    stats.finish()
+    observe_stage("ingest", "total", stats.wall_seconds)
+    stats.report()
+    print("Vector store saved successfully")
     
     save_processed_files_info(processed_files, processed_files_cache)
     print(f"Processed files information saved to {processed_files_cache}")
     
     return vectorstore
 
+def rebuild_shards(shards: List[str], persist_dir: str, processed_files_cache: str = 'processed_files.pkl',
+                   stats: Optional[IngestStats] = None):
+    """Re-create the given subject shards from every indexed file, leaving the other shards as they are.
+
+    Files are re-parsed and their chunks re-classified with the current shard
+    rules; chunks now assigned to a rebuilt shard are moved out of any other
+    shard, and chunks that left a rebuilt shard are written to their new one.
+    Embeddings come from the embedding cache, so only text that was never
+    embedded reaches the API.
+    """
+    embeddings = get_embeddings()
+    vectorstore = open_ingest_store(persist_dir, embeddings)
+    if not isinstance(vectorstore, ShardedVectorStore):
+        raise ValueError("The index is not sharded, set SUBJECT_SHARDS to shard it")
+    unknown = sorted(set(shards) - set(vectorstore.shards))
+    if unknown:
+        raise ValueError(f"Unknown shards: {', '.join(unknown)}")
+    targets = set(shards)
+    lexical_index = load_or_build_lexical_index(persist_dir, vectorstore)
+    stats = stats if stats is not None else IngestStats()
+
+    # Chunks removed below; those now classified elsewhere must still land in their new shard
+    rebuilt_ids = set()
+    for shard in shards:
+        old_ids = vectorstore.shards[shard].get(include=[])["ids"]
+        rebuilt_ids.update(old_ids)
+        _delete_chunks(vectorstore.shards[shard], old_ids)
+        lexical_index.remove(old_ids)
+        stats.chunks_removed += len(old_ids)
+        stats.shard_chunks[shard] = 0
+
+    def write(batch):
+        started = time.perf_counter()
+        vectors = embeddings.embed_documents([item["text"] for item in batch])
+        seconds = time.perf_counter() - started
+        stats.add("embed", seconds, len(batch))
+        observe_stage("ingest", "embed", seconds)
+        ids = [item["id"] for item in batch]
+        # Drop stale copies in the shards that are not rebuilt, the upsert puts each chunk back where it belongs
+        for shard, store in vectorstore.shards.items():
+            if shard not in targets:
+                _delete_chunks(store, ids)
+        for item, vector in zip(batch, vectors):
+            item["embedding"] = vector
+        _write_batch(vectorstore, batch, stats)
+        lexical_index.add(ids, [item["text"] for item in batch], [item["metadata"] for item in batch])
+        stats.chunks_added += len(batch)
+
+    processed_files = load_processed_files_info(processed_files_cache)
+    pdf_files = sorted(f for f in processed_files if os.path.exists(f))
+    # Text comes from the parse cache, only splitting and new embeddings cost time
+    hashes = {pdf_file: entry_hash(processed_files[pdf_file]) for pdf_file in pdf_files}
+    stats.files_total += len(pdf_files)
+    print(f"[ingest] rebuilding shards {', '.join(shards)} from {len(pdf_files)} files")
+    batch: List[Dict] = []
+    for pdf_file, chunks, seconds, error in _parse_files(pdf_files, hashes):
+        if error is not None:
+            print(f"  Error processing {pdf_file}: {str(error)}")
+            stats.failed_files.append(pdf_file)
+            stats.files_failed += 1
+            continue
+        stats.add("parse", sum(seconds.values()), len(chunks))
+        stats.parse_cache_hits += "cache_load" in seconds
+        for stage, stage_seconds in seconds.items():
+            observe_stage("ingest", stage, stage_seconds)
+        for chunk_id, chunk, shard in zip(assign_chunk_ids(chunks), chunks,
+                                          assign_shards([chunk.page_content for chunk in chunks])):
+            if shard not in targets and chunk_id not in rebuilt_ids:
+                continue
+            batch.append({
+                "id": chunk_id,
+                "file": pdf_file,
+                "text": chunk.page_content,
+                "metadata": {**_clean_metadata(chunk.metadata), "shard": shard},
+            })
+            if len(batch) >= INGEST_EMBED_BATCH_SIZE:
+                write(batch)
+                batch = []
+        stats.files_done += 1
+    if batch:
+        write(batch)
+
+    embeddings.store.flush()
+    lexical_index.save(lexical_index_path(persist_dir))
+    write_shard_manifest(persist_dir, vectorstore, redistributed=True)
+    stats.finish()
+    observe_stage("ingest", "total", stats.wall_seconds)
+    stats.report()
+    return vectorstore
+
 if __name__ == "__main__":
     print("Current working directory:", os.getcwd())
     pdf_dir = './data'
@@ -0,0 +1,39 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+from components.answer_cache import SemanticAnswerCache
+
+
+def test_answer_without_vector_is_found_by_query_text():
+    cache = SemanticAnswerCache()
+    cache.store("What is a Binary Search?", None, {"answer": "halving"})
+
+    assert cache.lookup_query("what is a  binary search?") == {"answer": "halving"}
+    assert cache.lookup_query("what is a heap?") is None
+    # Text-only entries never take part in the similarity search
+    assert cache.lookup([1.0, 0.0]) is None
+
+
+def test_answer_from_a_replaced_index_is_not_stored():
+    cache = SemanticAnswerCache(index_version="v1")
+    cache.invalidate("v2")
+
+    # Retrieved from v1 before the new index was published, finished afterwards
+    cache.store("what is a heap?", None, {"answer": "old"}, index_version="v1")
+
+    assert cache.lookup_query("what is a heap?") is None
+    assert cache.stats()["stale_stores"] == 1
+
+
+def test_stores_are_saved_later_in_one_write(tmp_path):
+    path = tmp_path / "answers.pkl"
+    cache = SemanticAnswerCache(persist_path=str(path), index_version="v1", save_delay=60)
+    cache.store("what is a heap?", None, {"answer": "a tree"})
+    cache.store("what is a stack?", None, {"answer": "LIFO"})
+    assert not path.exists()
+
+    cache.flush()
+
+    reloaded = SemanticAnswerCache(persist_path=str(path), index_version="v1")
+    assert reloaded.lookup_query("what is a stack?") == {"answer": "LIFO"}
@@ -0,0 +1,49 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+from components.context_builder import build_context
+
+# 1000 characters without repeated 20-character runs, so overlaps are found only where they are real
+PAGE = "".join(f"w{i:03d} " for i in range(200))
+
+
+def _chunk(start, end, offsets=False):
+    metadata = {"source": "notes.pdf", "page": 3}
+    if offsets:
+        metadata["start_index"] = start
+    return Document(page_content=PAGE[start:end], metadata=metadata)
+
+
+def test_shuffled_chunks_without_offsets_are_merged_once():
+    chunks = [_chunk(600, 1000), _chunk(0, 400), _chunk(300, 700)]
+
+    context, used = build_context(chunks, budget=1000)
+
+    assert context == PAGE
+    assert len(used) == 3
+
+
+def test_chunks_with_offsets_are_merged_in_page_order():
+    chunks = [_chunk(300, 700, True), _chunk(600, 1000, True), _chunk(0, 400, True)]
+
+    context, used = build_context(chunks, budget=1000)
+
+    assert context == PAGE
+    assert len(used) == 3
+
+
+def test_no_budget_adds_no_passage():
+    context, used = build_context([_chunk(0, 400)], budget=0)
+
+    assert context == ""
+    assert used == []
+
+
+def test_passage_over_budget_is_cut_at_a_word():
+    context, used = build_context([_chunk(0, 400)], budget=10)
+
+    assert context == "w000 w001 w002 w003 w004 w005 w006 w007 ..."
+    assert len(used) == 1
@@ -0,0 +1,66 @@
+import asyncio
+
+from components.embedding_batcher import QueryEmbeddingBatcher
+
+
+class FakeModel:
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+
+    async def embed_batch(self, texts):
+        self.calls.append(list(texts))
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+        return [[float(len(text))] for text in texts]
+
+
+def _embed_all(batcher, texts):
+    async def main():
+        return await asyncio.gather(*(batcher.embed(text) for text in texts))
+    return asyncio.run(main())
+
+
+def test_concurrent_queries_are_embedded_in_one_call():
+    model = FakeModel()
+    batcher = QueryEmbeddingBatcher(model.embed_batch, window=0.01)
+
+    vectors = _embed_all(batcher, ["heap", "binary search", "heap"])
+
+    # Identical texts are sent once and each caller gets its own text's vector
+    assert model.calls == [["heap", "binary search"]]
+    assert vectors == [[4.0], [13.0], [4.0]]
+    assert batcher.stats()["largest_batch"] == 2
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    model = FakeModel()
+    batcher = QueryEmbeddingBatcher(model.embed_batch, window=10.0, max_batch=2)
+
+    async def main():
+        return await asyncio.wait_for(asyncio.gather(batcher.embed("a"), batcher.embed("bb")), timeout=1)
+
+    assert asyncio.run(main()) == [[1.0], [2.0]]
+    assert model.calls == [["a", "bb"]]
+
+
+def test_failed_batch_fails_every_caller():
+    batcher = QueryEmbeddingBatcher(FakeModel(RuntimeError("quota exceeded")).embed_batch, window=0.01)
+
+    async def main():
+        return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(main())
+
+    assert [str(result) for result in results] == ["quota exceeded"] * 2
+    assert batcher.stats()["failed_batches"] == 1
+
+
+def test_zero_window_embeds_each_query_on_its_own():
+    model = FakeModel()
+    batcher = QueryEmbeddingBatcher(model.embed_batch, window=0)
+
+    _embed_all(batcher, ["a", "b"])
+
+    assert model.calls == [["a"], ["b"]]
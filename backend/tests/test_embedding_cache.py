@@ -0,0 +1,30 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_google_genai")
+
+from components.embedding_cache import EmbeddingStore
+
+
+def test_vectors_survive_a_reload(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many({"a": [1.0, 0.0], "b": [0.0, 1.0]})
+    store.flush()
+
+    assert EmbeddingStore(str(tmp_path)).get_many(["a", "b"]) == {"a": [1.0, 0.0], "b": [0.0, 1.0]}
+
+
+def test_slot_reused_after_the_last_index_save_is_a_miss(tmp_path):
+    store = EmbeddingStore(str(tmp_path), max_entries=2)
+    store.put_many({"a": [1.0, 0.0]})
+    store.put_many({"b": [0.0, 1.0]})
+    store.flush()
+    # Evicts "a" and writes "c" into its slot; the process dies before the index is saved again
+    store.put_many({"c": [0.5, 0.5]})
+    assert store.evictions == 1
+
+    reloaded = EmbeddingStore(str(tmp_path), max_entries=2)
+
+    assert reloaded.get_many(["a", "b"]) == {"b": [0.0, 1.0]}
+    reloaded.put_many({"d": [1.0, 1.0]})
+    assert reloaded.evictions == 0
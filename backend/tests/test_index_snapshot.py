@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+from components.index_snapshot import IndexSnapshot, SnapshotManager
+
+
+def test_older_snapshot_does_not_replace_a_newer_one(tmp_path):
+    manager = SnapshotManager(str(tmp_path / "chroma_db"))
+    newer = IndexSnapshot(2, str(tmp_path / "chroma_db@v0002"), None, None)
+    older = IndexSnapshot(1, str(tmp_path / "chroma_db@v0001"), None, None)
+
+    assert manager.publish(newer)
+    # A startup load of v1 finishing after an ingest published v2
+    assert not manager.publish(older)
+
+    assert manager.current() is newer
+    assert (tmp_path / "chroma_db.CURRENT").read_text() == "chroma_db@v0002"
+    assert manager.stats()["superseded"] == 1
+
+
+def test_stage_never_shares_files_chroma_writes_in_place(tmp_path):
+    pytest.importorskip("langchain_core")
+    source = tmp_path / "chroma_db"
+    source.mkdir()
+    (source / "chroma.sqlite3").write_bytes(b"sqlite")
+    (source / "processed_files.pkl").write_bytes(b"manifest")
+    manager = SnapshotManager(str(source))
+
+    version, staged = manager.stage()
+
+    assert version == 1
+    staged_db = os.path.join(staged, "chroma.sqlite3")
+    with open(staged_db, "r+b") as f:
+        f.write(b"SQLITE")
+    assert (source / "chroma.sqlite3").read_bytes() == b"sqlite"
+    # The manifest is replaced atomically, never written in place, so it is shared
+    assert os.path.samefile(os.path.join(staged, "processed_files.pkl"), source / "processed_files.pkl")
+    stats = manager.stats()["staging"]
+    assert stats["cloned_bytes"] + stats["copied_bytes"] == len(b"sqlite") + len(b"manifest")
+
+
+def test_discarded_staging_version_is_not_reused(tmp_path):
+    pytest.importorskip("langchain_core")
+    pytest.importorskip("langchain_chroma")
+    source = tmp_path / "chroma_db"
+    source.mkdir()
+    manager = SnapshotManager(str(source))
+
+    first_version, first_dir = manager.stage()
+    manager.discard(first_dir)
+    second_version, second_dir = manager.stage()
+
+    assert not os.path.exists(first_dir)
+    assert second_version == first_version + 1
+    assert second_dir != first_dir
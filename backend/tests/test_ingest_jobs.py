@@ -0,0 +1,72 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from components.ingest_jobs import IngestJobQueue
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def _stats(failed_files=()):
+    return SimpleNamespace(failed_files=list(failed_files), file_chunks={})
+
+
+def test_jobs_submitted_together_run_as_one_batch():
+    batches = []
+    queue = IngestJobQueue(lambda files, shards: batches.append(files) or _stats(), coalesce_window=0.2)
+
+    jobs = [queue.submit([f"/docs/{n}.pdf"]) for n in range(3)]
+    _wait_for(lambda: all(job.status == "done" for job in jobs))
+
+    assert batches == [["/docs/0.pdf", "/docs/1.pdf", "/docs/2.pdf"]]
+    assert {job.batch_id for job in jobs} == {1}
+
+
+def test_only_finished_jobs_are_evicted():
+    release = threading.Event()
+    queue = IngestJobQueue(lambda files, shards: release.wait(5) and _stats(), coalesce_window=0.01,
+                           max_batch_wait=0.05, max_jobs_kept=2)
+    first = queue.submit(["/docs/a.pdf"])
+    _wait_for(lambda: first.status == "running")
+    later = [queue.submit([f"/docs/{n}.pdf"]) for n in range(3)]
+
+    # Over the limit, but nothing has finished yet
+    assert all(queue.get(job.id) is job for job in [first] + later)
+
+    release.set()
+    _wait_for(lambda: all(job.status == "done" for job in later))
+    _wait_for(lambda: queue.get(later[0].id) is None)
+    assert queue.get(first.id) is None
+    assert queue.stats()["done"] == 2
+
+
+def test_finished_jobs_are_reported_with_their_failed_files():
+    finished = []
+    queue = IngestJobQueue(lambda files, shards: _stats(["/docs/b.pdf"]), coalesce_window=0.2,
+                           on_finished=lambda job: finished.append((job.status, job.failed_files)))
+
+    queue.submit(["/docs/a.pdf"])
+    queue.submit(["/docs/b.pdf"])
+    _wait_for(lambda: len(finished) == 2)
+
+    assert finished == [("done", []), ("failed", ["/docs/b.pdf"])]
+
+
+def test_failed_batch_fails_every_file_of_its_jobs():
+    finished = []
+
+    def run_batch(files, shards):
+        raise RuntimeError("disk full")
+
+    queue = IngestJobQueue(run_batch, coalesce_window=0.01, on_finished=lambda job: finished.append(job))
+    job = queue.submit(["/docs/a.pdf", "/docs/b.pdf"])
+    _wait_for(lambda: finished)
+
+    assert job.status == "failed"
+    assert job.error == "disk full"
+    assert job.failed_files == ["/docs/a.pdf", "/docs/b.pdf"]
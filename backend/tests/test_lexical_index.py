@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from langchain_core.documents import Document
+
+from components.lexical_index import BM25Index, load_or_build_lexical_index, reciprocal_rank_fusion
+
+CHUNKS = {
+    "c1": "Binary search halves a sorted array on every step",
+    "c2": "A heap is a tree where every parent is smaller than its children",
+    "c3": "The median is the middle value of a sorted sample",
+}
+
+
+def _index():
+    index = BM25Index()
+    index.add(list(CHUNKS), list(CHUNKS.values()), [{"source": f"{doc_id}.pdf"} for doc_id in CHUNKS])
+    return index
+
+
+def test_search_ranks_the_matching_chunk_first():
+    docs, confidence = _index().search("explain binary search", k=2)
+
+    assert docs[0].id == "c1"
+    assert docs[0].metadata["source"] == "c1.pdf"
+    assert confidence > 0.9
+
+
+def test_partial_match_is_less_confident():
+    index = _index()
+    _, full = index.search("binary search")
+    _, partial = index.search("binary search tree rotations")
+
+    assert partial < full
+
+
+def test_removed_and_replaced_chunks_are_not_found():
+    index = _index()
+    index.remove(["c2"])
+    index.add(["c1"], ["Linear search scans every element"])
+
+    assert index.search("heap")[0] == []
+    assert index.search("binary")[0] == []
+    assert [doc.id for doc in index.search("linear search")[0]] == ["c1"]
+    assert len(index) == 2
+
+
+def test_index_is_saved_next_to_the_persist_dir_and_loaded_back(tmp_path):
+    persist_dir = str(tmp_path / "chroma_db")
+    _index().save(persist_dir + ".bm25.gz")
+
+    loaded = load_or_build_lexical_index(persist_dir)
+
+    assert len(loaded) == 3
+    assert loaded.search("median")[0][0].id == "c3"
+
+
+def test_rrf_favours_documents_ranked_well_in_both_lists():
+    a, b, c = (Document(page_content=text) for text in ("a", "b", "c"))
+
+    fused = reciprocal_rank_fusion([[a, b, c], [b]], k=2)
+
+    assert [doc.page_content for doc in fused] == ["b", "a"]
@@ -0,0 +1,53 @@
+import asyncio
+
+from components.metrics import Counter, Histogram, Registry, server_timing, span, trace
+
+
+def test_spans_inside_a_trace_are_reported_as_server_timing():
+    async def speculate():
+        with span("speculative_search"):
+            await asyncio.sleep(0)
+
+    async def main():
+        with trace() as stages:
+            with span("refine"):
+                # Tasks started in the trace record into it too
+                await asyncio.create_task(speculate())
+            with span("retrieve"):
+                pass
+        return stages
+
+    stages = asyncio.run(main())
+
+    assert list(stages) == ["speculative_search", "refine", "retrieve"]
+    assert server_timing({"refine": 12.5, "retrieve": 3.0}) == "refine;dur=12.5, retrieve;dur=3.0"
+
+
+def test_span_outside_a_trace_only_feeds_the_histogram():
+    with trace() as stages:
+        pass
+    with span("embed"):
+        pass
+
+    assert stages == {}
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    calls = registry.register(Counter("llm_calls_total", "Chat model calls", ("purpose",)))
+    latency = registry.register(Histogram("stage_seconds", "Stage time", ("stage",), buckets=(0.1, 1.0)))
+    calls.inc(2, 'say "hi"')
+    latency.observe(0.5, "embed")
+    registry.add_collector(lambda: [("index_chunks", "gauge", "Chunks", {"shard": "dsa"}, 7)])
+    registry.add_collector(lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+
+    assert "# TYPE llm_calls_total counter" in lines
+    assert 'llm_calls_total{purpose="say \\"hi\\""} 2.0' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="0.1"} 0' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="1.0"} 1' in lines
+    assert 'stage_seconds_bucket{stage="embed",le="+Inf"} 1' in lines
+    assert 'stage_seconds_count{stage="embed"} 1' in lines
+    # A failing collector is skipped, the others are still reported
+    assert 'index_chunks{shard="dsa"} 7' in lines
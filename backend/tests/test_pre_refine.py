@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from components.pre_refine import OFF_TOPIC_REPLY, expand_abbreviations, pre_refine
+
+
+@pytest.mark.parametrize("query", [
+    "recommend some movies",
+    "any good jokes?",
+    "best recipes for dinner",
+    "suggest some songs",
+    "do you like coffee?",
+])
+def test_plural_and_singular_off_topic_queries_are_refused(query):
+    assert pre_refine(query) == (OFF_TOPIC_REPLY, "off_topic")
+
+
+def test_academic_query_mentioning_an_off_topic_word_is_not_refused():
+    query, route = pre_refine("probability of winning two games")
+    assert route != "off_topic"
+
+
+@pytest.mark.parametrize("query", [
+    "what is a match in regex",
+    "date handling in SQL",
+    "game theory basics",
+    "why do people love recursion",
+])
+def test_words_with_a_technical_sense_are_not_refused_locally(query):
+    assert pre_refine(query)[1] != "off_topic"
+
+
+@pytest.mark.parametrize("query, expanded", [
+    ("I'll need bfs notes", "I'll need breadth-first search notes"),
+    ("explain u-substitution", "explain u-substitution"),
+    ("dp vs greedy", "dynamic programming vs greedy"),
+    ("don't skip the ll chapter", "don't skip the linked list chapter"),
+    ("js-only examples", "js-only examples"),
+])
+def test_abbreviations_inside_contractions_and_hyphenated_words_are_kept(query, expanded):
+    assert expand_abbreviations(query) == expanded
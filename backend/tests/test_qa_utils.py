@@ -0,0 +1,143 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_google_genai")
+
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessageChunk
+
+# query_refine builds its Gemini client on import; nothing here calls it
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+
+from components import concurrency, qa_utils
+from components.subject_shards import ShardedVectorStore
+
+
+class FakeEmbeddings:
+    async def aembed_query(self, text):
+        return [1.0, 0.0]
+
+
+class FakeStore:
+    """Returns one document naming the store and the text searched"""
+
+    def __init__(self, name, fail=None):
+        self.name = name
+        self.fail = fail
+        self.embeddings = FakeEmbeddings()
+        self.searches = 0
+
+    def __len__(self):
+        return 1
+
+    async def amax_marginal_relevance_search_by_vector(self, embedding, k=4, **kwargs):
+        self.searches += 1
+        if self.fail is not None and self.searches == self.fail:
+            raise RuntimeError("search failed")
+        return [Document(page_content=f"{self.name} #{self.searches}", metadata={"source": self.name})]
+
+
+@pytest.fixture
+def llm_refine(monkeypatch):
+    """Refine every question through the (fake) LLM, to the text given per test"""
+    refined = {}
+
+    async def allm_refine(question, expanded):
+        return refined.get(question, question)
+
+    monkeypatch.setattr(qa_utils, "refine_locally", lambda question: (None, question))
+    monkeypatch.setattr(qa_utils, "allm_refine", allm_refine)
+    return refined
+
+
+def _retrieve(question, vectorstore):
+    return asyncio.run(qa_utils.aretrieve_context(question, vectorstore, speculative=True))
+
+
+def test_failed_speculation_falls_back_to_the_refined_search(llm_refine):
+    # The first search is the speculative one
+    store = FakeStore("notes", fail=1)
+
+    retrieved = _retrieve("what is a heap", store)
+
+    assert retrieved["timings"]["speculation"] == "failed"
+    assert [doc.page_content for doc in retrieved["docs"]] == ["notes #2"]
+
+
+def test_speculation_is_reused_only_for_the_same_shards(llm_refine):
+    llm_refine["how does it work"] = "how does a react component render the dom"
+    store = ShardedVectorStore({"dsa": FakeStore("dsa"), "webdev": FakeStore("webdev")})
+
+    same_route = _retrieve("react component dom render", store)
+    assert same_route["timings"]["speculation"] == "reused"
+
+    # The raw question matches no subject and was searched on every shard
+    other_route = _retrieve("how does it work", store)
+    assert other_route["timings"]["shards"] == ["webdev"]
+    assert other_route["timings"]["speculation"] == "merged"
+    assert other_route["docs"][0].page_content.startswith("webdev")
+
+
+class FakeChain:
+    """Streams the answer a few characters at a time"""
+
+    def __init__(self, answer, delay=0.0):
+        self.answer = answer
+        self.delay = delay
+
+    async def astream(self, inputs):
+        for start in range(0, len(self.answer), 4):
+            await asyncio.sleep(self.delay)
+            yield AIMessageChunk(content=self.answer[start:start + 4])
+
+
+@pytest.fixture
+def local_refine(monkeypatch):
+    monkeypatch.setattr(qa_utils, "refine_locally", lambda question: (question, question))
+
+
+def test_stream_sends_tokens_then_done_with_sources(local_refine):
+    async def main():
+        return [event async for event in qa_utils.astream_answer(FakeChain("halve the range"), "binary search",
+                                                                  FakeStore("notes"), speculative=False)]
+
+    events = asyncio.run(main())
+
+    assert [name for name, _ in events] == ["token"] * 4 + ["done"]
+    assert "".join(data["text"] for name, data in events if name == "token") == "halve the range"
+    done = events[-1][1]
+    assert done["sources"] == [{"source": "notes", "page": None}]
+    assert done["cached"] is False
+    assert "first_token_ms" in done["timings"]
+
+
+def test_llm_slot_is_released_before_a_slow_client_reads_the_answer(local_refine, monkeypatch):
+    monkeypatch.setattr(concurrency, "LLM_CONCURRENCY", 1)
+
+    async def main():
+        stream = qa_utils.astream_answer(FakeChain("halve the range"), "binary search", FakeStore("notes"),
+                                         speculative=False)
+        assert (await stream.__anext__())[0] == "token"
+        # The client has read one token; the whole answer is generated in the meantime
+        await asyncio.wait_for(concurrency.llm_slot().acquire(), timeout=1)
+        concurrency.llm_slot().release()
+        return [event async for event in stream]
+
+    assert asyncio.run(main())[-1][0] == "done"
+
+
+def test_client_disconnect_stops_the_generation_and_frees_the_slot(local_refine, monkeypatch):
+    monkeypatch.setattr(concurrency, "LLM_CONCURRENCY", 1)
+
+    async def main():
+        stream = qa_utils.astream_answer(FakeChain("halve the range " * 50, delay=0.01), "binary search",
+                                         FakeStore("notes"), speculative=False)
+        await stream.__anext__()
+        await stream.aclose()
+        await asyncio.wait_for(concurrency.llm_slot().acquire(), timeout=1)
+
+    asyncio.run(main())
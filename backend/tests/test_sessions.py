@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from components import sessions
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+        self.usage_metadata = None
+
+
+class FakeCondenseChain:
+    def __init__(self, reply):
+        self.reply = reply
+        self.calls = []
+
+    async def ainvoke(self, inputs):
+        self.calls.append(inputs)
+        return FakeResponse(self.reply)
+
+
+def test_follow_up_is_rewritten_with_the_conversation(monkeypatch):
+    chain = FakeCondenseChain("Give another example of binary search on a sorted array")
+    monkeypatch.setattr(sessions, "get_condense_chain", lambda: chain)
+    store = sessions.SessionStore(spill_dir=None)
+    session = store.get("s1")
+    session.record("What is binary search?", "Binary search halves a sorted array at every step.")
+
+    standalone = asyncio.run(store.condense(session, "Give another example of that"))
+
+    assert standalone == "Give another example of binary search on a sorted array"
+    assert "binary search" in chain.calls[0]["history"].lower()
+    assert chain.calls[0]["question"] == "Give another example of that"
+    assert store.stats()["condensed"] == 1
+
+
+def test_first_and_standalone_questions_are_not_rewritten(monkeypatch):
+    chain = FakeCondenseChain("unused")
+    monkeypatch.setattr(sessions, "get_condense_chain", lambda: chain)
+    store = sessions.SessionStore(spill_dir=None)
+    session = store.get("s2")
+
+    assert asyncio.run(store.condense(session, "Give an example")) == "Give an example"
+    session.record("What is binary search?", "Binary search halves a sorted array at every step.")
+    question = "Explain the time complexity of merge sort with a worked example"
+    assert asyncio.run(store.condense(session, question)) == question
+    assert chain.calls == []
@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from components.single_flight import SingleFlight
+
+
+def test_concurrent_identical_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+
+    async def answer():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "binary search halves the range"
+
+    async def main():
+        return await asyncio.gather(*(flights.run("q", answer) for _ in range(5)))
+
+    results = asyncio.run(main())
+
+    assert len(calls) == 1
+    assert [result for result, _ in results] == ["binary search halves the range"] * 5
+    assert sorted(coalesced for _, coalesced in results) == [False] + [True] * 4
+    assert flights.stats()["in_flight"] == 0
+
+
+def test_leader_disconnecting_does_not_cancel_the_shared_call():
+    flights = SingleFlight()
+
+    async def answer():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.run("q", answer))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.run("q", answer))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(main()) == ("done", True)
+
+
+def test_failure_reaches_every_caller_and_is_not_cached():
+    flights = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("LLM unavailable")
+
+    async def ok():
+        return "answer"
+
+    async def main():
+        results = await asyncio.gather(*(flights.run("q", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        return await flights.run("q", ok)
+
+    assert asyncio.run(main()) == ("answer", False)
+
+
+def test_stream_followers_replay_the_events_from_the_start():
+    flights = SingleFlight()
+    produced = []
+
+    async def tokens():
+        for token in ("a", "b", "c"):
+            produced.append(token)
+            yield token
+            await asyncio.sleep(0.01)
+
+    async def consume():
+        return [event async for event in flights.stream("q", tokens)]
+
+    async def main():
+        leader = asyncio.ensure_future(consume())
+        await asyncio.sleep(0.015)
+        # Joins after the first token was sent
+        return await asyncio.gather(leader, consume())
+
+    leader, follower = asyncio.run(main())
+
+    assert produced == ["a", "b", "c"]
+    assert leader == [("a", False), ("b", False), ("c", False)]
+    assert follower == [("a", True), ("b", True), ("c", True)]
+
+
+def test_stream_error_is_raised_to_followers():
+    flights = SingleFlight()
+
+    async def broken():
+        yield "a"
+        raise RuntimeError("stream broke")
+
+    async def main():
+        events = []
+        with pytest.raises(RuntimeError, match="stream broke"):
+            async for event in flights.stream("q", broken):
+                events.append(event)
+        return events
+
+    assert asyncio.run(main()) == [("a", False)]
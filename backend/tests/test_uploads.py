@@ -0,0 +1,63 @@
+import threading
+
+from components.uploads import UploadDeduplicator
+
+
+def _deduplicator(running_jobs=()):
+    return UploadDeduplicator(lambda: {}, lambda job_id: job_id in running_jobs)
+
+
+def test_only_one_of_two_concurrent_identical_uploads_is_reserved():
+    uploads = _deduplicator()
+    barrier = threading.Barrier(8)
+    results = []
+
+    def upload(n):
+        barrier.wait()
+        results.append(uploads.reserve("abc", f"/docs/copy{n}.pdf", index_key=1))
+
+    threads = [threading.Thread(target=upload, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(None) == 1
+    assert all(result["status"] == "pending" for result in results if result is not None)
+
+
+def test_released_and_finished_uploads_can_be_uploaded_again():
+    uploads = _deduplicator(running_jobs={"job-1"})
+    assert uploads.reserve("abc", "/docs/a.pdf", index_key=1) is None
+    uploads.release("abc")
+    assert uploads.reserve("abc", "/docs/a.pdf", index_key=1) is None
+    uploads.assign_job("abc", "job-1")
+    assert uploads.reserve("abc", "/docs/a.pdf", index_key=1)["job_id"] == "job-1"
+
+    uploads.assign_job("abc", "job-2")  # no longer running
+    assert uploads.reserve("abc", "/docs/a.pdf", index_key=1) is None
+
+
+def test_finished_job_marks_its_uploads_indexed():
+    uploads = _deduplicator(running_jobs={"job-1"})
+    uploads.reserve("abc", "/docs/a.pdf", index_key=1)
+    uploads.assign_job("abc", "job-1")
+
+    uploads.job_finished("job-1")
+
+    assert uploads.reserve("abc", "/docs/a.pdf", index_key=1) == {"document": "a.pdf", "status": "indexed"}
+    assert uploads.stats()["pending"] == 0
+
+
+def test_failed_job_releases_its_uploads():
+    uploads = _deduplicator(running_jobs={"job-1"})
+    uploads.reserve("abc", "/docs/a.pdf", index_key=1)
+    uploads.reserve("def", "/docs/b.pdf", index_key=1)
+    uploads.assign_job("abc", "job-1")
+    uploads.assign_job("def", "job-1")
+
+    uploads.job_finished("job-1", failed_files=["/docs/b.pdf"])
+
+    assert uploads.stats()["pending"] == 0
+    assert uploads.reserve("abc", "/docs/a.pdf", index_key=1)["status"] == "indexed"
+    assert uploads.reserve("def", "/docs/b.pdf", index_key=1) is None
@@ -0,0 +1,87 @@
+import pytest
+
+pytest.importorskip("chromadb")
+pytest.importorskip("langchain_chroma")
+
+from chromadb.api.client import SharedSystemClient
+from langchain_chroma import Chroma
+
+from components.subject_shards import ShardedVectorStore
+from components.vector_backends import MatrixVectorStore, close_vectorstore, export_chroma_to_matrix
+
+
+class NoEmbeddings:
+    def embed_documents(self, texts):
+        return [[0.0, 1.0] for _ in texts]
+
+    def embed_query(self, text):
+        return [0.0, 1.0]
+
+
+def test_close_stops_and_forgets_the_chroma_system(tmp_path):
+    store = Chroma(persist_directory=str(tmp_path), embedding_function=NoEmbeddings())
+    identifier = store._client._identifier
+    system = SharedSystemClient._identifier_to_system[identifier]
+
+    close_vectorstore(store)
+
+    assert identifier not in SharedSystemClient._identifier_to_system
+    assert not system._running
+
+
+def test_close_stops_the_shared_system_of_a_sharded_store_once(tmp_path):
+    shards = {name: Chroma(collection_name=f"subject_{name}", persist_directory=str(tmp_path),
+                           embedding_function=NoEmbeddings())
+              for name in ("dsa", "general")}
+    identifier = shards["dsa"]._client._identifier
+
+    close_vectorstore(ShardedVectorStore(shards))
+
+    assert identifier not in SharedSystemClient._identifier_to_system
+
+
+def test_matrix_store_cannot_be_built_from_texts():
+    with pytest.raises(TypeError, match="read-only"):
+        MatrixVectorStore.from_texts(["binary search"], NoEmbeddings())
+
+
+class TableEmbeddings:
+    VECTORS = {"binary search": [1.0, 0.0, 0.0], "heap": [0.0, 1.0, 0.0], "median": [0.0, 0.0, 2.0]}
+
+    def embed_documents(self, texts):
+        return [self.VECTORS[text] for text in texts]
+
+    def embed_query(self, text):
+        return self.VECTORS[text]
+
+
+def _export(tmp_path):
+    store = Chroma(persist_directory=str(tmp_path / "chroma"), embedding_function=TableEmbeddings())
+    store.add_texts(list(TableEmbeddings.VECTORS), metadatas=[{"subject": "dsa"}, {"subject": "dsa"},
+                                                              {"subject": "maths"}],
+                    ids=["c1", "c2", "c3"])
+    directory = export_chroma_to_matrix(store, str(tmp_path / "chroma.matrix"))
+    close_vectorstore(store)
+    return MatrixVectorStore(directory, TableEmbeddings(), use_hnsw=False)
+
+
+def test_matrix_export_answers_like_the_chroma_store(tmp_path):
+    matrix = _export(tmp_path)
+
+    assert len(matrix) == 3
+    assert matrix.similarity_search("heap", k=2)[0].id == "c2"
+    # The filter leaves only the dsa chunks, however dissimilar
+    assert {doc.id for doc in matrix.similarity_search("median", k=3, filter={"subject": "dsa"})} == {"c1", "c2"}
+    assert {doc.id for doc in matrix.max_marginal_relevance_search("binary search", k=3)} == {"c1", "c2", "c3"}
+
+
+def test_matrix_get_restores_the_original_embeddings(tmp_path):
+    matrix = _export(tmp_path)
+
+    data = matrix.get(ids=["c3"], include=["embeddings", "metadatas"])
+
+    assert data["ids"] == ["c3"]
+    assert data["metadatas"] == [{"subject": "maths"}]
+    assert list(data["embeddings"][0]) == [0.0, 0.0, 2.0]
+    with pytest.raises(TypeError, match="read-only"):
+        matrix.add_texts(["heap"])
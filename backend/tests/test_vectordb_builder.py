@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip("langchain_chroma")
+pytest.importorskip("langchain_community")
+
+from langchain_core.documents import Document
+
+from components import vectordb_builder
+from components.subject_shards import ShardedVectorStore
+
+
+class FakeCollection:
+    def __init__(self, store):
+        self.store = store
+
+    def upsert(self, ids, embeddings, documents, metadatas):
+        for chunk_id, document, metadata in zip(ids, documents, metadatas):
+            self.store.chunks[chunk_id] = (document, metadata)
+
+    def count(self):
+        return len(self.store.chunks)
+
+
+class FakeShard:
+    def __init__(self, chunks=None):
+        self.chunks = dict(chunks or {})
+        self._collection = FakeCollection(self)
+
+    def get(self, **kwargs):
+        return {"ids": list(self.chunks)}
+
+    def delete(self, ids):
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+
+
+class FakeLexicalIndex:
+    def remove(self, ids):
+        pass
+
+    def add(self, ids, texts, metadatas):
+        pass
+
+    def save(self, path):
+        pass
+
+
+class FakeEmbeddings:
+    store = type("Store", (), {"flush": lambda self: None})()
+
+    def embed_documents(self, texts):
+        return [[0.0] for _ in texts]
+
+
+def test_rebuild_shards_moves_reclassified_chunks(tmp_path, monkeypatch):
+    pdf_file = tmp_path / "notes.pdf"
+    pdf_file.write_bytes(b"%PDF")
+    chunks = [Document(page_content="binary search on a sorted array"),
+              Document(page_content="an array is a list of values")]
+    chunk_ids = vectordb_builder.assign_chunk_ids(chunks)
+    # Both chunks were in dsa; the new rules send the second one to general
+    store = ShardedVectorStore({
+        "dsa": FakeShard({chunk_id: None for chunk_id in chunk_ids}),
+        "general": FakeShard(),
+    })
+    monkeypatch.setattr(vectordb_builder, "get_embeddings", lambda: FakeEmbeddings())
+    monkeypatch.setattr(vectordb_builder, "open_ingest_store", lambda persist_dir, embeddings: store)
+    monkeypatch.setattr(vectordb_builder, "load_or_build_lexical_index", lambda *args: FakeLexicalIndex())
+    monkeypatch.setattr(vectordb_builder, "load_processed_files_info", lambda path: {str(pdf_file): {"hash": "h"}})
+    monkeypatch.setattr(vectordb_builder, "_parse_files",
+                        lambda files, hashes: iter([(str(pdf_file), chunks, {"load": 0.0}, None)]))
+    monkeypatch.setattr(vectordb_builder, "assign_shards", lambda texts: ["dsa", "general"])
+
+    manifest = str(tmp_path / "processed_files.pkl")
+    version = vectordb_builder.get_index_version(manifest)
+
+    vectordb_builder.rebuild_shards(["dsa"], str(tmp_path), manifest)
+
+    assert list(store.shards["dsa"].chunks) == [chunk_ids[0]]
+    assert list(store.shards["general"].chunks) == [chunk_ids[1]]
+    assert store.shards["general"].chunks[chunk_ids[1]][1]["shard"] == "general"
+    # Cached answers and coalesced requests of the old layout must not be reused
+    assert vectordb_builder.get_index_version(manifest) != version